@@ -0,0 +1,182 @@
+# app/change_layers.py
+import argparse
+import hashlib
+import os
+import pathlib as pl
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+
+from composites import CHANGE_DIR, composite_years, fingerprint, level_dir, load_grid, ndvi_path, on_grid
+
+# ΔNDVI change layers: compute, cache on disk, precompute in batches.
+#
+#   python app/change_layers.py --consecutive --workers 4
+#   python app/change_layers.py --pairs 2000:2020,2016:2024 --budget 1GB
+#
+# Cached files are named after the two source composites' fingerprints, so a
+# rebuilt composite never serves a stale Δ, and the cache directory is kept
+# under a disk budget by evicting the least recently used pairs. Δ layers of a
+# coarser pyramid level (`level`, in m) live in data/change/<level>m/.
+NODATA = -9999.0
+# Disk budget for data/change (e.g. "2GB"); least recently used pairs go first.
+CHANGE_BUDGET = os.getenv("CHANGE_BUDGET", "2GB")
+
+_locks = defaultdict(threading.Lock)  # one compute per pair at a time
+_locks_guard = threading.Lock()
+# Eviction runs one at a time and never removes a Δ that is being produced or
+# returned (_in_flight) or the one on screen (_displayed).
+_evict_lock = threading.Lock()
+_in_flight = Counter()
+_displayed = None
+
+def parse_size(text: str) -> int:
+    units = {"": 1, "B": 1, "KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
+    t = text.strip().upper()
+    num = t.rstrip("KMGTB")
+    return int(float(num) * units[t[len(num):]])
+
+def change_dir(level: int = None) -> pl.Path:
+    return CHANGE_DIR if not level else CHANGE_DIR / f"{level}m"
+
+def source_key(y1: int, y2: int, level: int = None) -> str:
+    src = level_dir(level)
+    stamp = f"{fingerprint(ndvi_path(y1, src))}|{fingerprint(ndvi_path(y2, src))}"
+    return hashlib.sha1(stamp.encode("utf-8")).hexdigest()[:12]
+
+def delta_path(y1: int, y2: int, level: int = None) -> pl.Path:
+    return change_dir(level) / f"ndvi_delta_{y1}_{y2}_{source_key(y1, y2, level)}.tif"
+
+def _delta_on_grid(p1: pl.Path, p2: pl.Path, part: pl.Path):
+    # Both composites share the pipeline's grid: plain pixel-aligned arithmetic.
+    import numpy as np
+    import rasterio
+
+    with rasterio.open(p1) as a, rasterio.open(p2) as b:
+        ndvi1 = a.read(1, masked=True).astype("float32")
+        ndvi2 = b.read(1, masked=True).astype("float32")
+        profile = {"driver": "COG", "dtype": "float32", "count": 1, "crs": a.crs, "transform": a.transform,
+                   "width": a.width, "height": a.height, "nodata": NODATA, "compress": "DEFLATE"}
+    delta = (ndvi2 - ndvi1).filled(np.nan)
+    delta[~np.isfinite(delta)] = NODATA
+    with rasterio.open(part, "w", **profile) as dst:
+        dst.write(delta, 1)
+
+def compute_delta(y1: int, y2: int, out: pl.Path, level: int = None) -> pl.Path:
+    """Compute ΔNDVI = NDVI(y2) - NDVI(y1), align grids, write COG atomically."""
+    part = out.with_name(out.name + ".part")
+    src = level_dir(level)
+    p1, p2 = ndvi_path(y1, src), ndvi_path(y2, src)
+    grid = load_grid(src)
+    if grid and on_grid(p1, grid) and on_grid(p2, grid):
+        _delta_on_grid(p1, p2, part)
+        os.replace(part, out)
+        return out
+
+    import rioxarray as rxr  # deferred: keeps the viewer's cold start light
+
+    ndvi1 = rxr.open_rasterio(str(p1)).squeeze()
+    ndvi2 = rxr.open_rasterio(str(p2)).squeeze()
+
+    if not (ndvi2.rio.crs == ndvi1.rio.crs and ndvi2.rio.transform() == ndvi1.rio.transform()):
+        ndvi2 = ndvi2.rio.reproject_match(ndvi1)
+
+    delta = (ndvi2 - ndvi1)
+    delta = delta.rio.write_nodata(NODATA, inplace=False).fillna(NODATA)
+    delta = delta.rio.write_crs(ndvi1.rio.crs, inplace=False)
+    delta.rio.to_raster(part, driver="COG", compress="DEFLATE")
+    os.replace(part, out)
+    return out
+
+def _drop_stale(y1: int, y2: int, keep: pl.Path):
+    # older fingerprints of the same pair, plus the pre-fingerprint file name
+    for p in list(keep.parent.glob(f"ndvi_delta_{y1}_{y2}_*.tif")) + [keep.parent / f"ndvi_delta_{y1}_{y2}.tif"]:
+        if p != keep and p.exists():
+            p.unlink(missing_ok=True)
+
+def ensure_delta(y1: int, y2: int, budget: int = None, level: int = None, display: bool = False) -> pl.Path:
+    """
+    Path to an up-to-date Δ layer for (y1, y2) at `level`, computing it if
+    needed. `display` marks it as the layer on screen, which eviction keeps.
+    """
+    global _displayed
+    change_dir(level).mkdir(parents=True, exist_ok=True)
+    out = delta_path(y1, y2, level)
+    with _evict_lock:
+        _in_flight[out] += 1
+        if display:
+            _displayed = out
+    try:
+        with _locks_guard:
+            lock = _locks[(y1, y2, level)]
+        with lock:
+            if out.exists():
+                os.utime(out)  # mark as recently used
+                return out
+            compute_delta(y1, y2, out, level)
+            _drop_stale(y1, y2, out)
+        enforce_budget(parse_size(CHANGE_BUDGET) if budget is None else budget, keep={out})
+        return out
+    finally:
+        with _evict_lock:
+            _in_flight[out] -= 1
+            if _in_flight[out] <= 0:
+                del _in_flight[out]
+
+def enforce_budget(max_bytes: int, keep=()) -> List[pl.Path]:
+    """
+    Delete least recently used Δ layers (all levels) until the directory fits
+    in `max_bytes`. Layers in `keep`, in flight or on screen are never deleted.
+    """
+    with _evict_lock:
+        keep = set(keep) | set(_in_flight) | ({_displayed} if _displayed else set())
+        files = []
+        for p in CHANGE_DIR.rglob("ndvi_delta_*.tif"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:  # replaced or dropped by another writer
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort(key=lambda f: f[0])
+        total = sum(size for _, size, _ in files)
+        evicted = []
+        for _, size, p in files:
+            if total <= max_bytes:
+                break
+            if p in keep:
+                continue
+            total -= size
+            p.unlink(missing_ok=True)
+            evicted.append(p)
+        return evicted
+
+def consecutive_pairs(years: Iterable[int]) -> List[Tuple[int, int]]:
+    ys = sorted(years)
+    return list(zip(ys[:-1], ys[1:]))
+
+def precompute(pairs: Iterable[Tuple[int, int]], workers: int = 4, budget: int = None) -> List[pl.Path]:
+    """Compute Δ layers for `pairs` in parallel; pairs already cached are skipped."""
+    pairs = list(dict.fromkeys(pairs))
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="delta") as pool:
+        return list(pool.map(lambda p: ensure_delta(*p, budget=budget), pairs))
+
+def main():
+    ap = argparse.ArgumentParser(description="Compute and cache ΔNDVI change layers.")
+    ap.add_argument("--pairs", default="", help="comma-separated FROM:TO year pairs")
+    ap.add_argument("--consecutive", action="store_true", help="all consecutive year pairs")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--budget", default=CHANGE_BUDGET, help="disk budget for data/change, e.g. 2GB")
+    args = ap.parse_args()
+
+    pairs = [tuple(map(int, p.split(":"))) for p in args.pairs.split(",") if p.strip()]
+    if args.consecutive:
+        pairs += consecutive_pairs(composite_years())
+    if not pairs:
+        ap.error("nothing to do: pass --pairs and/or --consecutive")
+
+    for p in precompute(pairs, workers=args.workers, budget=parse_size(args.budget)):
+        print(f"Ready {p}")
+
+if __name__ == "__main__":
+    main()
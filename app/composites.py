@@ -0,0 +1,74 @@
+# app/composites.py
+import json
+import os
+import pathlib as pl
+from typing import List
+
+# Shared locations and lookups for the viewer and its helpers.
+BASE_DIR = pl.Path(__file__).resolve().parents[1]
+COMP_DIR = pl.Path(os.getenv("COMP_DIR", BASE_DIR / "data" / "composites"))  # e.g. one batch AOI's directory
+CHANGE_DIR = BASE_DIR / "data" / "change"
+EVENTS_DIR = BASE_DIR / "data" / "events"
+AOI_PATH = BASE_DIR / "data" / "aoi" / "roi.geojson"
+
+def level_dir(level: int = None, comp_dir: pl.Path = COMP_DIR) -> pl.Path:
+    """Directory of a pyramid level (resolution in m, written by src/pyramid.py); None = full resolution."""
+    return comp_dir if not level else comp_dir / f"{level}m"
+
+def pyramid_levels(comp_dir: pl.Path = COMP_DIR) -> List[int]:
+    """Resolutions (m) of the coarser composite levels present, ascending."""
+    levels = []
+    for p in comp_dir.glob("*m"):
+        if p.is_dir() and p.name[:-1].isdigit() and any(p.glob("ndvi_median_*.tif")):
+            levels.append(int(p.name[:-1]))
+    return sorted(levels)
+
+def composite_years(comp_dir: pl.Path = COMP_DIR) -> List[int]:
+    tif_paths = list(comp_dir.glob("ndvi_median_*.tif")) + list(comp_dir.glob("ndvi_median_*.tiff"))
+    years = []
+    for p in tif_paths:
+        parts = p.stem.split("_")
+        if parts and parts[-1].isdigit():
+            years.append(int(parts[-1]))
+    return sorted(set(years))
+
+def ndvi_path(y: int, comp_dir: pl.Path = COMP_DIR) -> pl.Path:
+    tif = comp_dir / f"ndvi_median_{y}.tif"
+    if tif.exists():
+        return tif
+    tiff = comp_dir / f"ndvi_median_{y}.tiff"
+    if tiff.exists():
+        return tiff
+    raise FileNotFoundError(f"No composite found for year {y} in {comp_dir}")
+
+def fingerprint(path: pl.Path) -> str:
+    """Cheap content stamp (mtime + size); changes whenever a composite is rewritten."""
+    st = pl.Path(path).stat()
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+def load_grid(comp_dir: pl.Path = COMP_DIR):
+    """The pipeline's canonical grid (grid.json: epsg, transform, width, height), or None."""
+    try:
+        return json.loads((comp_dir / "grid.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+def on_grid(path: pl.Path, grid) -> bool:
+    """True if the raster at `path` sits exactly on `grid` (same CRS, transform and size)."""
+    import rasterio  # deferred: keeps the viewer's cold start light
+
+    if not grid:
+        return False
+    with rasterio.open(path) as src:
+        return (
+            src.crs is not None and src.crs.to_epsg() == grid["epsg"]
+            and all(abs(a - b) < 1e-6 for a, b in zip(src.transform, grid["transform"]))
+            and (src.width, src.height) == (grid["width"], grid["height"])
+        )
+
+def dir_stamp(path: pl.Path):
+    """Directory mtime; changes whenever a file in it is added, removed or atomically replaced."""
+    try:
+        return pl.Path(path).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
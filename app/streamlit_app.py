@@ -1,25 +1,72 @@
+import math
+import os
 import pathlib as pl
+import threading
+import time
+from contextlib import contextmanager
+from typing import Tuple
+
 import streamlit as st
-import leafmap.foliumap as leafmap
-import numpy as np
-import rioxarray as rxr
-import geopandas as gpd
-from typing import Tuple, List
+
+_T0 = time.perf_counter()
+_TIMINGS = []
+
+@contextmanager
+def timed(stage: str):
+    """Record how long a stage of this script run takes (shown in the Timing panel)."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _TIMINGS.append((stage, (time.perf_counter() - t) * 1000.0))
+
+# Heavy libraries load once per process: Python caches the modules, and
+# geopandas / rioxarray / leafmap are only imported inside the functions
+# that need them.
+with timed("imports"):
+    import numpy as np
+    import pandas as pd
+    import folium
+    from folium.plugins import Draw
+    from streamlit_folium import st_folium
+    import tiles
+    import change_layers
+    import timeseries
+    from composites import (AOI_PATH, CHANGE_DIR, COMP_DIR, EVENTS_DIR, composite_years,
+                            dir_stamp, fingerprint, level_dir, load_grid, ndvi_path, pyramid_levels)
 
 
 #Streamlit app for visualizing yearly NDVI composites and ΔNDVI change
 #over a user-supplied AOI. Composites are COGs written by search_download.py.
+#
+#Each widget interaction reruns this script. Discovery and the AOI view are
+#cached per process (invalidated by directory / file stamps), the base map
+#is identical on every run, and data layers travel in a feature group, so
+#st_folium only swaps the layers that changed instead of redrawing the map.
+#
+#With pyramid levels (PYRAMID_LEVELS in the pipeline) the map reports its
+#zoom, and layers, Δ and polygon statistics use the coarsest level that is
+#still finer than a screen pixel, so zoomed-out comparisons stay fast.
 
 
 # ---- Constants ----
 APP_TITLE = "Deforestation Viewer (1985–2024)"
-NODATA = -9999.0
+NODATA = change_layers.NODATA
 NDVI_CMAP = "RdYlGn"
 DELTA_CMAP = "coolwarm"
+EVENTS_CMAP = "plasma"
+MAGNITUDE_CMAP = "magma"
+BASEMAP_URL = "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
 DEFAULT_ZOOM = 10
+MAP_HEIGHT = 780
 SINGLE_OPACITY = 0.90
 CONTEXT_OPACITY = 0.65
 DELTA_OPACITY = 0.85
+NDVI_RANGE = (0.0, 1.0)
+# Serve layers as XYZ tiles from the in-process tile server (0 = leafmap add_raster)
+USE_TILE_SERVER = os.getenv("TILE_SERVER", "1") != "0"
+# Background Δ precompute at startup: "consecutive" (first→last + consecutive pairs) or "0"
+PRECOMPUTE_CHANGE = os.getenv("PRECOMPUTE_CHANGE", "consecutive").lower()
 
 # ---- Page setup ----
 st.set_page_config(layout="wide", page_title="Deforestation Viewer")
@@ -106,77 +153,72 @@ st.markdown(
 )
 
 # ---- Paths ----
-BASE_DIR = pl.Path(__file__).resolve().parents[1]
-COMP_DIR = BASE_DIR / "data" / "composites"
-CHANGE_DIR = BASE_DIR / "data" / "change"
 CHANGE_DIR.mkdir(parents=True, exist_ok=True)
 
+# ---- Per-process state ----
+@st.cache_resource(show_spinner=False)
+def _process_state() -> dict:
+    return {"started": time.time(), "runs": 0}
+
+_state = _process_state()
+_state["runs"] += 1
+
 # ---- Discovery ----
-def _composite_years() -> List[int]:
-    tif_paths = list(COMP_DIR.glob("ndvi_median_*.tif")) + list(COMP_DIR.glob("ndvi_median_*.tiff"))
-    years = []
-    for p in tif_paths:
-        parts = p.stem.split("_")
-        if parts and parts[-1].isdigit():
-            years.append(int(parts[-1]))
-    return sorted(set(years))
-
-years = _composite_years()
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _discover(stamp) -> Tuple[int, ...]:
+    """Composite years; re-globbed only when the directory stamp changes."""
+    return tuple(composite_years())
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _discover_levels(stamp) -> Tuple[int, Tuple[int, ...]]:
+    """(base resolution, coarser pyramid levels) in metres."""
+    return (load_grid() or {}).get("resolution", 30), tuple(pyramid_levels())
+
+with timed("discovery"):
+    years = list(_discover(dir_stamp(COMP_DIR)))
+    base_res, levels = _discover_levels(dir_stamp(COMP_DIR))
 if not years:
     st.warning("No composites found.")
     st.write(f"Looked in: `{COMP_DIR}`")
     st.stop()
 
-# ---- AOI centroid for sensible map start ----
-def _default_center() -> Tuple[float, float]:
+# ---- AOI view for a sensible map start ----
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _aoi_view(stamp, fallback: pl.Path):
+    """(center, [[south, west], [north, east]]) of the AOI, else of a composite."""
     try:
-        aoi = gpd.read_file(BASE_DIR / "data" / "aoi" / "roi.geojson")
-        c = aoi.geometry.centroid
-        return float(c.y.mean()), float(c.x.mean())
+        import geopandas as gpd
+
+        minx, miny, maxx, maxy = gpd.read_file(AOI_PATH).to_crs(4326).total_bounds
     except Exception:
-        return 0.0, 0.0
+        try:
+            minx, miny, maxx, maxy = tiles.layer_bounds(fallback)
+        except Exception:
+            return (0.0, 0.0), None
+    return ((miny + maxy) / 2, (minx + maxx) / 2), [[miny, minx], [maxy, maxx]]
 
-center = _default_center()
+with timed("aoi"):
+    center, bounds = _aoi_view(fingerprint(AOI_PATH) if AOI_PATH.exists() else None, ndvi_path(years[0]))
 
 # ---- Helpers ----
-def ndvi_path(y: int) -> pl.Path:
-    tif = COMP_DIR / f"ndvi_median_{y}.tif"
-    if tif.exists():
-        return tif
-    tiff = COMP_DIR / f"ndvi_median_{y}.tiff"
-    if tiff.exists():
-        return tiff
-    raise FileNotFoundError(f"No composite found for year {y} in {COMP_DIR}")
-
-@st.cache_data(show_spinner=False)
-def open_ndvi(y: int):
-    """Open a single-band NDVI COG and squeeze band dimension."""
-    p = ndvi_path(y)
-    da = rxr.open_rasterio(str(p)).squeeze()
-    return da
-
-@st.cache_data(show_spinner=False)
-def write_delta_tif(y1: int, y2: int) -> pl.Path:
-    """Compute ΔNDVI = NDVI(y2) - NDVI(y1), align grids, write cached COG."""
-    out = CHANGE_DIR / f"ndvi_delta_{y1}_{y2}.tif"
-    if out.exists():
-        return out
-
-    ndvi1 = open_ndvi(y1)
-    ndvi2 = open_ndvi(y2)
-
-    if not (ndvi2.rio.crs == ndvi1.rio.crs and ndvi2.rio.transform() == ndvi1.rio.transform()):
-        ndvi2 = ndvi2.rio.reproject_match(ndvi1)
-
-    delta = (ndvi2 - ndvi1)
-    delta = delta.rio.write_nodata(NODATA, inplace=False).fillna(NODATA)
-    delta = delta.rio.write_crs(ndvi1.rio.crs, inplace=False)
-    delta.rio.to_raster(out, driver="COG", compress="DEFLATE")
-    return out
-
+@st.cache_resource(show_spinner=False)
+def _precompute_changes(years_key: Tuple[int, ...]):
+    """Warm the Δ cache in the background once per process (default pair first)."""
+    pairs = [(years_key[0], years_key[-1])] + change_layers.consecutive_pairs(years_key)
+    t = threading.Thread(target=change_layers.precompute, args=(pairs,), kwargs={"workers": 2},
+                         name="delta-precompute", daemon=True)
+    t.start()
+    return t
+
+if PRECOMPUTE_CHANGE == "consecutive" and len(years) > 1:
+    _precompute_changes(tuple(years))
+
+# Δ paths carry the source composites' fingerprints, so memoizing on the path is safe.
 @st.cache_data(show_spinner=False)
 def robust_delta_range(delta_path: pl.Path) -> Tuple[float, float]:
     """Symmetric min/max from robust percentiles for stable diverging color scale."""
+    import rioxarray as rxr
+
     da = rxr.open_rasterio(str(delta_path)).squeeze()
     vals = da.values
     mask = np.isfinite(vals) & (vals != NODATA)
@@ -186,48 +228,164 @@ def robust_delta_range(delta_path: pl.Path) -> Tuple[float, float]:
         return (-mx, mx)
     return (-0.3, 0.3)
 
+@st.cache_resource(show_spinner=False)
+def _tile_server() -> str:
+    """Start the tile server once per process; returns its base URL."""
+    return tiles.start_server()
+
+@st.cache_data(show_spinner=False)
+def _legend_png(cmap: str, vmin: float, vmax: float) -> bytes:
+    ramp = np.tile(np.linspace(vmin, vmax, 256, dtype="float32"), (12, 1))
+    return tiles.encode_png(tiles.colorize(ramp, cmap, vmin, vmax))
+
+def legend(cmap: str, vmin: float, vmax: float, label: str):
+    """Colour ramp in the sidebar; kept off the map so changing it never redraws the map."""
+    st.sidebar.image(_legend_png(cmap, vmin, vmax), caption=f"{label}: {vmin:g} … {vmax:g}",
+                     use_container_width=True)
+
+def metres_per_pixel(zoom: float, lat: float) -> float:
+    """Ground size of one Web Mercator screen pixel."""
+    return 156543.03392 * math.cos(math.radians(lat)) / 2**zoom
+
+def pick_level(zoom, *needed_years):
+    """Coarsest pyramid level finer than a screen pixel that has every needed year; None = full resolution."""
+    if zoom is None:
+        return None
+    fits = [r for r in levels if r <= metres_per_pixel(zoom, center[0])]
+    for r in reversed(fits):
+        if all((level_dir(r) / f"ndvi_median_{y}.tif").exists() for y in needed_years):
+            return r
+    return None
+
+def base_map(draw: bool):
+    """The map without data layers; identical across reruns so st_folium keeps it mounted."""
+    if USE_TILE_SERVER:
+        m = folium.Map(location=center, zoom_start=DEFAULT_ZOOM, tiles=None, control_scale=True)
+        folium.TileLayer(BASEMAP_URL, attr="Esri", name="Esri.WorldImagery").add_to(m)
+    else:
+        import leafmap.foliumap as leafmap
+
+        m = leafmap.Map(center=center, zoom=DEFAULT_ZOOM, draw_control=False, measure_control=False)
+        m.add_basemap("Esri.WorldImagery")
+    if bounds:
+        m.fit_bounds(bounds)
+    if draw:
+        Draw(export=False, draw_options={"polyline": False, "circle": False, "marker": False,
+                                         "circlemarker": False}).add_to(m)
+    return m
+
+def add_layer(target, path: pl.Path, cmap: str, vmin: float, vmax: float, opacity: float, name: str):
+    """Add a raster layer, as server-rendered tiles or (fallback) a whole-file leafmap raster."""
+    if USE_TILE_SERVER:
+        url = tiles.tile_url(_tile_server(), tiles.register_layer(path, cmap, vmin, vmax))
+        folium.TileLayer(url, attr="NDVI composites", name=name, opacity=opacity, overlay=True).add_to(target)
+    else:
+        target.add_raster(str(path), cmap=cmap, vmin=vmin, vmax=vmax, opacity=opacity, layer_name=name)
+
 # ---- Sidebar UI ----
 st.sidebar.header("Controls")
-mode = st.sidebar.radio("Mode", ["View single year", "Compare change (ΔNDVI)"])
-m = leafmap.Map(center=center, zoom=DEFAULT_ZOOM, draw_control=False, measure_control=False)
-m.add_basemap("Esri.WorldImagery")
-
-if mode == "View single year":
-    year = st.sidebar.slider("Year", min_value=min(years), max_value=max(years), value=min(years), step=1)
-    raster_path = str(ndvi_path(year))
-    m.add_raster(raster_path, cmap=NDVI_CMAP, opacity=SINGLE_OPACITY, layer_name=f"NDVI {year}")
-    m.add_colormap(cmap=NDVI_CMAP, vmin=0.0, vmax=1.0, label=f"NDVI {year}")
-    try:
-        m.zoom_to_bounds(m.get_bounds(raster_path))
-    except Exception:
-        pass
-else:
-    y_from = st.sidebar.selectbox("From year", years, index=0)
-    y_to = st.sidebar.selectbox("To year", years, index=len(years) - 1)
-    st.caption(f"ΔNDVI = NDVI({y_to}) − NDVI({y_from})")
-
-    show_context = st.sidebar.checkbox(f"Show NDVI {y_to} under ΔNDVI", value=True)
-
-    delta_tif = write_delta_tif(y_from, y_to)
-    vmin, vmax = robust_delta_range(delta_tif)
-
-    if show_context:
-        base_raster = str(ndvi_path(y_to))
-        m.add_raster(base_raster, cmap=NDVI_CMAP, opacity=CONTEXT_OPACITY, layer_name=f"NDVI {y_to}")
-
-    m.add_raster(
-        str(delta_tif),
-        cmap=DELTA_CMAP,
-        vmin=vmin,
-        vmax=vmax,
-        opacity=DELTA_OPACITY,
-        layer_name=f"ΔNDVI {y_from}→{y_to}",
+mode = st.sidebar.radio("Mode", ["View single year", "Compare change (ΔNDVI)", "Deforestation events"])
+drill_down = st.sidebar.checkbox("Time-series drill-down", value=False,
+                                 help="Click the map for a pixel's NDVI history, or draw a polygon for per-year statistics.")
+adaptive = bool(levels) and st.sidebar.selectbox(
+    "Resolution", ["Auto (by zoom)", f"Full ({base_res} m)"],
+    help=f"Auto uses the {', '.join(f'{r} m' for r in levels)} levels when zoomed out.") != f"Full ({base_res} m)"
+# The zoom st_folium reported on the previous run (it keeps its value under its key).
+zoom = (st.session_state.get("map") or {}).get("zoom") if adaptive else None
+
+with timed("layers"):
+    m = base_map(drill_down)
+    # Data layers go in a feature group that st_folium swaps in place; the
+    # leafmap fallback adds them to the map itself (full redraw per change).
+    fg = folium.FeatureGroup(name="Layers")
+    target = fg if USE_TILE_SERVER else m
+
+    if mode == "View single year":
+        year = st.sidebar.slider("Year", min_value=min(years), max_value=max(years), value=min(years), step=1)
+        level = pick_level(zoom, year)
+        add_layer(target, ndvi_path(year, level_dir(level)), NDVI_CMAP, *NDVI_RANGE, SINGLE_OPACITY, f"NDVI {year}")
+        legend(NDVI_CMAP, *NDVI_RANGE, f"NDVI {year}")
+    elif mode == "Compare change (ΔNDVI)":
+        y_from = st.sidebar.selectbox("From year", years, index=0)
+        y_to = st.sidebar.selectbox("To year", years, index=len(years) - 1)
+        st.caption(f"ΔNDVI = NDVI({y_to}) − NDVI({y_from})")
+
+        show_context = st.sidebar.checkbox(f"Show NDVI {y_to} under ΔNDVI", value=True)
+
+        level = pick_level(zoom, y_from, y_to)
+        delta_tif = change_layers.ensure_delta(y_from, y_to, level=level, display=True)
+        vmin, vmax = robust_delta_range(delta_tif)
+
+        if show_context:
+            add_layer(target, ndvi_path(y_to, level_dir(level)), NDVI_CMAP, *NDVI_RANGE, CONTEXT_OPACITY, f"NDVI {y_to}")
+
+        add_layer(target, delta_tif, DELTA_CMAP, vmin, vmax, DELTA_OPACITY, f"ΔNDVI {y_from}→{y_to}")
+        legend(DELTA_CMAP, vmin, vmax, f"ΔNDVI {y_from}→{y_to}")
+    else:
+        level = None
+        cleared_tif = EVENTS_DIR / "cleared_year.tif"
+        if not cleared_tif.exists():
+            st.warning("No event layers yet. Run `python src/events.py` to detect deforestation events.")
+            st.stop()
+        show_magnitude = st.sidebar.checkbox("Show drop magnitude", value=False)
+        if show_magnitude:
+            add_layer(target, EVENTS_DIR / "drop_magnitude.tif", MAGNITUDE_CMAP, 0.0, 1.0, CONTEXT_OPACITY, "NDVI drop")
+        add_layer(target, cleared_tif, EVENTS_CMAP, min(years), max(years), DELTA_OPACITY, "Year cleared")
+        legend(EVENTS_CMAP, min(years), max(years), "Year cleared")
+
+def _events_panel():
+    summary = EVENTS_DIR / "summary.csv"
+    if not summary.exists():
+        return
+    df = pd.read_csv(summary)
+    st.subheader(f"Cleared area per year ({df['cleared_ha'].sum():,.0f} ha total)")
+    st.bar_chart(df.set_index("year")["cleared_ha"])
+
+if adaptive:
+    st.sidebar.caption(f"Showing {level or base_res} m data"
+                       + (f" at zoom {zoom:g}" if zoom is not None else " (zoom not reported yet)"))
+
+def _series_panel(map_state):
+    """NDVI time series for the last drawn polygon, else the last clicked point."""
+    map_state = map_state or {}
+    drawing = map_state.get("last_active_drawing") or {}
+    click = map_state.get("last_clicked")
+    geom = drawing.get("geometry") or {}
+    if geom.get("type") in ("Polygon", "MultiPolygon"):
+        level = pick_level(zoom, *years) if adaptive else None
+        df = timeseries.polygon_series(geom, level)
+        st.subheader("NDVI inside drawn polygon" + (f" ({level} m level)" if level else ""))
+        st.line_chart(df.set_index("year")[["mean", "median"]])
+        st.dataframe(df, hide_index=True, use_container_width=True)
+    elif click:
+        lat, lon = click["lat"], click["lng"]
+        df = timeseries.point_series(lon, lat)
+        st.subheader(f"NDVI at {lat:.5f}, {lon:.5f}")
+        st.line_chart(df.set_index("year")["ndvi"])
+    else:
+        st.info("Click the map for a pixel time series, or draw a polygon for per-year statistics.")
+
+def _timing_panel():
+    total = (time.perf_counter() - _T0) * 1000.0
+    run = "cold start" if _state["runs"] == 1 else f"rerun {_state['runs']}"
+    with st.sidebar.expander(f"Timing — {run}, {total:.0f} ms"):
+        df = pd.DataFrame(_TIMINGS + [("total", total)], columns=["stage", "ms"])
+        st.dataframe(df.round(1), hide_index=True, use_container_width=True)
+        st.caption(f"Process up {time.time() - _state['started']:.0f} s; browser tile loading not included.")
+
+# ---- Render ----
+with timed("render"):
+    # Without drill-down nothing is returned, so panning the map never triggers a rerun;
+    # with adaptive resolution only a zoom change does.
+    map_state = st_folium(
+        m, key="map", height=MAP_HEIGHT, use_container_width=True,
+        feature_group_to_add=fg if USE_TILE_SERVER else None,
+        layer_control=folium.LayerControl(collapsed=False),
+        returned_objects=(["last_clicked", "last_active_drawing"] if drill_down else []) + (["zoom"] if adaptive else []),
     )
-    m.add_colormap(cmap=DELTA_CMAP, vmin=vmin, vmax=vmax, label=f"ΔNDVI {y_from}→{y_to}")
-    try:
-        m.zoom_to_bounds(m.get_bounds(str(ndvi_path(y_to))))
-    except Exception:
-        pass
 
-m.add_layer_control()
-m.to_streamlit(height=780)
\ No newline at end of file
+if drill_down:
+    _series_panel(map_state)
+if mode == "Deforestation events":
+    _events_panel()
+_timing_panel()
@@ -0,0 +1,223 @@
+# app/tiles.py
+import hashlib
+import io
+import math
+import os
+import pathlib as pl
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import rasterio
+from affine import Affine
+from matplotlib import colormaps
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.errors import WindowError
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window
+
+# In-process XYZ tile server for the viewer. Tiles are cut from the COGs on
+# demand (reading the overview that matches the zoom), coloured server-side
+# and kept in a size-capped LRU cache, so the map only fetches what is visible.
+#
+# TILE_HOST / TILE_PORT: bind address (port 0 = any free port).
+# TILE_PUBLIC_URL: base URL the browser uses, if not http://localhost:<port>.
+# TILE_CACHE_MB: in-memory PNG cache size.
+# TILE_LAYERS: registered layers (and open rasters) kept; older ones are dropped and closed.
+TILE_HOST = os.getenv("TILE_HOST", "127.0.0.1")
+TILE_PORT = int(os.getenv("TILE_PORT", "0"))
+TILE_PUBLIC_URL = os.getenv("TILE_PUBLIC_URL", "").rstrip("/") or None
+TILE_CACHE_MB = int(os.getenv("TILE_CACHE_MB", "256"))
+TILE_LAYERS = int(os.getenv("TILE_LAYERS", "32"))
+TILE_SIZE = 256
+
+_WEB_MERCATOR = "EPSG:3857"
+_ORIGIN = 20037508.342789244
+_PATH_RE = re.compile(r"^/tiles/(\w+)/(\d+)/(\d+)/(\d+)\.png$")
+
+def tile_bounds(z: int, x: int, y: int):
+    """Web-Mercator bounds (minx, miny, maxx, maxy) of XYZ tile z/x/y."""
+    size = 2 * _ORIGIN / (1 << z)
+    minx = -_ORIGIN + x * size
+    maxy = _ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+def layer_bounds(path):
+    """Lon/lat bounds (minx, miny, maxx, maxy) of a raster, for zoom_to_bounds."""
+    with rasterio.open(path) as src:
+        return transform_bounds(src.crs, "EPSG:4326", *src.bounds, densify_pts=21)
+
+# ---- Rendering ----
+def read_tile(src, z, x, y):
+    """NDVI values for one tile as a float32 (256, 256) array, NaN where empty; None if off-raster."""
+    bounds = tile_bounds(z, x, y)
+    left, bottom, right, top = transform_bounds(_WEB_MERCATOR, src.crs, *bounds, densify_pts=21)
+    try:
+        win = src.window(left, bottom, right, top)
+        # Outward to whole pixels (Window.round_* dropped their `op` argument in rasterio 1.4).
+        col, row = math.floor(win.col_off), math.floor(win.row_off)
+        win = Window(col, row, math.ceil(win.col_off + win.width) - col, math.ceil(win.row_off + win.height) - row)
+        win = win.intersection(Window(0, 0, src.width, src.height))
+    except WindowError:
+        return None
+
+    # Decimated reads are served from the COG overviews; read just above tile resolution.
+    step = max(win.width / TILE_SIZE, win.height / TILE_SIZE, 1.0)
+    out_h, out_w = max(1, math.ceil(win.height / step)), max(1, math.ceil(win.width / step))
+    data = src.read(1, window=win, out_shape=(out_h, out_w), masked=True, resampling=Resampling.nearest)
+    data = data.astype("float32").filled(np.nan)
+    src_transform = src.window_transform(win) * Affine.scale(win.width / out_w, win.height / out_h)
+
+    tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype="float32")
+    reproject(
+        data, tile,
+        src_transform=src_transform, src_crs=src.crs, src_nodata=np.nan,
+        dst_transform=from_bounds(*bounds, TILE_SIZE, TILE_SIZE), dst_crs=_WEB_MERCATOR, dst_nodata=np.nan,
+        resampling=Resampling.nearest,
+    )
+    return tile
+
+def colorize(values, cmap, vmin, vmax):
+    """RGBA uint8 image; NaN becomes transparent."""
+    norm = np.clip((values - vmin) / (vmax - vmin), 0.0, 1.0)
+    rgba = colormaps[cmap](np.nan_to_num(norm), bytes=True)
+    rgba[~np.isfinite(values)] = 0
+    return rgba
+
+def encode_png(rgba):
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, "PNG", compress_level=1)
+    return buf.getvalue()
+
+_EMPTY_PNG = None
+
+def empty_png():
+    global _EMPTY_PNG
+    if _EMPTY_PNG is None:
+        _EMPTY_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+    return _EMPTY_PNG
+
+class TileCache:
+    """Thread-safe LRU of encoded tiles, capped by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            png = self._items.get(key)
+            if png is not None:
+                self._items.move_to_end(key)
+            return png
+
+    def put(self, key, png):
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = png
+            self._bytes += len(png)
+            while self._bytes > self.max_bytes and self._items:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= len(old)
+
+# ---- Layers ----
+# Both registries are LRUs capped at TILE_LAYERS, so switching years and layers
+# in the viewer doesn't grow them (or the open file handles) without bound.
+_layers = OrderedDict()    # layer id -> (raster key, cmap, vmin, vmax)
+_datasets = OrderedDict()  # raster key (path|mtime) -> (open dataset, lock)
+_registry_lock = threading.Lock()
+_cache = TileCache(TILE_CACHE_MB * 2**20)
+
+def register_layer(path, cmap, vmin, vmax) -> str:
+    """
+    Register a raster + style and return its layer id. The id includes the
+    file's mtime, so a rebuilt composite gets new URLs (and fresh tiles).
+    """
+    path = pl.Path(path)
+    stamp = path.stat().st_mtime_ns
+    raster = f"{path.resolve()}|{stamp}"
+    key = f"{raster}|{cmap}|{float(vmin):.6g}|{float(vmax):.6g}"
+    layer_id = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    with _registry_lock:
+        _layers[layer_id] = (raster, cmap, float(vmin), float(vmax))
+        _layers.move_to_end(layer_id)
+        while len(_layers) > TILE_LAYERS:
+            _layers.popitem(last=False)
+    return layer_id
+
+def has_layer(layer_id) -> bool:
+    with _registry_lock:
+        return layer_id in _layers
+
+def _dataset(raster):
+    """(open dataset, lock) for a raster key, opening it on first use and closing the least recent."""
+    with _registry_lock:
+        hit = _datasets.get(raster)
+        if hit is None:
+            hit = _datasets[raster] = (rasterio.open(raster.rsplit("|", 1)[0]), threading.Lock())
+            evicted = [_datasets.popitem(last=False)[1] for _ in range(max(0, len(_datasets) - TILE_LAYERS))]
+        else:
+            _datasets.move_to_end(raster)
+            evicted = []
+    for src, lock in evicted:
+        with lock:  # wait for a read in progress
+            src.close()
+    return hit
+
+def render(layer_id, z, x, y):
+    key = (layer_id, z, x, y)
+    png = _cache.get(key)
+    if png is None:
+        with _registry_lock:
+            raster, cmap, vmin, vmax = _layers[layer_id]
+        while True:
+            # One open handle per raster; rasterio datasets aren't thread-safe, so reads take its lock.
+            src, lock = _dataset(raster)
+            with lock:
+                if src.closed:  # evicted between lookup and read; reopen
+                    continue
+                values = read_tile(src, z, x, y)
+            break
+        png = empty_png() if values is None else encode_png(colorize(values, cmap, vmin, vmax))
+        _cache.put(key, png)
+    return png
+
+# ---- HTTP ----
+class _TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        m = _PATH_RE.match(self.path.split("?", 1)[0])
+        if not m or not has_layer(m.group(1)):
+            self.send_error(404)
+            return
+        try:
+            png = render(m.group(1), *map(int, m.groups()[1:]))
+        except Exception as e:  # one bad tile shouldn't kill the server thread
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(png)))
+        self.send_header("Cache-Control", "public, max-age=86400")  # URLs change when data does
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(png)
+
+    def log_message(self, *args):
+        pass
+
+def start_server(host=TILE_HOST, port=TILE_PORT) -> str:
+    """Start the tile server on a daemon thread; returns the base URL browsers should use."""
+    server = ThreadingHTTPServer((host, port), _TileHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="tile-server", daemon=True).start()
+    return TILE_PUBLIC_URL or f"http://localhost:{server.server_address[1]}"
+
+def tile_url(base_url, layer_id) -> str:
+    return f"{base_url}/tiles/{layer_id}/{{z}}/{{x}}/{{y}}.png"
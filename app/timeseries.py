@@ -0,0 +1,135 @@
+# app/timeseries.py
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import rasterio
+from affine import Affine
+from pyproj import Transformer
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask
+from rasterio.windows import Window, from_bounds
+from shapely.geometry import mapping, shape
+from shapely.ops import transform as shp_transform
+
+from composites import composite_years, fingerprint, level_dir, ndvi_path
+
+# Per-pixel and per-polygon NDVI time series over all yearly composites.
+# Every read is a window limited to the geometry's bounding box, and the grid
+# of each file (CRS, transform, size, nodata) comes from a small index cached
+# in memory and in data/composites/grid_index.json, refreshed per file when
+# its fingerprint changes. Polygon statistics can run on a coarser pyramid
+# level (`level`, in m), which keeps them fast over large polygons.
+INDEX_NAME = "grid_index.json"
+QUERY_THREADS = int(os.getenv("QUERY_THREADS", "8"))
+
+_index = {}  # level -> {year: entry}
+_index_lock = threading.Lock()
+
+def _header(path):
+    with rasterio.open(path) as src:
+        return {
+            "crs": src.crs.to_wkt(),
+            "transform": list(src.transform)[:6],
+            "width": src.width,
+            "height": src.height,
+            "nodata": None if src.nodata is None else float(src.nodata),
+        }
+
+def grid_index(level: int = None) -> dict:
+    """{year: {path, stamp, crs, transform, width, height, nodata}} for every composite at `level`."""
+    comp_dir = level_dir(level)
+    index_path = comp_dir / INDEX_NAME
+    with _index_lock:
+        index = _index.get(level)
+        if index is None:
+            try:
+                index = {int(k): v for k, v in json.loads(index_path.read_text()).items()}
+            except (OSError, ValueError):
+                index = {}
+        fresh, changed = {}, False
+        for y in composite_years(comp_dir):
+            path = ndvi_path(y, comp_dir)
+            stamp = fingerprint(path)
+            entry = index.get(y)
+            if not entry or entry["stamp"] != stamp or entry["path"] != str(path):
+                entry = {"path": str(path), "stamp": stamp, **_header(path)}
+                changed = True
+            fresh[y] = entry
+        changed |= fresh.keys() != index.keys()
+        _index[level] = fresh
+        if changed:
+            try:
+                index_path.write_text(json.dumps(fresh, indent=1))
+            except OSError:
+                pass  # read-only data dir: the in-memory index still works
+        return fresh
+
+@lru_cache(maxsize=32)
+def _to_crs(crs_wkt):
+    return Transformer.from_crs("EPSG:4326", crs_wkt, always_xy=True)
+
+def _run(fn, entries):
+    with ThreadPoolExecutor(max_workers=QUERY_THREADS) as pool:
+        return list(pool.map(fn, entries))
+
+def _clean(values, nodata):
+    values = values.astype("float64")
+    if nodata is not None and not np.isnan(nodata):
+        values[values == nodata] = np.nan
+    return values
+
+# ---- Queries ----
+def point_series(lon: float, lat: float) -> pd.DataFrame:
+    """NDVI at one lon/lat for every year (NaN where masked or outside the raster)."""
+    def _read(item):
+        year, g = item
+        x, y = _to_crs(g["crs"]).transform(lon, lat)
+        col, row = ~Affine(*g["transform"]) * (x, y)
+        col, row = int(np.floor(col)), int(np.floor(row))
+        if not (0 <= col < g["width"] and 0 <= row < g["height"]):
+            return year, np.nan
+        with rasterio.open(g["path"]) as src:
+            v = src.read(1, window=Window(col, row, 1, 1))
+        return year, float(_clean(v, g["nodata"])[0, 0])
+
+    rows = _run(_read, sorted(grid_index().items()))
+    return pd.DataFrame(rows, columns=["year", "ndvi"])
+
+def polygon_series(geometry, level: int = None) -> pd.DataFrame:
+    """
+    Per-year statistics of NDVI inside a GeoJSON polygon (EPSG:4326):
+    mean, median, valid pixel count and total pixels inside the polygon,
+    from the composites at pyramid `level` (None = full resolution).
+    """
+    geom = shape(geometry)
+
+    def _read(item):
+        year, g = item
+        local = shp_transform(_to_crs(g["crs"]).transform, geom)
+        transform = Affine(*g["transform"])
+        empty = (year, np.nan, np.nan, 0, 0)
+        try:
+            win = from_bounds(*local.bounds, transform=transform)
+            # Outward to whole pixels (Window.round_* dropped their `op` argument in rasterio 1.4).
+            col, row = math.floor(win.col_off), math.floor(win.row_off)
+            win = Window(col, row, math.ceil(win.col_off + win.width) - col, math.ceil(win.row_off + win.height) - row)
+            win = win.intersection(Window(0, 0, g["width"], g["height"]))
+        except WindowError:
+            return empty
+        with rasterio.open(g["path"]) as src:
+            data = _clean(src.read(1, window=win), g["nodata"])
+            inside = geometry_mask([mapping(local)], out_shape=data.shape,
+                                   transform=src.window_transform(win), invert=True)
+        vals = data[inside & np.isfinite(data)]
+        if not vals.size:
+            return (year, np.nan, np.nan, 0, int(inside.sum()))
+        return (year, float(vals.mean()), float(np.median(vals)), int(vals.size), int(inside.sum()))
+
+    rows = _run(_read, sorted(grid_index(level).items()))
+    return pd.DataFrame(rows, columns=["year", "mean", "median", "valid_px", "total_px"])
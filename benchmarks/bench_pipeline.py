@@ -0,0 +1,270 @@
+# benchmarks/bench_pipeline.py
+"""
+Benchmarks for the composite pipeline on synthetic scenes.
+
+    python benchmarks/bench_pipeline.py --sizes 512,2048 --scenes 8,32
+    python benchmarks/bench_pipeline.py --baseline benchmarks/results/bench_<rev>.json
+
+Each case reports wall time (best of --repeat), peak RSS above the starting
+point, and throughput in pixels/sec. Results are saved as JSON together with
+the git revision, so runs from two versions can be compared with --baseline.
+"""
+import argparse
+import json
+import os
+import pathlib as pl
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = pl.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+# search_items reads its catalog and cache settings at import: point them at
+# a throwaway directory of canned item JSON so nothing touches the network.
+_ITEMS_DIR = pl.Path(tempfile.mkdtemp(prefix="bench_items_"))
+os.environ["STAC_CATALOG"] = str(_ITEMS_DIR)
+os.environ["STAC_CACHE_DIR"] = "none"
+
+import numpy as np
+import dask
+import rasterio
+import xarray as xr
+
+import search_download as sd
+import chip_reader
+import scene_plan
+import reducers
+from cog_writer import write_cog
+from ndvi import REDUCERS, composite_ndvi_mixed, compute_ndvi_mixed, mask_clouds_mixed
+from synthetic import make_items, make_stack, write_items, write_scenes
+
+sd._progress.unregister()  # keep dask progress bars out of the timings
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def measure(fn, repeat):
+    """Best wall time over `repeat` runs and the peak RSS increase seen in any run."""
+    best, peak = float("inf"), 0
+    for _ in range(repeat):
+        with sd.track_peak_rss(interval=0.05) as rss:
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        peak = max(peak, rss["peak"] - rss["start"])
+    return best, peak
+
+def _masked_ndvi(red, nir, qa, cfg):
+    ndvi = compute_ndvi_mixed(red, nir, cfg).where((red != 0) & (nir != 0))
+    return mask_clouds_mixed(qa, ndvi, cfg)
+
+def check_fused(kind, size=256, scenes=6):
+    """{reducer: ok} for the fused kernel against the separate xarray steps, at float32 tolerance."""
+    red, nir, qa, cfg = make_stack(kind, size, scenes, seed=1)
+    ndvi = _masked_ndvi(red, nir, qa, cfg)
+    checks = {}
+    for reducer in REDUCERS:
+        ref = sd.reduce_ndvi_over_time(ndvi, reducer).astype("float32").values
+        got = composite_ndvi_mixed(red, nir, qa, cfg, reducer).values
+        try:
+            np.testing.assert_allclose(got, ref, rtol=2 * np.finfo(np.float32).eps, atol=0, equal_nan=True)
+            checks[reducer] = True
+            print(f"check fused {kind}/{reducer}: ok")
+        except AssertionError as e:
+            checks[reducer] = False
+            print(f"check fused {kind}/{reducer}: MISMATCH{str(e).rstrip()}")
+    return checks
+
+def bench_stack(kind, size, scenes, repeat, results):
+    red, nir, qa, cfg = make_stack(kind, size, scenes, chunk=sd.CHUNK_SIZE)
+    red, nir, qa = (a.persist() for a in (red, nir, qa))
+    pixels = size * size * scenes
+    case = {"dataset": kind, "size": size, "scenes": scenes}
+
+    def record(name, fn, n=pixels, **extra):
+        wall, peak = measure(fn, repeat)
+        results.append({
+            "name": name, "case": case | extra, "wall_s": wall,
+            "peak_rss_mib": peak / 2**20, "pixels_per_s": n / wall if wall else None,
+        })
+        print(f"{name:<24} {kind:<8} {size:>5}px x{scenes:<3} {' '.join(map(str, extra.values())):<8}"
+              f"{wall:8.3f}s {peak / 2**20:8.1f} MiB {n / wall / 1e6:8.1f} Mpx/s")
+
+    record("compute_ndvi_mixed", lambda: compute_ndvi_mixed(red, nir, cfg).compute())
+    ndvi = compute_ndvi_mixed(red, nir, cfg).persist()
+    record("mask_clouds_mixed", lambda: mask_clouds_mixed(qa, ndvi, cfg).compute())
+
+    masked = _masked_ndvi(red, nir, qa, cfg).persist()
+    for reducer in REDUCERS:
+        record("reduce_ndvi_over_time", lambda: sd.reduce_ndvi_over_time(masked, reducer).compute(), reducer=reducer)
+        record("composite_fused", lambda: composite_ndvi_mixed(red, nir, qa, cfg, reducer).compute(), reducer=reducer)
+        record("stream_reduce", lambda: reducers.stream_reduce(masked, reducer)[0].compute(), reducer=reducer)
+
+    composite = composite_ndvi_mixed(red, nir, qa, cfg, "max").compute()
+    composite = composite.rio.write_crs(red.rio.crs).rio.write_transform(red.rio.transform())
+    with tempfile.TemporaryDirectory() as tmp:
+        out = pl.Path(tmp) / "bench.tif"
+        record("write_cog", lambda: write_cog(composite, out), n=size * size)
+
+# Scene origin on the 30 m pixel lattice (a multiple of the resolution), so the
+# chip grid lines up with the source pixels instead of resampling them.
+_X0 = 499_980.0
+
+class _ResigningCatalog:
+    # Stand-in for stac_cache: items start with a dead href ("expired"); a
+    # forced re-sign hands back the real one.
+    def __init__(self, good):
+        self.good = {it.id: it for it in good}
+
+    def sign(self, items, force=False):
+        return [self.good[it.id] if force else it for it in items]
+
+def check_chips(kind, size=512, scenes=4):
+    """Chip reads must match the source rasters, survive a dead href and hit the cache on re-read."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pl.Path(tmp)
+        items = write_scenes(root, kind, size, scenes, seed=2, origin=(_X0, 9_000_000.0))
+        expired = []
+        for it in items:
+            bad = it.clone()
+            for a in bad.assets.values():
+                a.href = str(root / "expired" / pl.Path(a.href).name)
+            expired.append(bad)
+        reader = chip_reader.ChipReader(_ResigningCatalog(items), chip_reader.ChipCache(root / "chips", 1024),
+                                        backoff=0.0, prefetch=2)
+        chip_reader._readers[id(reader.catalog)] = reader
+        bounds = (_X0, 9_000_000.0 - 30.0 * size, _X0 + 30.0 * size, 9_000_000.0)
+        stack = lambda: chip_reader.chip_stack(expired, ["red", "nir", "qa"], 32721, bounds, 30, 256,
+                                               catalog=reader.catalog).values
+        first = stack()
+        with rasterio.open(items[0].assets["nir"].href) as src:
+            ref = src.read(1)
+        ok = np.array_equal(first[0, 1], ref) and reader.stats["resigned"] > 0
+        reads = reader.stats["reads"]
+        ok &= np.array_equal(stack(), first) and reader.stats["reads"] == reads
+        print(f"check chips {kind}: {'ok' if ok else 'MISMATCH'} ({reader.stats})")
+        return ok
+
+def bench_chips(kind, size, scenes, repeat, results):
+    """Cold (source reads into an empty cache) vs warm (cache only) chip stacks."""
+    case = {"dataset": kind, "size": size, "scenes": scenes}
+    bounds = (_X0, 9_000_000.0 - 30.0 * size, _X0 + 30.0 * size, 9_000_000.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pl.Path(tmp)
+        items = write_scenes(root, kind, size, scenes, origin=(_X0, 9_000_000.0))
+        for name, fresh in (("chip_stack_cold", True), ("chip_stack_warm", False)):
+            def run():
+                if fresh:
+                    chip_reader._readers.clear()
+                    chip_reader._readers[id(None)] = chip_reader.ChipReader(
+                        cache=chip_reader.ChipCache(root / f"chips_{time.perf_counter_ns()}"), prefetch=0)
+                chip_reader.chip_stack(items, ["red", "nir", "qa"], 32721, bounds, 30, sd.CHUNK_SIZE).compute()
+            wall, peak = measure(run, repeat)
+            n = size * size * scenes * 3
+            results.append({"name": name, "case": case, "wall_s": wall,
+                            "peak_rss_mib": peak / 2**20, "pixels_per_s": n / wall if wall else None})
+            print(f"{name:<24} {kind:<8} {size:>5}px x{scenes:<3}         {wall:8.3f}s {peak / 2**20:8.1f} MiB")
+    chip_reader._readers.clear()
+
+def bench_search(kind, tiles, days, repeat, results):
+    fc = make_items(kind, tiles, days)
+    path = write_items(_ITEMS_DIR / f"{kind}_{tiles}x{days}.json", fc)
+    catalog = sd.stac_cache.get_catalog(sd.CATALOG)
+    catalog._client = None  # reload the directory with the new file
+    cfg = sd.DATASETS["S2" if kind == "s2" else "L89"]
+    aoi = {"features": [{"geometry": fc["features"][0]["geometry"]}]}
+    n = len(fc["features"])
+    case = {"dataset": kind, "tiles": tiles, "days": days, "items": n}
+
+    items = catalog.search(cfg["collection"], aoi["features"][0]["geometry"], "2020-01-01", "2020-12-31")
+    steps = {
+        "scene_plan.select": lambda: scene_plan.select_scenes(scene_plan.items_table(items, cfg["mask"]), sd.DAY_GAP),
+        "search_items": lambda: sd.search_items(aoi, "2020-01-01", "2020-12-31", max_cloud=sd.MAX_CLOUD, cfg=cfg),
+    }
+    for name, fn in steps.items():
+        wall, peak = measure(fn, repeat)
+        results.append({"name": name, "case": case, "wall_s": wall,
+                        "peak_rss_mib": peak / 2**20, "items_per_s": n / wall if wall else None})
+        print(f"{name:<24} {kind:<8} {n:>6} items      {wall:8.3f}s {peak / 2**20:8.1f} MiB")
+    path.unlink()
+
+def compare(results, baseline_path, tolerance):
+    """Print time ratios against a saved run; return the cases slower than `tolerance`."""
+    base = json.loads(pl.Path(baseline_path).read_text())
+    key = lambda r: (r["name"], json.dumps(r["case"], sort_keys=True))
+    prev = {key(r): r for r in base["results"]}
+    slower = []
+    print(f"\nvs {baseline_path} ({base['meta'].get('git_rev')}):")
+    for r in results:
+        old = prev.get(key(r))
+        if not old:
+            continue
+        ratio = r["wall_s"] / old["wall_s"] if old["wall_s"] else float("inf")
+        flag = "  << slower" if ratio > tolerance else ""
+        print(f"  {r['name']:<24} {json.dumps(r['case'], sort_keys=True):<70} x{ratio:5.2f}{flag}")
+        if flag:
+            slower.append(r)
+    return slower
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="512,2048", help="AOI edge lengths in pixels")
+    ap.add_argument("--scenes", default="8,32", help="scenes per stack")
+    ap.add_argument("--datasets", default="landsat,s2")
+    ap.add_argument("--items", default="4x60,25x120", help="search cases as TILESxDAYS")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default=None, help="results JSON (default benchmarks/results/bench_<rev>.json)")
+    ap.add_argument("--baseline", default=None, help="earlier results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=1.2, help="slowdown ratio flagged as a regression")
+    args = ap.parse_args()
+
+    kinds = args.datasets.split(",")
+    # A fused mismatch is reported (and saved with the results) but doesn't stop the timings.
+    fused = {k: check_fused(k) for k in kinds}
+    if not all(check_chips(k) for k in kinds):
+        sys.exit("Chip reader does not reproduce the source rasters.")
+
+    results = []
+    for kind in kinds:
+        for size in map(int, args.sizes.split(",")):
+            for scenes in map(int, args.scenes.split(",")):
+                bench_stack(kind, size, scenes, args.repeat, results)
+                bench_chips(kind, size, scenes, args.repeat, results)
+        for spec in args.items.split(","):
+            tiles, days = map(int, spec.split("x"))
+            bench_search(kind, tiles, days, args.repeat, results)
+
+    rev = _git_rev()
+    meta = {
+        "git_rev": rev,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "dask": dask.__version__,
+        "xarray": xr.__version__,
+        "cpus": os.cpu_count(),
+        "dask_threads": sd.DASK_THREADS,
+        "chunk_size": sd.CHUNK_SIZE,
+        "fused_matches_xarray": fused,
+    }
+    out = pl.Path(args.out or ROOT / "benchmarks" / "results" / f"bench_{rev}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"meta": meta, "results": results}, indent=1))
+    print(f"\nSaved {out}")
+    off = [f"{k}/{r}" for k, checks in fused.items() for r, ok in checks.items() if not ok]
+    if off:
+        print(f"Fused composite differs from the xarray steps beyond float32 tolerance: {', '.join(off)}")
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# benchmarks/synthetic.py
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import dask.array as da
+import pystac
+import rasterio
+import xarray as xr
+from rasterio.transform import from_origin
+from rasterio.warp import transform_geom
+from shapely.geometry import box, mapping, shape
+
+# Synthetic Landsat / Sentinel-2 stacks with realistic QA distributions, plus
+# canned STAC item JSON for exercising search_items() offline and on-disk
+# scenes standing in for remote assets.
+
+# Landsat Collection 2 QA_PIXEL values and how often each shows up per scene.
+LANDSAT_QA = {
+    21824: 0.58,  # clear land
+    21952: 0.08,  # water
+    22280: 0.14,  # high-confidence cloud
+    23888: 0.07,  # cloud shadow
+    30048: 0.02,  # snow
+    55052: 0.06,  # cirrus + cloud (L8/9)
+    1: 0.05,      # fill
+}
+# Sentinel-2 SCL classes and frequencies.
+S2_SCL = {4: 0.45, 5: 0.10, 6: 0.05, 3: 0.05, 7: 0.03, 8: 0.10, 9: 0.10, 10: 0.05, 11: 0.02, 0: 0.05}
+
+DATASETS = {
+    "landsat": {"scale": 2.75e-05, "offset": -0.2, "mask": "landsat", "qa": LANDSAT_QA},
+    "s2": {"scale": 1.0 / 10000.0, "offset": 0.0, "mask": "s2", "qa": S2_SCL},
+}
+
+def _blocky_classes(rng, values, probs, shape, block=32):
+    # Clouds and water come in patches, not salt-and-pepper: draw classes on a
+    # coarse grid and upsample.
+    coarse = (-(-shape[0] // block), -(-shape[1] // block))
+    cls = rng.choice(values, size=coarse, p=probs)
+    return np.repeat(np.repeat(cls, block, 0), block, 1)[: shape[0], : shape[1]]
+
+def _scene(rng, kind, size):
+    cfg = DATASETS[kind]
+    values = np.array(list(cfg["qa"]), dtype=np.uint16)
+    probs = np.array(list(cfg["qa"].values()), dtype=np.float64)
+    qa = _blocky_classes(rng, values, probs / probs.sum(), (size, size))
+
+    red_refl = rng.uniform(0.02, 0.12, (size, size))
+    nir_refl = rng.uniform(0.15, 0.45, (size, size))
+    to_dn = lambda r: np.clip((r - cfg["offset"]) / cfg["scale"], 1, 65535).astype(np.uint16)
+    red, nir = to_dn(red_refl), to_dn(nir_refl)
+
+    fill = (qa == 1) if kind == "landsat" else (qa == 0)
+    red[fill] = 0
+    nir[fill] = 0
+    return red, nir, qa
+
+def make_stack(kind, size, scenes, chunk=1024, seed=0):
+    """
+    (red, nir, qa) DataArrays with dims (time, y, x), native uint16 and chunked
+    like the pipeline (time=1, chunk² spatial), plus the dataset cfg.
+    """
+    rng = np.random.default_rng(seed)
+    bands = [_scene(rng, kind, size) for _ in range(scenes)]
+    times = [np.datetime64("2020-01-01") + np.timedelta64(8 * i, "D") for i in range(scenes)]
+    res = 30.0
+    coords = {
+        "time": times,
+        "y": 9_000_000.0 - res * (np.arange(size) + 0.5),
+        "x": 500_000.0 + res * (np.arange(size) + 0.5),
+    }
+    out = []
+    for b in range(3):
+        data = da.from_array(np.stack([s[b] for s in bands]), chunks=(1, chunk, chunk))
+        arr = xr.DataArray(data, dims=("time", "y", "x"), coords=coords)
+        arr = arr.rio.write_crs(32721).rio.write_transform(from_origin(500_000.0, 9_000_000.0, res, res))
+        out.append(arr)
+    cfg = {k: v for k, v in DATASETS[kind].items() if k != "qa"}
+    return (*out, cfg)
+
+def make_items(kind, tiles, days, per_day=2, year=2020, seed=0):
+    """
+    FeatureCollection of STAC items over `tiles` tiles and `days` acquisition
+    days, with `per_day` duplicate acquisitions per tile/day at random cloud
+    cover (what search_items has to de-duplicate).
+    """
+    rng = np.random.default_rng(seed)
+    collection = "sentinel-2-l2a" if kind == "s2" else "landsat-c2-l2"
+    geom = {"type": "Polygon", "coordinates": [[[-56, -10], [-54, -10], [-54, -8], [-56, -8], [-56, -10]]]}
+    start = datetime(year, 1, 1, 13, 30, tzinfo=timezone.utc)
+    feats = []
+    for t in range(tiles):
+        for d in range(days):
+            for k in range(per_day):
+                when = start + timedelta(days=d, minutes=k)
+                props = {
+                    "datetime": when.isoformat().replace("+00:00", "Z"),
+                    "eo:cloud_cover": float(rng.uniform(0, 100)),
+                    "platform": "sentinel-2a" if kind == "s2" else "landsat-8",
+                }
+                if kind == "s2":
+                    props["s2:mgrs_tile"] = f"21L{chr(65 + t % 26)}{chr(65 + t // 26)}"
+                else:
+                    props["landsat:wrs_path"] = f"{226 + t % 5:03d}"
+                    props["landsat:wrs_row"] = f"{66 + t // 5:03d}"
+                feats.append({
+                    "type": "Feature",
+                    "stac_version": "1.0.0",
+                    "id": f"{kind}_{t}_{d}_{k}",
+                    "collection": collection,
+                    "geometry": geom,
+                    "bbox": [-56, -10, -54, -8],
+                    "properties": props,
+                    "links": [],
+                    "assets": {"red": {"href": f"/data/{kind}_{t}_{d}_{k}_red.tif"}},
+                })
+    return {"type": "FeatureCollection", "features": feats}
+
+def write_items(path, fc):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(fc))
+    return path
+
+def write_scenes(root, kind, size, scenes, seed=0, origin=(500_000.0, 9_000_000.0)):
+    """
+    Synthetic scenes as red/nir/qa GeoTIFFs under `root`, and pystac Items
+    whose asset hrefs point at them: a local stand-in for signed remote assets.
+    `origin` is the top-left corner; put it on a multiple of 30 m to match the
+    30 m grids stackstac builds.
+    """
+    rng = np.random.default_rng(seed)
+    x0, y0 = origin
+    crs, transform = "EPSG:32721", from_origin(x0, y0, 30.0, 30.0)
+    footprint = transform_geom(crs, "EPSG:4326", mapping(box(x0, y0 - 30.0 * size, x0 + 30.0 * size, y0)))
+    start = datetime(2020, 1, 1, 13, 30, tzinfo=timezone.utc)
+    items = []
+    for i in range(scenes):
+        item = pystac.Item(f"{kind}_scene_{i}", footprint, list(shape(footprint).bounds),
+                           start + timedelta(days=8 * i), properties={})
+        for name, band in zip(("red", "nir", "qa"), _scene(rng, kind, size)):
+            path = root / f"{item.id}_{name}.tif"
+            with rasterio.open(path, "w", driver="GTiff", width=size, height=size, count=1, dtype="uint16",
+                               crs=crs, transform=transform, tiled=True, blockxsize=256, blockysize=256) as dst:
+                dst.write(band, 1)
+            item.add_asset(name, pystac.Asset(href=str(path)))
+        items.append(item)
+    return items
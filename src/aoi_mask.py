@@ -0,0 +1,58 @@
+# src/aoi_mask.py
+import os
+
+import numpy as np
+import dask.array as da
+import xarray as xr
+from rasterio.features import geometry_mask
+
+# Polygon-aware reads. The AOI is rasterized once onto the stack's grid;
+# spatial chunks holding no AOI pixel are swapped for constant fill blocks
+# before anything is computed, so dask culls their remote reads, and pixels
+# outside the polygon are written as NoData.
+#
+# AOI_CLIP: 1 (default) clip to the polygon, 0 read the whole bounding box.
+AOI_CLIP = os.getenv("AOI_CLIP", "1") != "0"
+
+def grid_mask(aoi_gdf, crs, transform, shape) -> np.ndarray:
+    """Boolean (y, x) mask of the AOI on a grid, True inside (all-touched)."""
+    return geometry_mask(aoi_gdf.to_crs(crs).geometry, out_shape=shape, transform=transform,
+                         all_touched=True, invert=True)
+
+def rasterize(aoi_gdf, arr) -> xr.DataArray:
+    """grid_mask() on `arr`'s grid, as a DataArray sharing its y/x coords."""
+    transform = arr.attrs.get("transform") or arr.rio.transform()
+    inside = grid_mask(aoi_gdf, arr.rio.crs, transform, (arr.sizes["y"], arr.sizes["x"]))
+    return xr.DataArray(inside, dims=("y", "x"), coords={"y": arr["y"], "x": arr["x"]})
+
+def _offsets(chunks):
+    return np.concatenate([[0], np.cumsum(chunks)])
+
+def cull_chunks(stack: xr.DataArray, inside: xr.DataArray, fill_value=0):
+    """
+    `stack` (..., y, x) with every spatial chunk that misses the AOI replaced
+    by `fill_value`. Returns (stack, kept, total) chunk counts.
+    """
+    data = stack.data
+    if not isinstance(data, da.Array):
+        return stack, None, None
+    ychunks, xchunks = data.chunks[-2], data.chunks[-1]
+    yoff, xoff = _offsets(ychunks), _offsets(xchunks)
+    mask = inside.values
+    lead = (slice(None),) * (data.ndim - 2)
+
+    rows, kept = [], 0
+    for iy, h in enumerate(ychunks):
+        row = []
+        for ix, w in enumerate(xchunks):
+            if mask[yoff[iy]:yoff[iy + 1], xoff[ix]:xoff[ix + 1]].any():
+                row.append(data.blocks[lead + (iy, ix)])
+                kept += 1
+            else:
+                shape = data.shape[:-2] + (h, w)
+                row.append(da.full(shape, fill_value, dtype=data.dtype, chunks=data.chunks[:-2] + ((h,), (w,))))
+        rows.append(row)
+    total = len(ychunks) * len(xchunks)
+    if kept == total:
+        return stack, kept, total
+    return stack.copy(data=da.block(rows)), kept, total
@@ -0,0 +1,211 @@
+# src/batch_aoi.py
+import argparse
+import json
+import os
+import pathlib as pl
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+from shapely.geometry import mapping, shape
+from shapely.ops import unary_union
+
+import grid
+import manifest
+import scene_plan
+import search_download as sd
+import tiling
+from cog_writer import write_cogs
+
+# Batch mode for many AOIs (e.g. concession polygons) in one file:
+#
+#   python src/batch_aoi.py data/aoi/concessions.geojson --years 2000-2024
+#
+# Per year there is one STAC search over all AOIs. AOIs that share a scene
+# tile (WRS path/row or MGRS) and lie within BATCH_LINK_M of each other form a
+# group; each group gets one stack, so every scene window is read and masked
+# once, and every member's composite is cut from it and written in the same
+# compute pass to <out>/<aoi_id>/ndvi_median_<year>.tif.
+#
+# All AOIs share one output CRS (OUTPUT_CRS, or the UTM zone of the whole
+# set), and each keeps its own grid.json on that CRS's pixel lattice, so a
+# member's composite is a plain crop of its group's and lines up every year.
+#
+# AOI_ID_FIELD: property naming each AOI (falls back to "name", then the row index).
+# BATCH_LINK_M: max gap between AOIs sharing a stack; larger gaps read the
+#               empty ground between them, so keep it near the chunk size.
+AOI_ID_FIELD = os.getenv("AOI_ID_FIELD", "id")
+BATCH_LINK_M = float(os.getenv("BATCH_LINK_M", "5000"))
+
+# ---- AOIs ----
+def _safe_id(value) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(value)).strip("_") or "aoi"
+
+def load_aois(path, id_field=AOI_ID_FIELD) -> gpd.GeoDataFrame:
+    """Every feature as its own AOI, in EPSG:4326, indexed by a filesystem-safe id."""
+    gdf = gpd.read_file(path).to_crs(epsg=4326)
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    field = id_field if id_field in gdf else ("name" if "name" in gdf else None)
+    ids = gdf[field].map(_safe_id) if field else [f"aoi_{i:03d}" for i in range(len(gdf))]
+    gdf = gdf.assign(aoi_id=list(ids))
+    dupes = gdf["aoi_id"][gdf["aoi_id"].duplicated()].unique()
+    if len(dupes):
+        raise ValueError(f"Duplicate AOI ids in {path}: {sorted(dupes)}")
+    return gdf.set_index("aoi_id")[["geometry"]]
+
+def search_geojson(aois: gpd.GeoDataFrame) -> dict:
+    """One search geometry covering all AOIs (the hull keeps the STAC request small)."""
+    hull = unary_union(list(aois.geometry)).convex_hull
+    return {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}, "geometry": mapping(hull)}]}
+
+def aoi_geojson(aois: gpd.GeoDataFrame, aoi_id: str) -> dict:
+    return json.loads(aois.loc[[aoi_id]].to_json())
+
+# ---- Grouping ----
+def group_aois(aois: gpd.GeoDataFrame, table, link_m=BATCH_LINK_M):
+    """
+    Split AOIs into groups that share one stack: AOIs are linked when they
+    intersect a common scene tile and are at most `link_m` apart. Returns
+    [(aoi_ids, items)], each group with the items touching any member.
+    """
+    footprints = {tile: unary_union([shape(it.geometry) for it in rows["item"]])
+                  for tile, rows in table.groupby("tile")}
+    ids = list(aois.index)
+    tiles = {a: {t for t, fp in footprints.items() if fp.intersects(aois.geometry[a])} for a in ids}
+    metric = aois.geometry.to_crs(aois.estimate_utm_crs())
+
+    parent = {a: a for a in ids}
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    for i, a in enumerate(ids):
+        for b in ids[i + 1:]:
+            if tiles[a] & tiles[b] and metric[a].distance(metric[b]) <= link_m:
+                parent[find(a)] = find(b)
+
+    members = {}
+    for a in ids:
+        if tiles[a]:
+            members.setdefault(find(a), []).append(a)
+        else:
+            print(f"[{a}] No scenes intersect this AOI.")
+
+    groups = []
+    for group in members.values():
+        area = unary_union([aois.geometry[a] for a in group])
+        items = [it for it in table["item"] if shape(it.geometry).intersects(area)]
+        groups.append((group, items))
+    return groups
+
+def aoi_item_ids(items, geometry_4326) -> list:
+    """Ids of the items whose footprint touches this AOI: its own inputs, whatever group it is in."""
+    return [it.id for it in items if shape(it.geometry).intersects(geometry_4326)]
+
+# ---- Build ----
+def clip_to_aoi(ndvi, geometry_4326, aoi_grid):
+    """Lazy crop of a group composite onto one AOI's grid, NaN outside its polygon."""
+    sub = grid.snap(ndvi, aoi_grid)
+    geom = gpd.GeoSeries([geometry_4326], crs=4326).to_crs(sub.rio.crs)
+    return sub.rio.clip(geom.geometry, geom.crs, all_touched=True, drop=False, from_disk=False)
+
+def group_bounds(grids):
+    """Bounds covering every member grid (all on one lattice, so the union is too)."""
+    b = [grid.bounds(g) for g in grids]
+    return min(v[0] for v in b), min(v[1] for v in b), max(v[2] for v in b), max(v[3] for v in b)
+
+def build_group(plan, aois, group, outdirs, grids):
+    """One shared stack for `group`; writes every member's COG in a single pass."""
+    y = plan["year"]
+    gdf = aois.loc[group]
+    epsg = grids[group[0]]["epsg"]
+    ndvi = sd.composite_for_year(plan, gdf, epsg=epsg, bounds=group_bounds([grids[a] for a in group]))
+    if ndvi is None:
+        return {}
+    cuts = {a: clip_to_aoi(ndvi, aois.geometry[a], grids[a]) for a in group}
+    paths = {a: outdirs[a] / f"ndvi_median_{y}.tif" for a in group}
+    print(f"[{y}] Writing {len(group)} AOI composite(s) from one stack: {', '.join(group)}")
+    with sd.track_peak_rss() as rss:
+        write_cogs(
+            [cuts[a].data for a in group], [paths[a] for a in group],
+            ndvi.rio.crs, [grid.affine(grids[a]) for a in group],
+        )
+    print(f"[{y}] Peak RSS {rss['peak'] / 2**20:.0f} MiB")
+    return paths
+
+def run_batch(years, aois: gpd.GeoDataFrame, outroot, link_m=BATCH_LINK_M):
+    """Build every AOI's composites for `years`; returns {aoi_id: {year: path}}."""
+    outroot = pl.Path(outroot)
+    outdirs = {a: outroot / a for a in aois.index}
+    for d in outdirs.values():
+        d.mkdir(parents=True, exist_ok=True)
+    built = {a: manifest.load_manifest(outdirs[a]) for a in aois.index}
+    digests = {a: manifest.aoi_hash(aoi_geojson(aois, a)) for a in aois.index}
+    epsg = tiling.output_epsg(aois)
+    grids = {a: grid.ensure_grid(outdirs[a], aois.loc[[a]], digests[a], resolution=30, epsg=epsg)
+             for a in aois.index}
+    params = sd.build_params()
+    query = search_geojson(aois)
+    written, failed = {a: {} for a in aois.index}, []
+
+    years = list(years)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="stac-search") as searcher:
+        # Search the next year while this one computes.
+        pending = searcher.submit(sd.plan_year, years[0], query) if years else None
+        for i, y in enumerate(years):
+            plan = pending.result()
+            pending = searcher.submit(sd.plan_year, years[i + 1], query) if i + 1 < len(years) else None
+            if plan is None:
+                continue
+            table = scene_plan.items_table(plan["items"], plan["cfg"]["mask"])
+            for group, items in group_aois(aois, table, link_m):
+                # Each AOI is fingerprinted by its own scenes, so a change that only
+                # touches a neighbour (or regrouping) doesn't rebuild it.
+                entries = {a: manifest.year_entry(digests[a], params, plan["dataset"],
+                                                  aoi_item_ids(items, aois.geometry[a]))
+                           for a in group}
+                stale = [a for a in group if sd.FORCE_REBUILD or not manifest.is_current(
+                    built[a], y, entries[a], outdirs[a] / f"ndvi_median_{y}.tif")]
+                if not stale:
+                    print(f"[{y}] {', '.join(group)}: composites are current (manifest); skipping.")
+                    continue
+                try:
+                    paths = build_group(plan | {"items": items}, aois, stale, outdirs, grids)
+                except Exception as e:
+                    print(f"[{y}] Failed for {', '.join(stale)}: {e!r}")
+                    failed.append((y, tuple(stale)))
+                    continue
+                for a, path in paths.items():
+                    written[a][y] = path
+                    manifest.record(built[a], y, entries[a])
+                    manifest.save_manifest(outdirs[a], built[a])
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} group-year(s) failed: {failed}")
+    return written
+
+def parse_years(text: str):
+    years = []
+    for part in text.split(","):
+        lo, _, hi = part.strip().partition("-")
+        years.extend(range(int(lo), int(hi or lo) + 1))
+    return sorted(set(years))
+
+def main():
+    ap = argparse.ArgumentParser(description="Composites for many AOIs with shared scene reads.")
+    ap.add_argument("aois", help="multi-feature AOI file (GeoJSON, GPKG, …)")
+    ap.add_argument("--years", default="1985-2024", help="e.g. 2000-2024 or 2016,2020")
+    ap.add_argument("--out", default="data/composites", help="per-AOI subdirectories are created here")
+    ap.add_argument("--id-field", default=AOI_ID_FIELD)
+    ap.add_argument("--link-m", type=float, default=BATCH_LINK_M)
+    args = ap.parse_args()
+
+    aois = load_aois(args.aois, args.id_field)
+    print(f"Batch: {len(aois)} AOIs from {args.aois}")
+    run_batch(parse_years(args.years), aois, args.out, link_m=args.link_m)
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
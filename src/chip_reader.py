@@ -0,0 +1,303 @@
+# src/chip_reader.py
+import hashlib
+import os
+import pathlib as pl
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import dask.array as da
+import rasterio
+import xarray as xr
+from dask.base import tokenize
+from dask.highlevelgraph import HighLevelGraph
+from rasterio.enums import Resampling
+from rasterio.errors import RasterioIOError
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_geom
+from rasterio.windows import Window, bounds as window_bounds
+from shapely.geometry import box, shape
+
+import aoi_mask
+import tiling
+
+# Alternative to stackstac for the red/nir/qa stack (READER=chips). Every
+# block of the stack is one "chip": one asset of one scene, warped onto one
+# CHUNK_SIZE² window of the output grid. Chips are
+#
+#   - read with bounded retries and exponential backoff; a rejected read
+#     re-signs the item (stac_cache) before the next attempt, and an item
+#     whose token is about to expire is re-signed before reading;
+#   - prefetched by a thread pool as soon as the stack is built, in the order
+#     the composite consumes them, so downloads overlap with compute;
+#   - cached on disk under a content address (scene, asset, unsigned href and
+#     grid window), LRU-trimmed to CHIP_CACHE_MB. Re-running a year, or
+#     changing only the reducer, reads everything from the cache.
+#
+# Hrefs may be local paths or file:// / http(s):// URLs, so a directory of
+# item JSON (STAC_CATALOG) plus local rasters or a local HTTP server stands in
+# for the Planetary Computer.
+#
+# CHIP_CACHE_DIR: chip cache ("none" disables it, and prefetching with it).
+# CHIP_CACHE_MB: cache size cap. CHIP_PREFETCH: prefetch threads (0 = off).
+# CHIP_RETRIES / CHIP_BACKOFF: attempts per chip and the first backoff (s).
+# CHIP_OVERVIEWS: 0 = always warp from full resolution. Otherwise chips whose
+#                 pixels span OVERVIEW_MIN+ source pixels (coarse QA probes,
+#                 see cloud_select.py) are read from the matching COG overview.
+CHIP_CACHE_DIR = os.getenv("CHIP_CACHE_DIR", "data/cache/chips")
+CHIP_CACHE_MB = float(os.getenv("CHIP_CACHE_MB", "20000"))
+CHIP_PREFETCH = int(os.getenv("CHIP_PREFETCH", "8"))
+CHIP_RETRIES = max(1, int(os.getenv("CHIP_RETRIES", "4")))
+CHIP_BACKOFF = float(os.getenv("CHIP_BACKOFF", "1.0"))
+CHIP_OVERVIEWS = os.getenv("CHIP_OVERVIEWS", "1") != "0"
+OVERVIEW_MIN = 4
+
+_GDAL_ENV = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "GDAL_HTTP_MAX_RETRY": "0",  # retries are ours, so a re-sign can happen between them
+}
+
+def _strip_query(href: str) -> str:
+    return href.split("?", 1)[0]
+
+def _overview_level(src, target_res):
+    """Index of the deepest overview no coarser than `target_res`, or None for full resolution."""
+    if not CHIP_OVERVIEWS or src.crs is None or src.crs.is_geographic:
+        return None
+    factor = target_res / src.res[0]
+    if factor < OVERVIEW_MIN:
+        return None
+    fits = [i for i, f in enumerate(src.overviews(1)) if f <= factor]
+    return fits[-1] if fits else None
+
+class ChipCache:
+    """Content-addressed .npy chips with an LRU size cap (mtime = last use)."""
+
+    def __init__(self, root=CHIP_CACHE_DIR, max_mb=CHIP_CACHE_MB):
+        self.root = None if str(root).lower() in ("", "none") else pl.Path(root)
+        self.max_bytes = int(max_mb * 2**20)
+        self._lock = threading.Lock()
+        self._size = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def _path(self, key):
+        return self.root / key[:2] / f"{key}.npy"
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            data = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp.npy")
+        np.save(tmp, data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(p.stat().st_size for p in self.root.glob("*/*.npy"))
+            else:
+                self._size += path.stat().st_size
+            if self._size > self.max_bytes:
+                self._trim()
+
+    def _trim(self):
+        # Oldest-used first, down to 90% of the cap so trims aren't constant.
+        files = sorted(((p.stat().st_mtime, p.stat().st_size, p) for p in self.root.glob("*/*.npy")),
+                       key=lambda f: f[0])
+        total = sum(f[1] for f in files)
+        for _, size, p in files:
+            if total <= self.max_bytes * 0.9:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+        self._size = total
+
+class ChipReader:
+    """Reads chips with retry / re-sign, through the cache, with optional prefetch."""
+
+    def __init__(self, catalog=None, cache=None, retries=CHIP_RETRIES, backoff=CHIP_BACKOFF,
+                 prefetch=CHIP_PREFETCH):
+        self.catalog = catalog
+        self.cache = cache or ChipCache()
+        self.retries, self.backoff = retries, backoff
+        self._items = {}                      # id -> latest signed item
+        self._inflight = {}                   # key -> Future (prefetch)
+        self._lock = threading.Lock()
+        self._pool = (ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="chip-prefetch")
+                      if prefetch > 0 and self.cache.enabled else None)
+        self.stats = {"hits": 0, "reads": 0, "retries": 0, "resigned": 0}
+
+    # ---- signing ----
+    def _current(self, item, force=False):
+        """Signed item, re-signed when close to expiry (or `force`)."""
+        if self.catalog is None:
+            return item
+        if force:
+            clean = item.clone()
+            for asset in clean.assets.values():
+                asset.href = _strip_query(asset.href)
+            item = self.catalog.sign([clean], force=True)[0]
+            self.stats["resigned"] += 1
+        else:
+            item = self.catalog.sign([self._items.get(item.id, item)])[0]
+        with self._lock:
+            self._items[item.id] = item
+        return item
+
+    # ---- reads ----
+    @staticmethod
+    def key(item, asset, grid, window) -> str:
+        crs, transform, _ = grid
+        ident = (item.id, asset, _strip_query(item.assets[asset].href), str(crs), tuple(transform)[:6],
+                 window.col_off, window.row_off, window.width, window.height)
+        return hashlib.sha256(repr(ident).encode("utf-8")).hexdigest()
+
+    def _read_remote(self, item, asset, grid, window):
+        crs, transform, (height, width) = grid
+        err = None
+        for attempt in range(self.retries):
+            signed = self._current(item, force=attempt > 0 and err is not None)
+            href = signed.assets[asset].href
+            try:
+                with rasterio.Env(**_GDAL_ENV):
+                    src = rasterio.open(href)
+                    level = _overview_level(src, abs(transform.a))
+                    if level is not None:  # reopen on the overview; full-res blocks are never fetched
+                        src.close()
+                        src = rasterio.open(href, overview_level=level)
+                    with src, WarpedVRT(src, crs=crs, transform=transform, width=width, height=height,
+                                        resampling=Resampling.nearest, nodata=0) as vrt:
+                        return vrt.read(1, window=window, out_dtype="uint16", fill_value=0)
+            except (RasterioIOError, OSError) as e:
+                err = e
+                self.stats["retries"] += 1
+                if attempt + 1 < self.retries:
+                    time.sleep(self.backoff * 2**attempt * (0.5 + random.random()))
+        raise RuntimeError(f"chip {item.id}/{asset} {window} failed after {self.retries} attempts: {err!r}")
+
+    def _fetch(self, item, asset, grid, window):
+        key = self.key(item, asset, grid, window)
+        data = self.cache.get(key)
+        if data is not None:
+            self.stats["hits"] += 1
+            return data
+        data = self._read_remote(item, asset, grid, window)
+        self.stats["reads"] += 1
+        self.cache.put(key, data)
+        return data
+
+    def read(self, item, asset, grid, window):
+        """(h, w) uint16 chip; waits for a prefetch of the same chip instead of reading twice."""
+        key = self.key(item, asset, grid, window)
+        with self._lock:
+            fut = self._inflight.pop(key, None)
+        # A prefetch still queued is dropped and read here; a running one is awaited
+        # (if it failed, this read retries on its own).
+        if fut is not None and not fut.cancel():
+            fut.exception()
+        return self._fetch(item, asset, grid, window)
+
+    def prefetch(self, chips):
+        """Queue (item, asset, grid, window) chips for background reads into the cache."""
+        if self._pool is None:
+            return
+        def _warm(key, spec):
+            try:
+                self._fetch(*spec)
+            finally:  # done or failed, later reads of this chip go through _fetch
+                with self._lock:
+                    self._inflight.pop(key, None)
+            return None  # the data is in the cache; don't pin it in memory
+        with self._lock:
+            for spec in chips:
+                key = self.key(*spec)
+                if key not in self._inflight:
+                    self._inflight[key] = self._pool.submit(_warm, key, spec)
+
+_readers = {}
+
+def get_reader(catalog=None) -> ChipReader:
+    """Per-process reader (and prefetch pool) for `catalog`."""
+    k = id(catalog)
+    if k not in _readers:
+        _readers[k] = ChipReader(catalog)
+    return _readers[k]
+
+# ---- Stack ----
+def _chip_task(reader, item, asset, grid, window, hit):
+    if not hit:
+        return np.zeros((1, 1, window.height, window.width), dtype="uint16")
+    return reader.read(item, asset, grid, window)[None, None]
+
+def chip_stack(items, assets, epsg, bounds, resolution, chunksize, catalog=None, aoi_gdf=None):
+    """
+    (time, band, y, x) uint16 stack like stackstac's (same snapped grid and
+    chunking), built from cached, retried chip reads. Chips that miss a
+    scene's footprint, or the AOI polygon when `aoi_gdf` is given, are zeros
+    and never read.
+    """
+    reader = get_reader(catalog)
+    transform, width, height = tiling.pixel_grid(bounds, resolution)
+    crs = f"EPSG:{epsg}"
+    grid = (crs, transform, (height, width))
+    items = sorted(items, key=lambda it: it.datetime)
+    inside = aoi_mask.grid_mask(aoi_gdf, crs, transform, (height, width)) if aoi_gdf is not None else None
+
+    ychunks = tuple(min(chunksize, height - r) for r in range(0, height, chunksize))
+    xchunks = tuple(min(chunksize, width - c) for c in range(0, width, chunksize))
+    footprints = [shape(transform_geom("EPSG:4326", crs, it.geometry)) if it.geometry else None for it in items]
+
+    name = "chips-" + tokenize([it.id for it in items], list(assets), crs, tuple(transform), width, height, chunksize)
+    dsk, wanted = {}, []
+    for iy, r in enumerate(range(0, height, chunksize)):
+        for ix, c in enumerate(range(0, width, chunksize)):
+            window = Window(c, r, xchunks[ix], ychunks[iy])
+            in_aoi = inside is None or inside[r:r + window.height, c:c + window.width].any()
+            cell = box(*window_bounds(window, transform))
+            for t, it in enumerate(items):
+                hit = in_aoi and (footprints[t] is None or footprints[t].intersects(cell))
+                for b, asset in enumerate(assets):
+                    dsk[(name, t, b, iy, ix)] = (partial(_chip_task, reader, it, asset, grid, window, hit),)
+                    if hit:
+                        wanted.append((it, asset, grid, window))
+
+    chunks = ((1,) * len(items), (1,) * len(assets), ychunks, xchunks)
+    data = da.Array(HighLevelGraph.from_collections(name, dsk, dependencies=()), name, chunks, dtype="uint16")
+
+    # Spatial-major, like the composite consumes them (all scenes of one chunk, then the next).
+    reader.prefetch(wanted)
+
+    xs = transform.c + (np.arange(width) + 0.5) * transform.a
+    ys = transform.f + (np.arange(height) + 0.5) * transform.e
+    stack = xr.DataArray(
+        data, dims=("time", "band", "y", "x"),
+        coords={
+            "time": pd.to_datetime([it.datetime for it in items], utc=True).tz_convert(None),
+            "band": np.array(list(assets), dtype=object),
+            "id": ("time", [it.id for it in items]),
+            "y": ys, "x": xs,
+        },
+    )
+    stack = stack.rio.write_crs(crs).rio.write_transform(transform)
+    stack.attrs["transform"] = transform
+    return stack
@@ -0,0 +1,116 @@
+# src/cloud_select.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from rasterio.windows import Window
+
+import aoi_mask
+import chip_reader
+import tiling
+from ndvi import SCL_BAD, _L8_BAD
+
+# Cloud-aware scene selection. eo:cloud_cover describes the whole scene, so a
+# scene that is clear overall can be cloudy over the AOI, and the reverse.
+# Before any red/nir read, each candidate's QA band (SCL / QA_PIXEL) is read
+# once on a coarse QA_RES grid over the AOI (from the COG overviews, through
+# chip_reader's signed, retried and cached reads). Scenes are then picked
+# greedily, always the one adding the most still-needed clear looks, until
+# TARGET_CLEAR of the AOI has CLEAR_OBS clear observations or no scene adds any.
+#
+# CLOUD_SELECT: 1 to enable (replaces the first-MAX_SCENES cut; MAX_SCENES
+#               then caps the number of scenes picked).
+# TARGET_CLEAR: share of AOI pixels that must reach CLEAR_OBS clear looks.
+# CLEAR_OBS: clear looks per pixel that count as covered (the reducer wants a few).
+# QA_RES: probe pixel size in metres. QA_THREADS: concurrent QA reads.
+CLOUD_SELECT = os.getenv("CLOUD_SELECT", "0") != "0"
+TARGET_CLEAR = float(os.getenv("TARGET_CLEAR", "0.95"))
+CLEAR_OBS = max(1, int(os.getenv("CLEAR_OBS", "3")))
+QA_RES = float(os.getenv("QA_RES", "300"))
+QA_THREADS = max(1, int(os.getenv("QA_THREADS", "8")))
+
+def params() -> dict:
+    """Settings that change which scenes are used (for the manifest), or {} when off."""
+    if not CLOUD_SELECT:
+        return {}
+    return {"CLOUD_SELECT": {"target": TARGET_CLEAR, "obs": CLEAR_OBS, "qa_res": QA_RES}}
+
+def clear_mask(qa: np.ndarray, mask: str) -> np.ndarray:
+    """True where a QA pixel is valid and clear (0 is fill for both sensors)."""
+    if mask == "s2":
+        return (qa != 0) & ~np.isin(qa, SCL_BAD)
+    return (qa != 0) & ((qa & (_L8_BAD | 1)) == 0)  # bit 0: QA_PIXEL fill
+
+def probe_grid(aoi_gdf, epsg, res=QA_RES):
+    """(crs, transform, (h, w)) coarse grid over the AOI, in chip_reader's grid form."""
+    transform, width, height = tiling.pixel_grid(aoi_gdf.to_crs(epsg).total_bounds, res)
+    return f"EPSG:{epsg}", transform, (height, width)
+
+def clear_maps(items, qa_asset, mask, aoi_gdf, epsg, catalog=None, res=QA_RES, threads=QA_THREADS):
+    """
+    Per item, its (h, w) clear-and-inside-AOI map on the probe grid (None if
+    the QA read failed), plus the AOI mask itself.
+    """
+    reader = chip_reader.get_reader(catalog)
+    grid = probe_grid(aoi_gdf, epsg, res)
+    crs, transform, shape = grid
+    inside = aoi_mask.grid_mask(aoi_gdf, crs, transform, shape)
+    window = Window(0, 0, shape[1], shape[0])
+
+    def _one(item):
+        if qa_asset not in item.assets:
+            return None
+        try:
+            return clear_mask(reader.read(item, qa_asset, grid, window), mask) & inside
+        except RuntimeError as e:
+            print(f"Warning: QA probe failed for {item.id}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="qa-probe") as pool:
+        return list(pool.map(_one, items)), inside
+
+def greedy_cover(clear, inside, target=TARGET_CLEAR, obs=CLEAR_OBS, max_scenes=None):
+    """
+    Indices of the scenes to keep (ascending) and the share of AOI pixels
+    that reach `obs` clear looks with them.
+    """
+    total = int(inside.sum())
+    if not total:
+        return [], 0.0
+    need = np.where(inside, obs, 0)
+    remaining = [i for i, c in enumerate(clear) if c is not None]
+    chosen = []
+    covered = 0.0
+    while remaining and covered < target and (not max_scenes or len(chosen) < max_scenes):
+        wanted = need > 0
+        gain, best = max((int(np.count_nonzero(clear[i] & wanted)), -i) for i in remaining)
+        if gain == 0:
+            break
+        best = -best
+        chosen.append(best)
+        remaining.remove(best)
+        need[clear[best]] = np.maximum(need[clear[best]] - 1, 0)
+        covered = float(np.count_nonzero(inside & (need == 0))) / total
+    return sorted(chosen), covered
+
+def select_scenes(items, qa_asset, mask, aoi_gdf, catalog=None, max_scenes=None, stats=None):
+    """
+    The items to build from, in their original order; `stats` gets probe
+    counts and coverage. When nothing can be picked (every probe failed, or
+    no scene adds a clear look) the year isn't dropped: it falls back to the
+    items as found, capped at `max_scenes`.
+    """
+    epsg = tiling.output_epsg(aoi_gdf)
+    clear, inside = clear_maps(items, qa_asset, mask, aoi_gdf, epsg, catalog)
+    keep, covered = greedy_cover(clear, inside, max_scenes=max_scenes)
+    probed = sum(c is not None for c in clear)
+    if stats is not None:
+        stats["qa_probed"] = probed
+        stats["clear_coverage"] = round(covered, 3)
+    if not keep and items:
+        why = "every QA probe failed" if not probed else "no scene adds a clear look over the AOI"
+        print(f"Warning: cloud-aware selection picked nothing ({why}); using the scenes as found.")
+        if stats is not None:
+            stats["fallback"] = why
+        return list(items[:max_scenes] if max_scenes else items), covered
+    return [items[i] for i in keep], covered
@@ -0,0 +1,164 @@
+# src/cog_writer.py
+import os
+import pathlib as pl
+import threading
+import time
+
+import numpy as np
+import dask
+import dask.array as da
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as rio_copy
+from rasterio.windows import Window
+
+# ---- COG settings ----
+# COG_CODEC: DEFLATE | ZSTD | LERC | LERC_DEFLATE | LERC_ZSTD
+# COG_PREDICTOR: 1 (none), 2 (horizontal), 3 (floating point) for DEFLATE/ZSTD;
+#                3 applies to float rasters only, integer rasters get 2 instead
+# COG_LEVEL: codec compression level (GDAL default when unset)
+# COG_MAX_Z_ERROR: LERC max error; 0 keeps it lossless
+# COG_OVERVIEWS: "auto" (halve until one block), "none", or factors like "2,4,8,16"
+COG_CODEC = os.getenv("COG_CODEC", "DEFLATE").upper()
+COG_PREDICTOR = os.getenv("COG_PREDICTOR", "3")
+COG_LEVEL = os.getenv("COG_LEVEL", "").strip() or None
+COG_MAX_Z_ERROR = float(os.getenv("COG_MAX_Z_ERROR", "0"))
+COG_BLOCKSIZE = int(os.getenv("COG_BLOCKSIZE", "512"))
+COG_OVERVIEWS = os.getenv("COG_OVERVIEWS", "auto").strip().lower()
+COG_THREADS = os.getenv("COG_THREADS", "ALL_CPUS")
+
+_PREDICTORS = {"1": "NO", "2": "STANDARD", "3": "FLOATING_POINT"}
+
+def overview_factors(width, height, blocksize=COG_BLOCKSIZE, spec=COG_OVERVIEWS):
+    if spec in ("none", "0", ""):
+        return []
+    if spec != "auto":
+        return [int(f) for f in spec.split(",") if f.strip()]
+    factors, f = [], 2
+    while max(width, height) / (f // 2) > blocksize:
+        factors.append(f)
+        f *= 2
+    return factors
+
+def predictor_for(dtype, predictor=COG_PREDICTOR) -> str:
+    """GDAL PREDICTOR value for `dtype`: the floating-point predictor only exists for float32/float64."""
+    predictor = _PREDICTORS.get(str(predictor), str(predictor))
+    if predictor == "FLOATING_POINT" and np.dtype(dtype).kind != "f":
+        return "STANDARD"
+    return predictor
+
+def cog_options(codec=COG_CODEC, predictor=COG_PREDICTOR, level=COG_LEVEL, dtype="float32"):
+    """Creation options for GDAL's COG driver, for a raster of `dtype`."""
+    opts = {
+        "COMPRESS": codec,
+        "BLOCKSIZE": COG_BLOCKSIZE,
+        "NUM_THREADS": COG_THREADS,  # parallel tile compression
+        "BIGTIFF": "IF_SAFER",
+    }
+    if codec in ("DEFLATE", "ZSTD", "LZW"):
+        opts["PREDICTOR"] = predictor_for(dtype, predictor)
+    if codec.startswith("LERC"):
+        opts["MAX_Z_ERROR"] = COG_MAX_Z_ERROR
+    if level:
+        opts["LEVEL"] = level
+    return opts
+
+class _WindowTarget:
+    # da.store() target: each computed block lands in its window of the open
+    # dataset. GDAL handles aren't thread-safe, so writes are serialized while
+    # the blocks themselves are still computed in parallel.
+    def __init__(self, dst, dtype):
+        self.dst, self.dtype = dst, dtype
+        self.lock = threading.Lock()
+
+    def __setitem__(self, key, block):
+        ys, xs = key
+        window = Window.from_slices(ys, xs)
+        with self.lock:
+            self.dst.write(np.asarray(block, dtype=self.dtype), 1, window=window)
+
+def scratch_profile(crs, transform, width, height, dtype="float32", nodata=np.nan):
+    """Tiled, uncompressed GeoTIFF used as the staging file before COG conversion."""
+    return {
+        "driver": "GTiff",
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": dtype,
+        "crs": crs,
+        "transform": transform,
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": COG_BLOCKSIZE,
+        "blockysize": COG_BLOCKSIZE,
+        "BIGTIFF": "IF_SAFER",
+    }
+
+def finalize_cog(scratch, path, overviews=COG_OVERVIEWS, **codec):
+    """
+    Build overviews (average) in the staging file, then copy it into a COG
+    with multi-threaded compression. The COG replaces `path` atomically and
+    the staging file is removed.
+    """
+    scratch, path = pl.Path(scratch), pl.Path(path)
+    with rasterio.Env(GDAL_NUM_THREADS=COG_THREADS):
+        with rasterio.open(scratch, "r+") as dst:
+            factors = overview_factors(dst.width, dst.height, spec=overviews)
+            if factors:
+                dst.build_overviews(factors, Resampling.average)
+            dtype = dst.dtypes[0]
+        opts = cog_options(dtype=dtype, **codec)
+        opts["OVERVIEWS"] = "FORCE_USE_EXISTING" if factors else "NONE"
+        part = path.with_name(path.name + ".part")
+        rio_copy(scratch, part, driver="COG", **opts)
+    os.replace(part, path)
+    scratch.unlink(missing_ok=True)
+    return path
+
+def write_cog(arr, path, dtype="float32", nodata=np.nan, overviews=COG_OVERVIEWS, timings=None, **codec):
+    """
+    Write a 2-D (y, x) DataArray with CRS and transform as a COG, streaming
+    dask blocks window by window so the full raster is never held in memory.
+    """
+    write_cogs([arr.data], [path], arr.rio.crs, arr.rio.transform(),
+               dtypes=[dtype], nodatas=[nodata], overviews=overviews, timings=timings, **codec)
+    return pl.Path(path)
+
+def write_cogs(arrays, paths, crs, transform, dtypes=None, nodatas=None, also=(),
+               overviews=COG_OVERVIEWS, timings=None, **codec):
+    """
+    Write several 2-D arrays as COGs in a single compute pass, so outputs
+    derived from the same graph don't recompute it. `transform` is shared, or
+    a list with one per array (e.g. windows cut from one stack). `also` are
+    extra dask collections computed in the same pass; their results are returned.
+    `timings`, if given, receives compute_s (graph + scratch writes) and
+    finalize_s (overviews + COG copy).
+    """
+    paths = [pl.Path(p) for p in paths]
+    transforms = transform if isinstance(transform, list) else [transform] * len(arrays)
+    dtypes = dtypes or ["float32"] * len(arrays)
+    nodatas = nodatas or [np.nan] * len(arrays)
+    sources, targets, files, scratches = [], [], [], []
+    try:
+        for arr, path, transform, dtype, nodata in zip(arrays, paths, transforms, dtypes, nodatas):
+            data = arr if isinstance(arr, da.Array) else da.from_array(np.asarray(arr), chunks=COG_BLOCKSIZE * 2)
+            height, width = data.shape
+            scratch = path.with_name(path.stem + ".scratch.tif")
+            dst = rasterio.open(scratch, "w", **scratch_profile(crs, transform, width, height, dtype=dtype, nodata=nodata))
+            files.append(dst)
+            scratches.append(scratch)
+            sources.append(data)
+            targets.append(_WindowTarget(dst, dtype))
+        store = da.store(sources, targets, lock=False, compute=False)
+        t = time.perf_counter()
+        _, *extra = dask.compute(store, *also)
+    finally:
+        for dst in files:
+            dst.close()
+    t_final = time.perf_counter()
+    for scratch, path in zip(scratches, paths):
+        finalize_cog(scratch, path, overviews=overviews, **codec)
+    if timings is not None:
+        timings["compute_s"] = round(t_final - t, 3)
+        timings["finalize_s"] = round(time.perf_counter() - t_final, 3)
+    return extra
@@ -0,0 +1,112 @@
+# src/cube.py
+import os
+import pathlib as pl
+
+import numpy as np
+import xarray as xr
+import rioxarray  # registers .rio accessor
+import zarr
+
+import grid
+
+# Multi-year NDVI datacube: every year on one fixed grid in a chunked Zarr
+# store with a `year` dimension. Chunks span many years and a small spatial
+# tile, so a pixel's whole time series (or any year pair over a tile) is a
+# single chunk read.
+#
+# CUBE_PATH: enable the cube and set its location (unset = GeoTIFFs only).
+# CUBE_CHUNK / CUBE_YEAR_CHUNK: spatial and year chunk sizes.
+CUBE_PATH = os.getenv("CUBE_PATH", "").strip() or None
+CUBE_CHUNK = int(os.getenv("CUBE_CHUNK", "128"))
+CUBE_YEAR_CHUNK = int(os.getenv("CUBE_YEAR_CHUNK", "64"))
+
+def _group(path, mode="a"):
+    return zarr.open_group(str(path), mode=mode)
+
+def cube_years(path) -> list:
+    if not pl.Path(path).exists():
+        return []
+    with xr.open_zarr(path) as ds:
+        return [int(y) for y in ds["year"].values]
+
+def open_cube(path=CUBE_PATH):
+    """The cube as a lazy Dataset with CRS set; `provenance` holds per-year inputs."""
+    ds = xr.open_zarr(path)
+    attrs = _group(path, mode="r").attrs.asdict()
+    ds = ds.rio.write_crs(attrs["crs_wkt"])
+    ds.attrs["provenance"] = attrs.get("provenance", {})
+    return ds
+
+def _template(path):
+    ds = open_cube(path)
+    return ds["ndvi"].isel(year=0, drop=True)
+
+def _year_slab(tif, template):
+    # Read the composite lazily in cube-aligned chunks; only a grid that
+    # differs from the cube's is resampled onto it.
+    da = rioxarray.open_rasterio(tif, chunks={"y": CUBE_CHUNK, "x": CUBE_CHUNK}, masked=True)
+    da = da.squeeze("band", drop=True)
+    if template is None:
+        # First year: the composites' grid.json, when there is one, is the cube's grid.
+        out_grid = grid.load_grid(pl.Path(tif).parent)
+        if out_grid:
+            da = grid.snap(da, out_grid).chunk({"y": CUBE_CHUNK, "x": CUBE_CHUNK})
+    else:
+        same = (
+            da.rio.crs == template.rio.crs
+            and da.rio.transform() == template.rio.transform()
+            and da.shape == template.shape
+        )
+        if not same:
+            print(f"Cube: resampling {pl.Path(tif).name} onto the cube grid")
+            da = da.rio.reproject_match(template).chunk({"y": CUBE_CHUNK, "x": CUBE_CHUNK})
+            da = da.assign_coords(y=template["y"], x=template["x"])
+    da = da.astype("float32")
+    da.attrs = {k: v for k, v in da.attrs.items() if k not in ("scale_factor", "add_offset")}  # encoding owns these
+    return da.drop_vars([c for c in da.coords if c not in ("y", "x")])
+
+def append_year(path, year: int, tif, provenance=None):
+    """
+    Add (or replace) one year from a composite GeoTIFF. The first year fixes
+    the cube grid; later years are written onto it.
+    """
+    path = pl.Path(path)
+    years = cube_years(path)
+    template = _template(path) if years else None
+    # appends rewrite the group attrs from the (empty) Dataset attrs; keep the cube's own
+    attrs = _group(path, mode="r").attrs.asdict() if years else {}
+    slab = _year_slab(tif, template).expand_dims(year=[int(year)])
+    ds = slab.to_dataset(name="ndvi")
+
+    if not years:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        ds["ndvi"].encoding = {"chunks": (CUBE_YEAR_CHUNK, CUBE_CHUNK, CUBE_CHUNK), "_FillValue": np.nan}
+        ds.to_zarr(path, mode="w", consolidated=True)
+        with rioxarray.open_rasterio(tif) as src:
+            attrs = {"crs_wkt": src.rio.crs.to_wkt(), "transform": list(src.rio.transform())[:6]}
+    elif year in years:
+        i = years.index(year)
+        ds.drop_vars(["y", "x"]).to_zarr(
+            path, region={"year": slice(i, i + 1), "y": slice(None), "x": slice(None)}, safe_chunks=False
+        )
+    else:
+        # year-chunks hold many years, so appends fill a chunk partially; each
+        # dask chunk maps to its own spatial zarr chunk, so writes don't race
+        ds.drop_vars(["y", "x"]).to_zarr(path, append_dim="year", safe_chunks=False, consolidated=True)
+
+    if provenance is not None:
+        attrs["provenance"] = dict(attrs.get("provenance", {})) | {str(year): provenance}
+    _group(path).attrs.update(attrs)
+    zarr.consolidate_metadata(str(path))  # keep .zmetadata in step with the attrs
+    print(f"Cube: wrote {year} → {path}")
+    return path
+
+# ---- Reads ----
+def pixel_series(ds, x, y):
+    """NDVI for every year at map coordinate (x, y) in the cube CRS, sorted by year."""
+    return ds["ndvi"].sel(x=x, y=y, method="nearest").sortby("year").compute()
+
+def year_pair(ds, y1: int, y2: int):
+    """(NDVI y1, NDVI y2) on the shared grid; no alignment needed."""
+    pair = ds["ndvi"].sel(year=[y1, y2]).compute()
+    return pair.sel(year=y1), pair.sel(year=y2)
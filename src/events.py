@@ -0,0 +1,183 @@
+# src/events.py
+import argparse
+import os
+import pathlib as pl
+
+import numpy as np
+import pandas as pd
+import dask.array as da
+import xarray as xr
+import rioxarray  # registers .rio accessor
+
+import cube
+import grid
+from cog_writer import write_cogs
+
+# Deforestation events over the whole archive. Every pixel's NDVI series is
+# scanned once, chunk by chunk in parallel (year axis whole, space tiled):
+#
+#   drop_year.tif       year of the largest year-on-year NDVI drop (0 = none)
+#   drop_magnitude.tif  size of that drop (NDVI units, positive = loss)
+#   trend.tif           least-squares NDVI slope per year
+#   change_class.tif    0 stable, 1 breakpoint (abrupt, persistent loss),
+#                       2 declining trend, 3 greening trend, 255 too few years
+#   cleared_year.tif    drop_year for breakpoint pixels only (what the viewer shows)
+#   summary.csv         cleared pixels / hectares per year
+#
+#   python src/events.py --drop 0.2 --persist 3 --trend 0.01
+#
+# Reads the Zarr cube when CUBE_PATH is set and exists, else the yearly
+# GeoTIFFs, placed on the AOI's grid.json (or the first year's grid, for
+# archives built before it existed); only off-grid years are resampled.
+COMP_DIR = pl.Path(os.getenv("COMP_DIR", "data/composites"))
+EVENTS_DIR = pl.Path(os.getenv("EVENTS_DIR", "data/events"))
+EVENT_CHUNK = int(os.getenv("EVENT_CHUNK", "512"))
+EVENT_DROP = float(os.getenv("EVENT_DROP", "0.2"))      # min drop for a breakpoint
+EVENT_PERSIST = int(os.getenv("EVENT_PERSIST", "3"))    # years the loss must hold
+EVENT_TREND = float(os.getenv("EVENT_TREND", "0.01"))   # |slope| for a trend class
+MIN_YEARS = 3
+
+STABLE, BREAKPOINT, DECLINING, GREENING, UNKNOWN = 0, 1, 2, 3, 255
+BANDS = ("drop_year", "drop_magnitude", "trend", "change_class")
+
+# ---- Inputs ----
+def _tif_years(comp_dir):
+    years = {}
+    for p in sorted(comp_dir.glob("ndvi_median_*.tif")):
+        tail = p.stem.rsplit("_", 1)[-1]
+        if tail.isdigit():
+            years[int(tail)] = p
+    return years
+
+def load_archive(comp_dir=COMP_DIR, chunk=EVENT_CHUNK) -> xr.DataArray:
+    """All composites as one lazy (year, y, x) array, one chunk along year."""
+    if cube.CUBE_PATH and pl.Path(cube.CUBE_PATH).exists():
+        arr = cube.open_cube(cube.CUBE_PATH)["ndvi"].sortby("year")
+        return arr.chunk({"year": -1, "y": chunk, "x": chunk})
+
+    tifs = _tif_years(pl.Path(comp_dir))
+    if not tifs:
+        raise FileNotFoundError(f"No ndvi_median_<year>.tif composites in {comp_dir}")
+    out_grid = grid.load_grid(comp_dir)
+    slabs, template = [], None
+    for year, tif in tifs.items():
+        arr = rioxarray.open_rasterio(tif, chunks={"y": chunk, "x": chunk}, masked=True).squeeze("band", drop=True)
+        if out_grid:
+            arr = grid.snap(arr, out_grid)
+            template = template if template is not None else arr
+        elif template is None:
+            template = arr
+        elif arr.rio.crs != template.rio.crs or arr.rio.transform() != template.rio.transform() or arr.shape != template.shape:
+            print(f"Events: resampling {tif.name} onto the {min(tifs)} grid")
+            arr = arr.rio.reproject_match(template).assign_coords(y=template["y"], x=template["x"])
+        slabs.append(arr.astype("float32").expand_dims(year=[year]))
+    out = xr.concat(slabs, dim="year", coords="minimal", compat="override")
+    return out.chunk({"year": -1, "y": chunk, "x": chunk}).rio.write_crs(template.rio.crs)
+
+# ---- Per-block kernel ----
+def detect_block(ndvi, years, drop=EVENT_DROP, persist=EVENT_PERSIST, trend=EVENT_TREND):
+    """
+    (T, h, w) NDVI block -> (4, h, w) float32 stack in BANDS order. NaN marks
+    missing years; drops are measured from the previous valid year.
+    """
+    T = ndvi.shape[0]
+    t = np.arange(T).reshape(-1, 1, 1)
+    valid = np.isfinite(ndvi)
+    n = valid.sum(axis=0)
+
+    # Previous valid observation for every year (forward fill of indices).
+    last = np.maximum.accumulate(np.where(valid, t, -1), axis=0)
+    prev = np.concatenate([np.full((1,) + last.shape[1:], -1), last[:-1]], axis=0)
+    prev_val = np.take_along_axis(ndvi, np.clip(prev, 0, None), axis=0)
+    step = np.where(valid & (prev >= 0), prev_val - ndvi, -np.inf)
+
+    k = step.argmax(axis=0)[None]
+    magnitude = np.take_along_axis(step, k, axis=0)[0]
+    has_drop = np.isfinite(magnitude)
+    drop_year = np.where(has_drop, np.asarray(years)[k[0]], 0)
+    magnitude = np.where(has_drop, magnitude, np.nan)
+
+    # Persistence: mean after the drop (up to `persist` years) vs mean before.
+    before = valid & (t < k)
+    after = valid & (t >= k) & (t < k + persist)
+    v = np.where(valid, ndvi, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_before = (v * before).sum(axis=0) / before.sum(axis=0)
+        mean_after = (v * after).sum(axis=0) / after.sum(axis=0)
+        is_break = has_drop & (magnitude >= drop) & (mean_before - mean_after >= drop / 2)
+
+        # Least-squares slope over the valid years only.
+        x = (np.asarray(years, dtype="float64") - np.mean(years)).reshape(-1, 1, 1)
+        sx, sxx = (x * valid).sum(axis=0), (x * x * valid).sum(axis=0)
+        sy, sxy = v.sum(axis=0), (x * v).sum(axis=0)
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+    slope = np.where(n >= MIN_YEARS, slope, np.nan)
+
+    cls = np.full(n.shape, STABLE, dtype="float32")
+    cls[slope <= -trend] = DECLINING
+    cls[slope >= trend] = GREENING
+    cls[is_break] = BREAKPOINT
+    cls[n < MIN_YEARS] = UNKNOWN
+    return np.stack([drop_year, magnitude, slope, cls]).astype("float32")
+
+# ---- Driver ----
+def detect(arr: xr.DataArray, drop=EVENT_DROP, persist=EVENT_PERSIST, trend=EVENT_TREND) -> da.Array:
+    years = [int(y) for y in arr["year"].values]
+    data = arr.data.rechunk({0: -1})
+    return da.map_blocks(
+        detect_block, data, years=years, drop=drop, persist=persist, trend=trend,
+        chunks=((len(BANDS),),) + data.chunks[1:], dtype="float32",
+    )
+
+def pixel_area_ha(arr: xr.DataArray) -> float:
+    tr = arr.rio.transform()
+    if arr.rio.crs is not None and arr.rio.crs.is_geographic:
+        print("Warning: composites are in a geographic CRS; hectares are approximate.")
+    return abs(tr.a * tr.e) / 10_000.0
+
+def run(comp_dir=COMP_DIR, outdir=EVENTS_DIR, drop=EVENT_DROP, persist=EVENT_PERSIST, trend=EVENT_TREND):
+    arr = load_archive(comp_dir)
+    years = [int(y) for y in arr["year"].values]
+    print(f"Events: {len(years)} years ({years[0]}–{years[-1]}), grid {arr.shape[1]}×{arr.shape[2]}")
+    bands = detect(arr, drop=drop, persist=persist, trend=trend)
+    cls = bands[3]
+    cleared = da.where(cls == BREAKPOINT, bands[0], 0)
+
+    # Cleared pixels per year, tallied in the same pass that writes the rasters.
+    idx = da.where(cleared > 0, cleared - years[0] + 1, 0).astype("int64")
+    counts = da.bincount(idx.ravel(), minlength=years[-1] - years[0] + 2)
+
+    outdir = pl.Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    names = list(BANDS) + ["cleared_year"]
+    # Integer layers get the horizontal predictor (cog_writer picks it by dtype; PREDICTOR=3 is float-only).
+    (counts,) = write_cogs(
+        [bands[0], bands[1], bands[2], cls, cleared],
+        [outdir / f"{n}.tif" for n in names],
+        arr.rio.crs, arr.rio.transform(),
+        dtypes=["int16", "float32", "float32", "uint8", "int16"],
+        nodatas=[0, np.nan, np.nan, UNKNOWN, 0],
+        also=[counts],
+    )
+
+    ha = pixel_area_ha(arr)
+    summary = pd.DataFrame({"year": np.arange(years[0], years[-1] + 1), "cleared_px": counts[1:]})
+    summary = summary[summary["year"].isin(years)]
+    summary["cleared_ha"] = (summary["cleared_px"] * ha).round(2)
+    summary.to_csv(outdir / "summary.csv", index=False)
+    print(f"Events: {int(summary['cleared_px'].sum())} breakpoint pixels "
+          f"({summary['cleared_ha'].sum():.1f} ha) -> {outdir}")
+    return summary
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-pixel deforestation events over all composites.")
+    ap.add_argument("--composites", default=str(COMP_DIR))
+    ap.add_argument("--out", default=str(EVENTS_DIR))
+    ap.add_argument("--drop", type=float, default=EVENT_DROP, help="min NDVI drop for a breakpoint")
+    ap.add_argument("--persist", type=int, default=EVENT_PERSIST, help="years the loss must persist")
+    ap.add_argument("--trend", type=float, default=EVENT_TREND, help="|NDVI/yr| slope for a trend class")
+    args = ap.parse_args()
+    run(args.composites, args.out, drop=args.drop, persist=args.persist, trend=args.trend)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# src/grid.py
+import json
+import os
+import pathlib as pl
+
+import numpy as np
+import dask.array as da
+import xarray as xr
+import rioxarray  # registers .rio accessor
+from affine import Affine
+from pyproj import CRS
+from rasterio.enums import Resampling
+
+import tiling
+
+# Canonical output grid, defined once per AOI and kept next to the composites
+# as grid.json (EPSG, resolution, transform, width, height). Every year (any
+# sensor, tiled or not) is built on it, so composites line up pixel for pixel
+# and cross-year work (Δ, events, cube, viewer queries) is plain array math.
+GRID_NAME = "grid.json"
+
+def define(aoi_gdf, resolution=30, epsg=None) -> dict:
+    """Grid covering the AOI: its bounds snapped outward to `resolution` in `epsg` (default OUTPUT_CRS / UTM)."""
+    epsg = epsg or tiling.output_epsg(aoi_gdf)
+    transform, width, height = tiling.pixel_grid(aoi_gdf.to_crs(epsg).total_bounds, resolution)
+    return {"epsg": int(epsg), "resolution": resolution, "transform": list(transform)[:6],
+            "width": width, "height": height}
+
+def affine(g) -> Affine:
+    return Affine(*g["transform"])
+
+def bounds(g):
+    t = affine(g)
+    return t.c, t.f + t.e * g["height"], t.c + t.a * g["width"], t.f
+
+def coords(g):
+    """Pixel-centre (y, x) coordinates."""
+    t = affine(g)
+    return (t.f + (np.arange(g["height"]) + 0.5) * t.e,
+            t.c + (np.arange(g["width"]) + 0.5) * t.a)
+
+def load_grid(outdir):
+    path = pl.Path(outdir) / GRID_NAME
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+
+def save_grid(outdir, g):
+    path = pl.Path(outdir) / GRID_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(g, indent=2))
+    os.replace(tmp, path)
+
+def ensure_grid(outdir, aoi_gdf, aoi_digest, resolution=30, epsg=None) -> dict:
+    """
+    The persisted grid for this AOI, defining it on first use. A grid made for
+    another AOI, resolution or CRS is replaced (those changes rebuild every
+    year anyway, through the manifest).
+    """
+    g = load_grid(outdir)
+    want_epsg = epsg or tiling.output_epsg(aoi_gdf)
+    if g and g.get("aoi") == aoi_digest and g["resolution"] == resolution and g["epsg"] == want_epsg:
+        return g
+    g = define(aoi_gdf, resolution, want_epsg) | {"aoi": aoi_digest}
+    save_grid(outdir, g)
+    print(f"Grid: EPSG:{g['epsg']} {g['width']}×{g['height']} px at {resolution} m → {pl.Path(outdir) / GRID_NAME}")
+    return g
+
+def _pixel_offset(src: Affine, dst: Affine, res):
+    """(row, col) of `src`'s origin in `dst`'s pixels, or None if the lattices differ."""
+    col, row = (src.c - dst.c) / res, (dst.f - src.f) / res
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        return None
+    return int(round(row)), int(round(col))
+
+def snap(arr: xr.DataArray, g) -> xr.DataArray:
+    """
+    A 2-D (y, x) raster placed on grid `g`. Rasters already on the grid's
+    lattice (same CRS and pixel size) are only cropped / NaN-padded, lazily;
+    anything else is resampled (nearest), which should only happen for
+    composites written before the grid existed.
+    """
+    t, crs, res = affine(g), CRS.from_epsg(g["epsg"]), g["resolution"]
+    h, w = g["height"], g["width"]
+    src = arr.rio.transform()
+    off = None
+    if arr.rio.crs == crs and abs(src.a - t.a) < 1e-9 and abs(src.e - t.e) < 1e-9:
+        off = _pixel_offset(src, t, res)
+
+    if off is None:
+        print("Grid: resampling onto the canonical grid")
+        out = arr.rio.reproject(crs, transform=t, shape=(h, w), resampling=Resampling.nearest, nodata=np.nan)
+    else:
+        r0, c0 = off
+        data = arr.data
+        ah, aw = data.shape
+        y0, x0 = min(max(0, -r0), ah), min(max(0, -c0), aw)
+        data = data[y0:max(y0, min(ah, h - r0)), x0:max(x0, min(aw, w - c0))]
+        top, left = min(max(0, r0), h), min(max(0, c0), w)
+        pad = ((top, h - top - data.shape[0]), (left, w - left - data.shape[1]))
+        if any(p for pair in pad for p in pair):
+            data = (da.pad if isinstance(data, da.Array) else np.pad)(data, pad, constant_values=np.nan)
+        out = xr.DataArray(data, dims=("y", "x"))
+
+    ys, xs = coords(g)
+    out = out.assign_coords(y=ys, x=xs)
+    return out.rio.write_crs(crs).rio.write_transform(t)
@@ -0,0 +1,60 @@
+# src/manifest.py
+import hashlib
+import json
+import os
+import pathlib as pl
+from datetime import datetime, timezone
+
+# Build manifest kept next to the composites. One entry per year records the
+# inputs that produced ndvi_median_<year>.tif so re-runs can skip years whose
+# inputs haven't changed.
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+def _digest(obj) -> str:
+    blob = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def aoi_hash(aoi_geojson) -> str:
+    """Hash of the AOI geometries only (properties, key order and whitespace don't matter)."""
+    return _digest([f.get("geometry") for f in aoi_geojson.get("features", [])])
+
+def year_entry(aoi_digest: str, params: dict, dataset: str, item_ids) -> dict:
+    """Manifest entry for one year; `fingerprint` covers every input."""
+    inputs = {
+        "aoi": aoi_digest,
+        "params": params,
+        "dataset": dataset,
+        "items": sorted(item_ids),
+    }
+    return {"fingerprint": _digest(inputs), **inputs}
+
+def load_manifest(outdir) -> dict:
+    """Return {year (str): entry}; a missing or unreadable manifest is treated as empty."""
+    path = pl.Path(outdir) / MANIFEST_NAME
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: ignoring unreadable manifest {path}: {e}")
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        print(f"Manifest {path} has version {data.get('version')}; rebuilding all years.")
+        return {}
+    return data.get("years", {})
+
+def save_manifest(outdir, years: dict):
+    """Write the manifest atomically so an interrupted run never leaves it half-written."""
+    path = pl.Path(outdir) / MANIFEST_NAME
+    tmp = path.with_suffix(".json.tmp")
+    payload = {"version": MANIFEST_VERSION, "years": dict(sorted(years.items()))}
+    tmp.write_text(json.dumps(payload, indent=2))
+    os.replace(tmp, path)
+
+def is_current(manifest: dict, year: int, entry: dict, out_tif) -> bool:
+    prev = manifest.get(str(year))
+    return bool(prev) and prev.get("fingerprint") == entry["fingerprint"] and pl.Path(out_tif).exists()
+
+def record(manifest: dict, year: int, entry: dict):
+    manifest[str(year)] = entry | {"written": datetime.now(timezone.utc).isoformat(timespec="seconds")}
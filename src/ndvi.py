@@ -1,15 +1,18 @@
 #src/ndvi.py
+import warnings
 import numpy as np
+import xarray as xr
 
 # Bitmask and classification values for cirrus, cloud, water, and snow masking
 _L8_BAD = ((1 << 1) | (1 << 2) | (1 << 3) | (1 << 4) | (1 << 5) | (1 << 7))
 SCL_BAD = np.array([3, 6, 7, 8, 9, 10, 11], dtype=np.uint8)    # Sentinel-2 bad SCL classes
 
 # Computes NDVI using dataset-specific scale and offset (Landsat/Sentinel mixed).
+# Inputs may be raw integer DNs; everything is computed in float32.
 def compute_ndvi_mixed(red, nir, cfg):
     scale = cfg["scale"]; offset = cfg["offset"]
-    redf = red * scale + offset
-    nirf = nir * scale + offset
+    redf = red.astype("float32") * scale + offset
+    nirf = nir.astype("float32") * scale + offset
     ndvi = (nirf - redf) / (nirf + redf + 1e-6)
     return ndvi.astype("float32")
 
@@ -17,9 +20,69 @@ def compute_ndvi_mixed(red, nir, cfg):
 def mask_clouds_mixed(qa, arr, cfg):
     if cfg["mask"] == "s2":
         qa_i = qa.round().astype("uint8")
-        bad = np.isin(qa_i, SCL_BAD)
+        bad = qa_i.isin(SCL_BAD)  # stays lazy for dask-backed arrays (np.isin would load them)
         return arr.where(~bad)
     else:
         qa_u = qa.astype("uint16")
         bad = (qa_u & _L8_BAD) != 0
         return arr.where(~bad)
+
+# ---- Fused NDVI + mask + temporal reduce ----
+REDUCERS = ("max", "median", "p95")
+
+# Linear-interpolated quantile along `axis`, skipping NaNs, vectorised: one
+# sort puts NaNs last, so each pixel's valid count n fixes its rank (n - 1) * q.
+# The interpolation is written as dask's nanquantile (what xarray's quantile
+# runs on the pipeline's dask arrays) writes it, so p95 rounds identically.
+def nanquantile_sorted(arr, q, axis=-1):
+    s = np.sort(arr, axis=axis)
+    n = np.count_nonzero(~np.isnan(s), axis=axis)
+    rank = (n - 1) * np.float64(q)
+    lo, hi = np.floor(rank), np.ceil(rank)
+    f_hi = rank - lo
+    f_hi = np.where(f_hi == 0.0, 1.0, f_hi)
+    f_lo = hi - rank
+    take = lambda i: np.take_along_axis(s, np.expand_dims(i.clip(0).astype(np.intp), axis), axis).squeeze(axis)
+    out = take(hi) * f_hi + take(lo) * f_lo
+    return np.where(n > 0, out, np.nan)
+
+# NumPy kernel over raw DNs with time on `axis`. Gives the same numbers as
+# compute_ndvi_mixed -> zero mask -> mask_clouds_mixed -> reduce over time,
+# but without the whole-array temporaries between those steps.
+def composite_block(red, nir, qa, scale, offset, mask, reducer="max", axis=-1):
+    redf = red.astype(np.float32) * scale + offset
+    nirf = nir.astype(np.float32) * scale + offset
+    ndvi = ((nirf - redf) / (nirf + redf + 1e-6)).astype(np.float32)
+
+    invalid = (red == 0) | (nir == 0)
+    if mask == "s2":
+        invalid |= np.isin(np.round(qa).astype(np.uint8), SCL_BAD)
+    else:
+        invalid |= (qa.astype(np.uint16) & _L8_BAD) != 0
+    ndvi[invalid] = np.nan
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # all-NaN pixels -> NaN
+        if reducer == "median":
+            out = np.nanmedian(ndvi, axis=axis)
+        elif reducer == "p95":
+            out = nanquantile_sorted(ndvi, 0.95, axis=axis)
+        else:
+            out = np.nanmax(ndvi, axis=axis)
+    return out.astype(np.float32)
+
+# Seasonal composite straight from raw red/nir/qa (dims: time, y, x) in one
+# per-chunk pass. Each spatial chunk is loaded over the full time axis once.
+def composite_ndvi_mixed(red, nir, qa, cfg, reducer="max"):
+    reducer = (reducer or "max").lower()
+    if reducer not in REDUCERS:
+        print(f"Unknown REDUCER='{reducer}', falling back to 'max'.")
+        reducer = "max"
+    red, nir, qa = (a.chunk({"time": -1}) if a.chunks else a for a in (red, nir, qa))
+    return xr.apply_ufunc(
+        composite_block, red, nir, qa,
+        input_core_dims=[["time"]] * 3,
+        kwargs={"scale": cfg["scale"], "offset": cfg["offset"], "mask": cfg["mask"], "reducer": reducer},
+        dask="parallelized",
+        output_dtypes=[np.float32],
+    )
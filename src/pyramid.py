@@ -0,0 +1,99 @@
+# src/pyramid.py
+import argparse
+import math
+import os
+import pathlib as pl
+
+import rioxarray  # registers .rio accessor
+from affine import Affine
+
+import grid
+from cog_writer import write_cogs
+
+# Coarser copies of every composite for zoomed-out viewing: each level is the
+# 30 m composite averaged over f×f blocks (NaN-aware), written to
+# <outdir>/<res>m/ndvi_median_<year>.tif with its own grid.json. Levels come
+# from the 30 m result, never from imagery: in the same write pass for normal
+# builds, or read back from the finished COG for tiled builds and backfills:
+#
+#   python src/pyramid.py --levels 120,480
+#
+# PYRAMID_LEVELS: comma-separated resolutions in metres, multiples of 30 (empty = off).
+PYRAMID_LEVELS = sorted({int(v) for v in os.getenv("PYRAMID_LEVELS", "").replace(" ", "").split(",") if v})
+BASE_RES = 30
+
+def parse_levels(text: str) -> list:
+    return sorted({int(v) for v in text.replace(" ", "").split(",") if v})
+
+def level_dir(outdir, res) -> pl.Path:
+    return pl.Path(outdir) / f"{res}m"
+
+def level_path(outdir, res, year) -> pl.Path:
+    return level_dir(outdir, res) / f"ndvi_median_{year}.tif"
+
+def factor(res, base=BASE_RES) -> int:
+    if res <= base or res % base:
+        raise ValueError(f"Pyramid level {res} m must be a multiple of {base} m above it")
+    return res // base
+
+def level_grid(g, res) -> dict:
+    """grid.json for a level: same origin, `res`-sized pixels covering the base grid."""
+    f = factor(res, g["resolution"])
+    t = grid.affine(g) * Affine.scale(f)
+    return g | {"resolution": res, "transform": list(t)[:6],
+                "width": math.ceil(g["width"] / f), "height": math.ceil(g["height"] / f)}
+
+def save_level_grids(outdir, g, levels=PYRAMID_LEVELS):
+    for res in levels:
+        grid.save_grid(level_dir(outdir, res), level_grid(g, res))
+
+def coarsen(arr, res, base=BASE_RES):
+    """(y, x) NaN-aware mean over blocks of res/base pixels; edge blocks may be partial."""
+    f = factor(res, base)
+    out = arr.coarsen(y=f, x=f, boundary="pad").mean()  # float data: NaNs are skipped
+    return out.rio.write_crs(arr.rio.crs).rio.write_transform(arr.rio.transform() * Affine.scale(f))
+
+def levels_for(arr, outdir, year, levels=PYRAMID_LEVELS):
+    """[(path, lazy coarse array)] for every level, to write alongside the 30 m composite."""
+    out = []
+    for res in levels:
+        level_dir(outdir, res).mkdir(parents=True, exist_ok=True)
+        out.append((level_path(outdir, res, year), coarsen(arr, res)))
+    return out
+
+def missing(outdir, year, levels=PYRAMID_LEVELS) -> list:
+    return [res for res in levels if not level_path(outdir, res, year).exists()]
+
+def from_cog(tif, outdir, year, levels=PYRAMID_LEVELS, chunk=1024):
+    """Write the levels of an existing composite, reading it back window by window."""
+    if not levels:
+        return []
+    arr = rioxarray.open_rasterio(tif, chunks={"y": chunk, "x": chunk}, masked=True).squeeze("band", drop=True)
+    coarse = levels_for(arr, outdir, year, levels)
+    write_cogs([c.data for _, c in coarse], [p for p, _ in coarse], arr.rio.crs,
+               [c.rio.transform() for _, c in coarse])
+    return [p for p, _ in coarse]
+
+def main():
+    ap = argparse.ArgumentParser(description="Build missing pyramid levels for existing composites.")
+    ap.add_argument("--composites", default="data/composites")
+    ap.add_argument("--levels", default=",".join(map(str, PYRAMID_LEVELS)), help="e.g. 120,480")
+    args = ap.parse_args()
+    levels = parse_levels(args.levels)
+    if not levels:
+        ap.error("no levels: pass --levels or set PYRAMID_LEVELS")
+
+    outdir = pl.Path(args.composites)
+    g = grid.load_grid(outdir)
+    if g:
+        save_level_grids(outdir, g, levels)
+    for tif in sorted(outdir.glob("ndvi_median_*.tif")):
+        year = tif.stem.rsplit("_", 1)[-1]
+        todo = missing(outdir, year, levels)
+        if todo:
+            print(f"[{year}] Writing {', '.join(f'{r} m' for r in todo)} …")
+            from_cog(tif, outdir, year, todo)
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# src/reducers.py
+import os
+import numpy as np
+import dask
+import dask.array as da
+import xarray as xr
+
+# Streaming temporal reducers. Scenes are folded into a fixed-size per-pixel
+# state one at a time, so memory depends on the tile size (and histogram
+# bins), not on how many scenes fall inside the seasonal window.
+#
+# STREAM_BINS: histogram bins over NDVI [-1, 1] for median / p95. The
+#   result is within half a bin of the exact quantile (0.005 for 200 bins);
+#   values outside [-1, 1] are clamped into the end bins.
+# STREAM_CHUNK: spatial tile (pixels) each fold runs over.
+STREAM_BINS = int(os.getenv("STREAM_BINS", "200"))
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "256"))
+NDVI_RANGE = (-1.0, 1.0)
+
+class RunningMax:
+    """Exact running max and valid-observation count."""
+
+    def __init__(self, shape):
+        self.value = np.full(shape, np.nan, dtype=np.float32)
+        self.count = np.zeros(shape, dtype=np.uint16)
+
+    def update(self, x):
+        self.count += np.isfinite(x)
+        np.fmax(self.value, x, out=self.value)  # fmax skips NaN on either side
+        return self
+
+    def result(self):
+        return self.value
+
+class HistogramQuantile:
+    """
+    Per-pixel NDVI histogram (bins x pixels, uint16 counts). Quantiles use the
+    same linear rank interpolation as numpy/xarray, evaluated on bin centres.
+    """
+
+    def __init__(self, shape, q, bins=STREAM_BINS, lo=NDVI_RANGE[0], hi=NDVI_RANGE[1]):
+        self.shape = tuple(shape)
+        self.q, self.bins, self.lo = q, bins, lo
+        self.width = (hi - lo) / bins
+        npix = int(np.prod(self.shape))
+        self.counts = np.zeros((bins, npix), dtype=np.uint16)
+        self.count = np.zeros(self.shape, dtype=np.uint16)
+
+    def update(self, x):
+        flat = x.ravel()
+        pix = np.flatnonzero(np.isfinite(flat))
+        b = np.clip(((flat[pix] - self.lo) / self.width).astype(np.int64), 0, self.bins - 1)
+        self.counts[b, pix] += 1  # one bin per pixel per scene, so pairs never repeat
+        self.count.ravel()[pix] += 1
+        return self
+
+    def _value_at(self, cum, rank):
+        # bin holding the rank-th (0-based) observation -> its centre
+        b = (cum <= rank[None]).sum(axis=0)
+        return self.lo + (np.minimum(b, self.bins - 1) + 0.5) * self.width
+
+    def result(self):
+        n = self.count.ravel().astype(np.float64)
+        pos = self.q * np.maximum(n - 1, 0)
+        lo_rank, hi_rank = np.floor(pos), np.ceil(pos)
+        cum = np.cumsum(self.counts, axis=0, dtype=np.int32)
+        v_lo = self._value_at(cum, lo_rank)
+        v_hi = self._value_at(cum, hi_rank)
+        out = np.where(n > 0, v_lo + (v_hi - v_lo) * (pos - lo_rank), np.nan)
+        return out.reshape(self.shape).astype(np.float32)
+
+def make_reducer(name, shape, bins=STREAM_BINS):
+    name = (name or "max").lower()
+    if name == "median":
+        return HistogramQuantile(shape, 0.5, bins=bins)
+    if name == "p95":
+        return HistogramQuantile(shape, 0.95, bins=bins)
+    if name != "max":
+        print(f"Unknown REDUCER='{name}', falling back to 'max'.")
+    return RunningMax(shape)
+
+def reduce_scenes(scenes, name, shape, bins=STREAM_BINS):
+    """Fold an iterable of 2-D NDVI arrays (NaN = masked). Returns (composite, count)."""
+    state = make_reducer(name, shape, bins)
+    for x in scenes:
+        state.update(np.asarray(x, dtype=np.float32))
+    return state.result(), state.count
+
+# ---- dask plumbing: one sequential fold per spatial tile ----
+def _start(name, shape, bins):
+    return make_reducer(name, shape, bins)
+
+def _update(state, block):
+    for x in block:  # block is (time, y, x); usually a single scene
+        state.update(x)
+    return state
+
+def _finish(state):
+    return np.stack([state.result(), state.count.astype(np.float32)])
+
+def stream_reduce(ndvi_t, reducer="max", bins=STREAM_BINS, chunk=STREAM_CHUNK):
+    """
+    Reduce a (time, y, x) NDVI DataArray over time without gathering the time
+    axis: each spatial tile folds its scenes one chunk at a time. Returns
+    (composite float32, valid-observation count uint16) as (y, x) DataArrays.
+    """
+    ndvi_t = ndvi_t.transpose("time", "y", "x")
+    arr = ndvi_t.data if isinstance(ndvi_t.data, da.Array) else da.from_array(ndvi_t.data)
+    arr = arr.rechunk({0: 1, 1: chunk, 2: chunk})
+    blocks = arr.to_delayed()
+    nt, ny, nx = blocks.shape
+
+    rows = []
+    for iy in range(ny):
+        row = []
+        for ix in range(nx):
+            shape = (arr.chunks[1][iy], arr.chunks[2][ix])
+            state = dask.delayed(_start)(reducer, shape, bins)
+            for it in range(nt):
+                state = dask.delayed(_update)(state, blocks[it, iy, ix])
+            row.append(da.from_delayed(dask.delayed(_finish)(state), shape=(2,) + shape, dtype=np.float32))
+        rows.append(row)
+    out = da.block(rows)  # tiles concatenated along (y, x)
+
+    coords = {"y": ndvi_t["y"], "x": ndvi_t["x"]}
+    composite = xr.DataArray(out[0], dims=("y", "x"), coords=coords, name="ndvi")
+    count = xr.DataArray(out[1].astype(np.uint16), dims=("y", "x"), coords=coords, name="count")
+    return composite, count
@@ -0,0 +1,137 @@
+# src/run_log.py
+import json
+import os
+import pathlib as pl
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Structured run log: one JSON object per line, per year and stage, e.g.
+#
+#   {"run": "20250301T0200Z-4121", "year": 2016, "stage": "search", "seconds": 3.2, "found": 41, ...}
+#
+# Year processes append to the same file (single O_APPEND writes, so lines
+# never interleave) and share the parent's RUN_ID through the environment.
+#
+# RUN_LOG: JSON-lines path ("none" disables).
+# DASK_REPORT: directory for a per-year dask profile (HTML; needs bokeh).
+RUN_LOG = os.getenv("RUN_LOG", "data/logs/run_log.jsonl").strip()
+DASK_REPORT = os.getenv("DASK_REPORT", "").strip() or None
+RUN_ID = os.environ.setdefault(
+    "RUN_ID", datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + f"-{os.getpid()}"
+)
+
+def enabled() -> bool:
+    return RUN_LOG.lower() not in ("", "none", "0")
+
+def log(stage: str, year=None, **fields):
+    """Append one record for `stage` (and `year`, if any) to the run log."""
+    if not enabled():
+        return
+    rec = {
+        "run": RUN_ID,
+        "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "pid": os.getpid(),
+        "year": year,
+        "stage": stage,
+    } | fields
+    path = pl.Path(RUN_LOG)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(rec, default=str) + "\n").encode("utf-8"))
+    finally:
+        os.close(fd)
+
+@contextmanager
+def stage(name: str, year=None, **fields):
+    """Time a block and log it; the yielded dict collects extra fields (and any error)."""
+    rec = dict(fields)
+    t = time.perf_counter()
+    try:
+        yield rec
+    except BaseException as e:
+        rec["error"] = repr(e)
+        raise
+    finally:
+        log(name, year, seconds=round(time.perf_counter() - t, 3), **rec)
+
+@contextmanager
+def dask_report(year):
+    """Profile the dask work in the block (tasks + CPU/memory) to DASK_REPORT/dask_<year>.html."""
+    if not DASK_REPORT:
+        yield
+        return
+    from dask.diagnostics import Profiler, ResourceProfiler, visualize
+
+    with Profiler() as prof, ResourceProfiler(dt=0.5) as rprof:
+        yield
+    out = pl.Path(DASK_REPORT) / f"dask_{year}_{RUN_ID}.html"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        visualize([prof, rprof], filename=str(out), show=False, save=True)
+        log("dask_report", year, path=str(out))
+    except ImportError as e:
+        print(f"Warning: DASK_REPORT needs bokeh ({e}); no report written.")
+
+# ---- Summary ----
+def load(run=RUN_ID, path=RUN_LOG):
+    """This run's records as a DataFrame (empty if logging is off)."""
+    import pandas as pd
+
+    if not enabled() or not pl.Path(path).exists():
+        return pd.DataFrame()
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame([r for r in rows if r.get("run") == run])
+
+def summary(run=RUN_ID, path=RUN_LOG):
+    """
+    Per-year table: stage seconds, scene counts, tasks, peak memory and
+    `est_read_mib`, an upper bound on bytes read (shape × dtype of the kept
+    chunks) rather than a measurement.
+    """
+    df = load(run, path)
+    if df.empty:
+        return df
+    df = df[df["year"].notna()]
+    seconds = df.pivot_table(index="year", columns="stage", values="seconds", aggfunc="sum")
+    stages = ("search", "cloud_select", "graph", "compute", "finalize", "build")
+    out = seconds.reindex(columns=[c for c in stages if c in seconds])
+    out.columns = [f"{c}_s" for c in out.columns]
+    # (column, stages, field, how): tiled builds log graph/compute per tile;
+    # scenes are the last count kept, after cloud-aware selection when it ran
+    for col, stage_names, field, how in (
+        ("scenes", ("search", "cloud_select"), "kept", "last"),
+        ("est_read_mib", ("graph",), "read_mib_upper_bound", "sum"),
+        ("tasks", ("graph",), "tasks", "sum"),
+        ("peak_mib", ("compute",), "peak_rss_mib", "max"),
+    ):
+        if field in df:
+            out[col] = df[df["stage"].isin(stage_names)].groupby("year")[field].agg(how)
+    def _status(stages):
+        stages = set(stages)
+        for stage_name, label in (("failed", "failed"), ("skip", "skipped"), ("compute", "built")):
+            if stage_name in stages:
+                return label
+        return "no data"
+
+    status = df.groupby("year")["stage"].agg(_status)
+    out.insert(0, "status", status)
+    return out.sort_index()
+
+def report(run=RUN_ID, path=RUN_LOG):
+    """Print the per-year summary and stage totals for this run."""
+    import pandas as pd
+
+    table = summary(run, path)
+    if table.empty:
+        return table
+    with pd.option_context("display.width", 160, "display.max_columns", 20):
+        print(f"\nRun {run} ({path})")
+        print(table.round(2).to_string())
+    if "est_read_mib" in table:
+        print("est_read_mib is an upper bound from array shapes (every kept chunk as uint16), not bytes measured.")
+    totals = table.filter(like="_s").sum()
+    print("Stage totals (s): " + ", ".join(f"{k[:-2]} {v:.1f}" for k, v in totals.items()))
+    return table
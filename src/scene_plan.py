@@ -0,0 +1,111 @@
+# src/scene_plan.py
+import json
+import pathlib as pl
+
+import numpy as np
+import pandas as pd
+import pystac
+
+import stac_cache
+
+# Columnar view of STAC item metadata so de-duplication and day-gap subsampling
+# run as grouped table operations, for one year or many years at once. The
+# selected rows form a "plan": a table that can be saved and reloaded.
+
+def _pad3(s: pd.Series) -> pd.Series:
+    """Zero-pad integer-like WRS path/row values to 3 digits; leave anything else as text."""
+    num = pd.to_numeric(s, errors="coerce")
+    ok = num.notna() & (num % 1 == 0)
+    out = s.astype(str)
+    out[ok] = num[ok].astype("int64").astype(str).str.zfill(3)
+    return out
+
+def items_table(items, mask: str) -> pd.DataFrame:
+    """
+    One row per item: id, tile, datetime, day, year, cloud, platform, collection
+    and the item itself. `mask` is the dataset mask kind ('s2' or 'landsat'),
+    which decides how the tile ID is derived.
+    """
+    items = list(items)
+    props = pd.DataFrame([it.properties for it in items], index=pd.RangeIndex(len(items)))
+    col = lambda k: props[k] if k in props else pd.Series([None] * len(items), dtype=object)
+
+    if mask == "s2":
+        tile = col("s2:mgrs_tile").astype(str)
+    else:
+        path, row = col("landsat:wrs_path"), col("landsat:wrs_row")
+        tile = ("P" + _pad3(path) + "R" + _pad3(row)).where(path.notna() & row.notna(), "LTILE")
+
+    # naive UTC, so day boundaries match item.datetime.date() for UTC timestamps
+    dt = pd.to_datetime(pd.Series([it.datetime for it in items], dtype=object), utc=True).dt.tz_convert(None)
+    return pd.DataFrame({
+        "id": [it.id for it in items],
+        "tile": tile.to_numpy(),
+        "datetime": dt.to_numpy(),
+        "day": dt.dt.normalize().to_numpy(),
+        "year": dt.dt.year.to_numpy(),
+        "cloud": pd.to_numeric(col("eo:cloud_cover"), errors="coerce").to_numpy(),
+        "platform": col("platform").to_numpy(),
+        "collection": [it.collection_id for it in items],
+        "item": items,
+    })
+
+def best_per_tile_day(table: pd.DataFrame) -> pd.DataFrame:
+    """Keep the lowest-cloud item per (tile, day); ties keep the earlier row."""
+    ranked = table.sort_values(["tile", "day", "cloud"], kind="mergesort", na_position="last")
+    return ranked.drop_duplicates(["tile", "day"], keep="first").sort_values("datetime", kind="mergesort")
+
+def _gap_keep(days: np.ndarray, gap: int) -> np.ndarray:
+    # Greedy "at least `gap` days since the last accepted scene" over sorted
+    # day numbers; each step jumps straight to the next eligible scene.
+    keep = np.zeros(len(days), dtype=bool)
+    i = 0
+    while i < len(days):
+        keep[i] = True
+        i = int(np.searchsorted(days, days[i] + gap, side="left"))
+    return keep
+
+def subsample_days(table: pd.DataFrame, day_gap: int) -> pd.DataFrame:
+    """Per tile, keep scenes at least `day_gap` days apart (earliest first). day_gap <= 0 keeps all."""
+    table = table.sort_values("datetime", kind="mergesort")
+    if day_gap <= 0 or table.empty:
+        return table
+    days = table["day"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    keep = np.zeros(len(table), dtype=bool)
+    for idx in table.groupby("tile", sort=False).indices.values():
+        keep[idx] = _gap_keep(days[idx], day_gap)
+    return table[keep]
+
+def select_scenes(table: pd.DataFrame, day_gap: int) -> pd.DataFrame:
+    """Best item per tile/day, then the per-tile day-gap subsample, in date order."""
+    return subsample_days(best_per_tile_day(table), day_gap)
+
+# ---- Serialization ----
+def save_plan(plan: pd.DataFrame, path):
+    """Write a plan as JSON. Items are stored unsigned, so no (expiring) SAS token is persisted."""
+    path = pl.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    records = []
+    for r in plan.itertuples(index=False):
+        records.append({
+            "id": r.id,
+            "tile": r.tile,
+            "datetime": pd.Timestamp(r.datetime).isoformat(),
+            "cloud": None if pd.isna(r.cloud) else float(r.cloud),
+            "platform": r.platform,
+            "collection": r.collection,
+            "item": stac_cache.unsign(r.item).to_dict(transform_hrefs=False),
+        })
+    path.write_text(json.dumps({"scenes": records}, indent=1))
+
+def load_plan(path, mask: str, catalog=None) -> pd.DataFrame:
+    """
+    Reload a saved plan as a table. Items come back unsigned; pass the
+    CachedCatalog to sign them through it (cached tokens are reused until
+    they near expiry).
+    """
+    data = json.loads(pl.Path(path).read_text())
+    items = [pystac.Item.from_dict(r["item"]) for r in data["scenes"]]
+    if catalog is not None:
+        items = catalog.sign(items)
+    return items_table(items, mask)
@@ -1,18 +1,35 @@
 # src/search_download.py
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import date, timedelta
 import json
+import multiprocessing as mp
 import os
 import pathlib as pl
+import threading
 import numpy as np
 import geopandas as gpd
 import rioxarray  # registers .rio accessor
-from pystac_client import Client
-import planetary_computer as pc
 import stackstac as st
 import dask
 from dask.diagnostics import ProgressBar
+from dask.utils import parse_bytes
 from tqdm.auto import tqdm
-from ndvi import compute_ndvi_mixed, mask_clouds_mixed
+from ndvi import composite_ndvi_mixed, compute_ndvi_mixed, mask_clouds_mixed
+from cog_writer import write_cogs
+import cube
+import manifest
+import reducers
+import stac_cache
+import scene_plan
+import tiling
+import grid
+import aoi_mask
+import run_log
+import chip_reader
+import cloud_select
+import pyramid
 
 # ---- Dataset registry (year → collection/bands/mask) ----
 DATASETS = {
@@ -51,10 +68,20 @@ def select_dataset(year: int):
             return key, cfg
     raise ValueError(f"No dataset configured for year {year}")
 
-dask.config.set(scheduler="threads", num_workers=6)
-ProgressBar().register()
+# ---- Parallelism ----
+# DASK_THREADS: threads for one year's dask graph.
+# YEAR_WORKERS: years built concurrently in separate processes (1 = serial).
+# YEAR_MEMORY: optional per-year-process memory cap, e.g. "8GB".
+DASK_THREADS = int(os.getenv("DASK_THREADS", "6"))
+YEAR_WORKERS = int(os.getenv("YEAR_WORKERS", "1"))
+YEAR_MEMORY = os.getenv("YEAR_MEMORY", "").strip() or None
 
-CATALOG = "https://planetarycomputer.microsoft.com/api/stac/v1"
+dask.config.set(scheduler="threads", num_workers=DASK_THREADS)
+_progress = ProgressBar()
+_progress.register()
+
+# STAC API URL, or a directory of item JSON files for fully offline runs
+CATALOG = os.getenv("STAC_CATALOG", "https://planetarycomputer.microsoft.com/api/stac/v1")
 
 # throttle: set MAX_SCENES=None to process all
 _env = os.getenv("MAX_SCENES", "none").lower()  # Testing phase, low value for quick results
@@ -63,6 +90,38 @@ WINDOW_START_MONTH = int(os.getenv("WINDOW_START_MONTH", "1"))  # 7 = July
 WINDOW_START_DAY = int(os.getenv("WINDOW_START_DAY", "1"))
 _env_norm = (_env or "").strip().lower()
 MAX_SCENES = None if _env_norm in ("none", "") else int(_env_norm)
+# stackstac (default) or chips: retried, prefetched, locally cached chip reads (chip_reader.py)
+READER = os.getenv("READER", "stackstac").strip().lower()
+# Spatial chunk (pixels) used from stacking through the reduction
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1024"))
+# Optional directory for each year's selected scene list (plan_<year>.json)
+PLAN_DIR = os.getenv("PLAN_DIR", "").strip() or None
+MAX_CLOUD = int(os.getenv("MAX_CLOUD", "80"))
+DAY_GAP = int(os.getenv("DAY_GAP", "10"))
+REDUCER = os.getenv("REDUCER", "max").lower()
+# "fused": one per-chunk NDVI+mask+reduce kernel; "xarray": separate whole-array steps;
+# "stream": fold scenes one at a time into bounded per-pixel state (reducers.py)
+COMPOSITE_MODE = os.getenv("COMPOSITE_MODE", "fused").lower()
+# Rebuild every year even when the manifest says the composite is current
+FORCE_REBUILD = os.getenv("FORCE_REBUILD", "0").lower() in ("1", "true", "yes")
+
+def build_params() -> dict:
+    """Env-driven parameters that change a composite; part of each year's manifest entry."""
+    return {
+        "WINDOW_WEEKS": WINDOW_WEEKS,
+        "WINDOW_START_MONTH": WINDOW_START_MONTH,
+        "WINDOW_START_DAY": WINDOW_START_DAY,
+        "MAX_CLOUD": MAX_CLOUD,
+        "DAY_GAP": DAY_GAP,
+        "REDUCER": REDUCER,
+        "MAX_SCENES": MAX_SCENES,
+    } | (
+        # streamed median/p95 are histogram approximations, so they are distinct outputs
+        {"COMPOSITE_MODE": "stream", "STREAM_BINS": reducers.STREAM_BINS}
+        if COMPOSITE_MODE == "stream" else {}
+    ) | ({"OUTPUT_CRS": tiling.OUTPUT_CRS} if tiling.OUTPUT_CRS else {}) | (
+        {"AOI_CLIP": True} if aoi_mask.AOI_CLIP else {}  # NoData outside the polygon
+    ) | cloud_select.params()
 
 def resolve_landsat_assets(first_assets: set, want: str, ds_key: str) -> str:
     """
@@ -94,116 +153,79 @@ def load_aoi(path="data/aoi/roi.geojson"):
     gdf = gdf.to_crs(epsg=4326)
     return gdf, json.loads(gdf.to_json())
 
-def search_items(aoi_geojson, start, end, max_cloud=25, cfg=None):
+def search_items(aoi_geojson, start, end, max_cloud=25, cfg=None, stats=None):
+    """Signed items for the window after cloud filter, dedup and subsample; `stats` gets the counts."""
+    stats = {} if stats is None else stats
     if cfg is None:
         raise ValueError("search_items requires cfg from select_dataset(year)")
 
-    client = Client.open(CATALOG)
+    catalog = stac_cache.get_catalog(CATALOG)
 
-    # build query (keep cloud cap), but skip platform filter (too brittle on MPC)
-    query = {}
+    # One (cached) search per window without the cloud cap; the cap is applied
+    # here so the no-cloud-filter fallback doesn't cost a second search.
+    # Skip platform filter (too brittle on MPC).
+    all_items = catalog.search(cfg["collection"], aoi_geojson["features"][0]["geometry"], start, end)
+    items = all_items
     if max_cloud is not None:
-        query["eo:cloud_cover"] = {"lt": max_cloud}
-
-    def _do_search(q):
-        return client.search(
-            collections=[cfg["collection"]],
-            intersects=aoi_geojson["features"][0]["geometry"],
-            datetime=f"{start}/{end}",
-            query=q if q else None,
-        )
+        items = [it for it in all_items if it.properties.get("eo:cloud_cover", 100) < max_cloud]
+    stats |= {"found": len(all_items), "after_cloud": len(items)}
 
-    # first attempt
-    items = list(_do_search(query).items())
-
-    # fallback: if none found, retry without cloud filter
-    if not items and "eo:cloud_cover" in query:
+    # fallback: if none found, use the window without cloud filter
+    if not items and max_cloud is not None:
         print(f"No items with cloud<{max_cloud}. Retrying with no cloud filter…")
-        items = list(_do_search({}).items())
+        items = all_items
 
-    # sign for MPC
-    items = [pc.sign(it) for it in items]
+    # --- Dedup best (lowest cloud) per tile/day, then day-gap subsample per tile ---
+    table = scene_plan.items_table(items, cfg["mask"])
+    best = scene_plan.best_per_tile_day(table)
+    print(f"After best-per-day-per-tile filter: {len(best)} scenes")
+    stats["after_dedup"] = len(best)
 
-    # --- Dedup best (lowest cloud) per tile/day ---
-    by_key = {}
-    for it in items:
-        if cfg["mask"] == "s2":
-            tile_id = it.properties.get("s2:mgrs_tile")
-        else:
-            p = it.properties.get("landsat:wrs_path")
-            r = it.properties.get("landsat:wrs_row")
-
-            def _pad3(x):
-                try:
-                    return f"{int(x):03d}"
-                except Exception:
-                    return str(x)
-
-            tile_id = (
-                f"P{_pad3(p)}R{_pad3(r)}" if (p is not None and r is not None) else "LTILE"
-            )
-        day = it.datetime.date()
-        key = (tile_id, day)
-        if key not in by_key or it.properties["eo:cloud_cover"] < by_key[key].properties["eo:cloud_cover"]:
-            by_key[key] = it
-
-    items = list(by_key.values())
-    print(f"After best-per-day-per-tile filter: {len(items)} scenes")
-
-    # --- Optional: date subsample per tile ---
-    items.sort(key=lambda it: it.datetime)
-    filtered, last_for_tile = [], {}
-    day_gap = int(os.getenv("DAY_GAP", "10"))
+    day_gap = DAY_GAP
     if day_gap <= 0:
         print("Subsample disabled (DAY_GAP<=0); keeping all best-per-day-per-tile scenes.")
-        return items
-    for it in items:
-        if cfg["mask"] == "s2":
-            tile_id = it.properties.get("s2:mgrs_tile")
-        else:
-            p = it.properties.get("landsat:wrs_path")
-            r = it.properties.get("landsat:wrs_row")
-
-            def _pad3(x):
-                try:
-                    return f"{int(x):03d}"
-                except Exception:
-                    return str(x)
-
-            tile_id = (
-                f"P{_pad3(p)}R{_pad3(r)}" if (p is not None and r is not None) else "LTILE"
-            )
+        return catalog.sign(best["item"].tolist())  # sign for MPC (only what we keep)
 
-        d = it.datetime.date()
-        if tile_id not in last_for_tile or (d - last_for_tile[tile_id]).days >= day_gap:
-            filtered.append(it)
-            last_for_tile[tile_id] = d
+    plan = scene_plan.subsample_days(best, day_gap)
+    print(f"After {day_gap}-day subsample: {len(plan)} scenes")
+    stats["after_subsample"] = len(plan)
+    return catalog.sign(plan["item"].tolist())  # sign for MPC (only what we keep)
 
-    print(f"After {day_gap}-day subsample: {len(filtered)} scenes")
-    return filtered
-
-def stack_for_year(items, aoi_gdf, cfg, resolution=30):
+def stack_for_year(items, aoi_gdf, cfg, resolution=30, epsg=None, bounds=None):
     # Decide bands by dataset
     bands = cfg.get("_resolved_assets", (cfg["assets"]["red"], cfg["assets"]["nir"], cfg["assets"]["qa"]))
 
-    utm = aoi_gdf.estimate_utm_crs()
-    target_epsg = utm.to_epsg() if utm else 4326
-
-    aoi_in_target = aoi_gdf.to_crs(target_epsg)
-    minx, miny, maxx, maxy = aoi_in_target.total_bounds
+    # OUTPUT_CRS or the AOI's UTM zone (an AOI across zones needs OUTPUT_CRS);
+    # tiled builds pass their own tile bounds on the same grid.
+    target_epsg = epsg or tiling.output_epsg(aoi_gdf)
+    if bounds is None:
+        bounds = aoi_gdf.to_crs(target_epsg).total_bounds
+    minx, miny, maxx, maxy = bounds
+
+    if READER == "chips":
+        return chip_reader.chip_stack(
+            items, list(bands), target_epsg, (minx, miny, maxx, maxy), resolution, CHUNK_SIZE,
+            catalog=stac_cache.get_catalog(CATALOG),
+            aoi_gdf=aoi_gdf if aoi_mask.AOI_CLIP else None,
+        )
 
+    # Native integer DNs (SR and QA_PIXEL are uint16, SCL fits), read as
+    # time=1, band=1, CHUNK_SIZE² spatial chunks. What the composite does with them:
+    #   fused   composite_ndvi_mixed rechunks time to -1 (each spatial chunk over all scenes)
+    #   stream  stream_reduce rechunks to time=1, STREAM_CHUNK² tiles and folds scene by scene
+    #   xarray  max reduces per chunk; median/p95 merge the time chunks inside dask
     stack = st.stack(
         items,
         assets=list(bands),
         epsg=target_epsg,
         bounds=(minx, miny, maxx, maxy),
         resolution=resolution,
-        chunksize=768,
-        dtype="float64", 
-        fill_value=0,
+        chunksize=CHUNK_SIZE,
+        dtype="uint16",
+        fill_value=np.uint16(0),  # stackstac requires a fill castable to dtype; a Python int isn't
         rescale=False,    # we’ll apply scale/offset explicitly
+        xy_coords="center",  # pixel-centre coords, as rioxarray (and grid.snap) expect
     )
-    stack = stack.chunk({"time": 1, "y": 512, "x": 512})
     if not stack.rio.crs:
         try:
             stack = stack.rio.write_crs(target_epsg)
@@ -223,37 +245,31 @@ def reduce_ndvi_over_time(ndvi_t, reducer: str):
         out = ndvi_t.max(dim="time", skipna=True)
     return out
     
-def main():
-    aoi_gdf, aoi_geojson = load_aoi("data/aoi/roi.geojson")
-    # save NDVI composites under data/composites/ (what your app expects)
-    outdir = pl.Path("data/composites")
-    outdir.mkdir(parents=True, exist_ok=True)
-    years = list(range(1985, 2025))
-
-    #years = [1995]  # : 2020, 2021, 2022, 2023, 2024
-    for y in tqdm(years, desc="Years"):
-        ds_name, cfg = select_dataset(y)
-        print(f"[{y}] Using dataset {ds_name}: {cfg['collection']}")
-
-        # Compute seasonal window first, then search
-        start, end = seasonal_window(
-            y,
-            start_month=WINDOW_START_MONTH,
-            start_day=WINDOW_START_DAY,
-            weeks=WINDOW_WEEKS,
-        )
+def plan_year(y, aoi_geojson):
+    """
+    Search and preflight one year: pick the dataset, find scenes and resolve
+    the real asset keys. Returns None when there is nothing to build.
+    """
+    ds_name, cfg = select_dataset(y)
+    print(f"[{y}] Using dataset {ds_name}: {cfg['collection']}")
+
+    # Compute seasonal window first, then search
+    start, end = seasonal_window(
+        y,
+        start_month=WINDOW_START_MONTH,
+        start_day=WINDOW_START_DAY,
+        weeks=WINDOW_WEEKS,
+    )
 
-        max_cloud = int(os.getenv("MAX_CLOUD", "80"))
-        print(f"[{y}] Searching items {start} → {end} (cloud<{max_cloud}%) …")
-        items = search_items(aoi_geojson, start, end, max_cloud=max_cloud, cfg=cfg)
+    max_cloud = MAX_CLOUD
+    print(f"[{y}] Searching items {start} → {end} (cloud<{max_cloud}%) …")
+    with run_log.stage("search", y, dataset=ds_name) as rec:
+        items = search_items(aoi_geojson, start, end, max_cloud=max_cloud, cfg=cfg, stats=rec)
         print(f" [{y}] Found {len(items)} scenes")
         if not items:
+            rec["kept"] = 0
             print(f"No scenes for {y}; skipping.")
-            continue
-
-        if isinstance(MAX_SCENES, int) and MAX_SCENES > 0 and len(items) > MAX_SCENES:
-            items = items[:MAX_SCENES]
-            print(f"Throttling to first {MAX_SCENES} scenes for speed…")
+            return None
 
         # --- Preflight: inspect first item and resolve real asset keys ---
         first = items[0]
@@ -267,57 +283,335 @@ def main():
         else:  # Sentinel-2 (usually stable)
             red_key, nir_key, qa_key = cfg["assets"]["red"], cfg["assets"]["nir"], cfg["assets"]["qa"]
 
-        # Build the stack using resolved asset keys
-        print(f"[{y}] Building stack at 30m and clipping to AOI …")
-        stack = stack_for_year(items, aoi_gdf, cfg | {"_resolved_assets": (red_key, nir_key, qa_key)}, resolution=30)
-        print(f"[{y}] Stack ready: {tuple(stack.sizes.get(k) for k in ['time','y','x'])} (time, y, x)")
-
-        if "band" not in stack.dims and "bands" not in stack.dims:
-            print(f"[{y}] No 'band' dimension found; skipping year.")
-            continue
-        bdim = "band" if "band" in stack.dims else "bands"
-
-        if stack.sizes.get(bdim, 0) == 0:
-            print(f"[{y}] Stack has 0 bands — likely no valid imagery overlaps AOI. Skipping year.")
-            continue
-
-        asset_names = [red_key, nir_key, qa_key]
-        if (
-            (bdim not in stack.coords)
-            or (stack.coords[bdim].dtype.kind not in ("U", "O"))
-            or (stack.coords[bdim].size != 3)
-        ):
-            stack = stack.assign_coords({bdim: np.array(asset_names, dtype=object)})
-            print(f"[{y}] Relabeled band coord -> {asset_names}")
-
-        # Select dataset-appropriate bands (keep QA native)
-        red = stack.sel({bdim: red_key}).astype("float32")
-        nir = stack.sel({bdim: nir_key}).astype("float32")
-        qa  = stack.sel({bdim: qa_key})
-
-        # Treat sensor zeros as missing so they don't pollute NDVI
-        red = red.where(red != 0)
-        nir = nir.where(nir != 0)
+        if (not cloud_select.CLOUD_SELECT and isinstance(MAX_SCENES, int) and MAX_SCENES > 0
+                and len(items) > MAX_SCENES):
+            items = items[:MAX_SCENES]
+            print(f"Throttling to first {MAX_SCENES} scenes for speed…")
+        rec["kept"] = len(items)
+
+    if cloud_select.CLOUD_SELECT:
+        # AOI-local clear fractions from coarse QA reads pick the scenes (MAX_SCENES caps them).
+        # Its own stage: QA reads aren't search latency.
+        with run_log.stage("cloud_select", y, dataset=ds_name) as rec:
+            aoi_gdf = gpd.GeoDataFrame.from_features(aoi_geojson["features"], crs=4326)
+            items, covered = cloud_select.select_scenes(
+                items, qa_key, cfg["mask"], aoi_gdf, catalog=stac_cache.get_catalog(CATALOG),
+                max_scenes=MAX_SCENES if isinstance(MAX_SCENES, int) and MAX_SCENES > 0 else None, stats=rec,
+            )
+            print(f"[{y}] Cloud-aware selection: {len(items)} scenes give {covered:.0%} of the AOI "
+                  f"{cloud_select.CLEAR_OBS}+ clear looks (target {cloud_select.TARGET_CLEAR:.0%})")
+            rec["kept"] = len(items)
+    if not items:
+        print(f"No usable scenes for {y}; skipping.")
+        return None
+
+    if PLAN_DIR:
+        scene_plan.save_plan(scene_plan.items_table(items, cfg["mask"]), pl.Path(PLAN_DIR) / f"plan_{y}.json")
+
+    return {
+        "year": y,
+        "dataset": ds_name,
+        "cfg": cfg | {"_resolved_assets": (red_key, nir_key, qa_key)},
+        "items": items,
+    }
+
+def composite_for_year(plan, aoi_gdf, epsg=None, bounds=None, out_grid=None):
+    """
+    Build the lazy seasonal NDVI composite for a plan from plan_year(), or
+    None. `epsg` / `bounds` restrict it to one processing tile; otherwise
+    `out_grid` (grid.json) fixes the output grid, so every year lines up.
+    """
+    y, cfg, items = plan["year"], plan["cfg"], plan["items"]
+    red_key, nir_key, qa_key = cfg["_resolved_assets"]
+    snap_to = out_grid if bounds is None else None
+    if snap_to:
+        epsg, bounds = snap_to["epsg"], grid.bounds(snap_to)
+
+    # Build the stack using resolved asset keys
+    print(f"[{y}] Building stack at 30m and clipping to {'AOI' if bounds is None or snap_to else 'tile'} …")
+    stack = stack_for_year(items, aoi_gdf, cfg, resolution=30, epsg=epsg, bounds=bounds)
+    print(
+        f"[{y}] Stack ready: {tuple(stack.sizes.get(k) for k in ['time','y','x'])} (time, y, x), "
+        f"{stack.nbytes / 2**20:.0f} MiB as {stack.dtype}"
+    )
 
+    if "band" not in stack.dims and "bands" not in stack.dims:
+        print(f"[{y}] No 'band' dimension found; skipping year.")
+        return None
+    bdim = "band" if "band" in stack.dims else "bands"
+
+    if stack.sizes.get(bdim, 0) == 0:
+        print(f"[{y}] Stack has 0 bands — likely no valid imagery overlaps AOI. Skipping year.")
+        return None
+
+    asset_names = [red_key, nir_key, qa_key]
+    if (
+        (bdim not in stack.coords)
+        or (stack.coords[bdim].dtype.kind not in ("U", "O"))
+        or (stack.coords[bdim].size != 3)
+    ):
+        stack = stack.assign_coords({bdim: np.array(asset_names, dtype=object)})
+        print(f"[{y}] Relabeled band coord -> {asset_names}")
+
+    # Rasterize the AOI once on this grid; chunks outside it are never read.
+    inside, kept, total = None, None, None
+    if aoi_mask.AOI_CLIP:
+        inside = aoi_mask.rasterize(aoi_gdf, stack)
+        stack, kept, total = aoi_mask.cull_chunks(stack, inside)
+        if total:
+            print(f"[{y}] AOI polygon touches {kept}/{total} spatial chunks; reading only those")
+    # Upper bound on bytes fetched per asset: every kept chunk of every scene.
+    read_frac = kept / total if total else 1.0
+    per_asset_mib = stack.nbytes / stack.sizes[bdim] * read_frac / 2**20
+
+    # Select dataset-appropriate bands (all stay native DNs until the reduce)
+    red = stack.sel({bdim: red_key})
+    nir = stack.sel({bdim: nir_key})
+    qa  = stack.sel({bdim: qa_key})
+
+    reducer = REDUCER
+    if COMPOSITE_MODE == "fused":
+        print(f"[{y}] Computing NDVI + mask + {reducer} composite (fused kernel) …")
+        ndvi_med = composite_ndvi_mixed(red, nir, qa, cfg, reducer)
+    else:
         print(f"[{y}] Computing NDVI + cloud/snow/water mask …")
-        ndvi_t = compute_ndvi_mixed(red, nir, cfg)           # applies per-dataset scale/offset safely
+        ndvi_t = compute_ndvi_mixed(red, nir, cfg)           # float32 scale/offset + NDVI per chunk
+        ndvi_t = ndvi_t.where((red != 0) & (nir != 0))       # sensor zeros / fill are missing, not dark
         ndvi_t = mask_clouds_mixed(qa, ndvi_t, cfg)          # S2 SCL vs Landsat QA_PIXEL handled here
 
+        if COMPOSITE_MODE == "stream":
+            print(f"[{y}] Streaming seasonal composite ({reducer}) over {ndvi_t.sizes['time']} scenes …")
+            ndvi_med, _ = reducers.stream_reduce(ndvi_t, reducer)
+        else:
+            print(f"[{y}] Reducing to seasonal composite ({reducer}) …")
+            ndvi_med = reduce_ndvi_over_time(ndvi_t, reducer)
+    ndvi_med = ndvi_med.where(np.isfinite(ndvi_med))
+    if inside is not None:
+        ndvi_med = ndvi_med.where(inside)  # NoData outside the polygon
+
+    run_log.log(
+        "graph", y,
+        tile=list(bounds) if bounds is not None and not snap_to else None,
+        time_steps=stack.sizes["time"], shape=[stack.sizes["y"], stack.sizes["x"]],
+        chunks_read=kept, chunks_total=total,
+        # shape × dtype of what the graph may read, not measured I/O
+        read_mib_upper_bound=round(per_asset_mib * len(asset_names), 1),
+        read_mib_upper_bound_per_asset={a: round(per_asset_mib, 1) for a in asset_names},
+        tasks=len(ndvi_med.data.__dask_graph__()) if ndvi_med.chunks else 0,
+    )
+
+    crs = nir.rio.crs or stack.rio.crs or f"EPSG:{epsg or tiling.output_epsg(aoi_gdf)}"
+    ndvi_med.rio.write_crs(crs, inplace=True)
+    ndvi_med.rio.write_transform(stack.attrs.get("transform") or nir.rio.transform(), inplace=True)
+    if snap_to:
+        ndvi_med = grid.snap(ndvi_med, snap_to)
+    return ndvi_med
+
+def build_year(plan, aoi_gdf, outdir):
+    """Compute one year's composite and write it as a COG. Returns the path or None."""
+    y = plan["year"]
+    out_tif = pl.Path(outdir) / f"ndvi_median_{y}.tif"
+    out_grid = grid.load_grid(outdir)
+    timings = {}
+    with run_log.stage("build", y) as rec, run_log.dask_report(y):
+        if tiling.TILE_PX > 0:
+            def _tile(items, epsg, bounds):
+                return composite_for_year(plan | {"items": items}, aoi_gdf, epsg=epsg, bounds=bounds)
+
+            with track_peak_rss() as rss:
+                out = tiling.build_tiled(plan["items"], aoi_gdf, out_tif, _tile, resolution=30,
+                                         label=f"[{y}] ", timings=timings, grid=out_grid)
+                if out is not None and pyramid.PYRAMID_LEVELS:
+                    pyramid.from_cog(out, outdir, y)  # tiles are gone; aggregate the finished COG
+        else:
+            ndvi_med = composite_for_year(plan, aoi_gdf, out_grid=out_grid)
+            out = None
+            if ndvi_med is not None:
+                # Pyramid levels aggregate the same lazy composite, so they're written in this pass.
+                levels = pyramid.levels_for(ndvi_med, outdir, y)
+                print(f"[{y}] Writing COG → {out_tif}"
+                      + (f" (+ {', '.join(f'{r} m' for r in pyramid.PYRAMID_LEVELS)})" if levels else "") + " …")
+                with track_peak_rss() as rss:
+                    write_cogs([ndvi_med.data] + [c.data for _, c in levels], [out_tif] + [p for p, _ in levels],
+                               ndvi_med.rio.crs, [ndvi_med.rio.transform()] + [c.rio.transform() for _, c in levels],
+                               timings=timings)
+                out = out_tif
+        rec["output"] = str(out) if out else None
+    if out is None:
+        return None
+
+    print(f"Saved {out_tif}")
+    print(
+        f"[{y}] Peak RSS {rss['peak'] / 2**20:.0f} MiB "
+        f"(+{(rss['peak'] - rss['start']) / 2**20:.0f} MiB during compute/write)"
+    )
+    run_log.log("compute", y, seconds=timings.get("compute_s"),
+                peak_rss_mib=round(rss["peak"] / 2**20), rss_delta_mib=round((rss["peak"] - rss["start"]) / 2**20))
+    run_log.log("finalize", y, seconds=timings.get("finalize_s"))
+    return out_tif
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # bytes on macOS (no /proc)
+        except ImportError:
+            return 0
+
+@contextmanager
+def track_peak_rss(interval=0.25):
+    """Sample this process's RSS in the background; yields {'start', 'peak'} in bytes."""
+    rss = {"start": _rss_bytes()}
+    rss["peak"] = rss["start"]
+    stop = threading.Event()
+
+    def _poll():
+        while not stop.wait(interval):
+            rss["peak"] = max(rss["peak"], _rss_bytes())
+
+    t = threading.Thread(target=_poll, name="rss-poll", daemon=True)
+    t.start()
+    try:
+        yield rss
+    finally:
+        stop.set()
+        t.join()
+        rss["peak"] = max(rss["peak"], _rss_bytes())
+
+def _init_year_worker(threads, memory):
+    # Runs once in each YEAR_WORKERS process: own thread pool, no interleaved
+    # progress bars, and an optional address-space cap so one runaway year
+    # fails with MemoryError instead of taking the whole box down.
+    dask.config.set(scheduler="threads", num_workers=threads)
+    _progress.unregister()
+    if memory:
+        try:
+            import resource
+            limit = parse_bytes(memory)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"Warning: unable to apply YEAR_MEMORY={memory}: {e}")
+
+def run_years(years, aoi_gdf, aoi_geojson, outdir, workers=None):
+    """
+    Build composites for `years`.
+
+    STAC search runs ahead of compute on a background thread, so searching
+    year N+1 overlaps with building year N. With workers > 1 the builds run in
+    a process pool, each process using DASK_THREADS threads and the optional
+    YEAR_MEMORY cap. Years whose manifest entry matches the current inputs are
+    skipped unless FORCE_REBUILD is set. Every year is built on the AOI's
+    canonical pixel grid (grid.json in `outdir`). Per-stage metrics go to the run log
+    and a per-year summary is printed at the end. Returns {year: path} for
+    the composites written.
+    """
+    workers = max(1, int(workers if workers is not None else YEAR_WORKERS))
+    built = manifest.load_manifest(outdir)
+    aoi_digest = manifest.aoi_hash(aoi_geojson)
+    params = build_params()
+    out_grid = grid.ensure_grid(outdir, aoi_gdf, aoi_digest, resolution=30)  # every year is built on it
+    pyramid.save_level_grids(outdir, out_grid)
+    years = list(years)
+    todo = iter(years)
+    searches = deque()
+    builds = {}
+    written, failed = {}, {}
+
+    pool = None
+    if workers > 1:
+        print(f"Building up to {workers} years in parallel ({DASK_THREADS} threads each"
+              + (f", {YEAR_MEMORY} cap" if YEAR_MEMORY else "") + ")")
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp.get_context("spawn"),  # no fork with live dask/GDAL threads
+            initializer=_init_year_worker,
+            initargs=(DASK_THREADS, YEAR_MEMORY),
+        )
 
-        reducer = os.getenv("REDUCER", "max").lower()
-        print(f"[{y}] Reducing to seasonal composite ({reducer}) …")
-        ndvi_t = ndvi_t.chunk({"time": 1, "y": 1024, "x": 1024})
-        ndvi_med = reduce_ndvi_over_time(ndvi_t, reducer)
-        ndvi_med = ndvi_med.where(np.isfinite(ndvi_med))
+    def _record(y, entry, fn, *args):
+        try:
+            out = fn(*args)
+        except Exception as e:
+            print(f"[{y}] Failed: {e!r}")
+            run_log.log("failed", y, error=repr(e))
+            failed[y] = e
+            return
+        if out is not None:
+            written[y] = out
+            manifest.record(built, y, entry)
+            manifest.save_manifest(outdir, built)
+            if cube.CUBE_PATH:
+                cube.append_year(cube.CUBE_PATH, y, out, provenance=built[str(y)])
+
+    def _drain(bar, until):
+        while len(builds) > until:
+            done, _ = wait(builds, return_when=FIRST_COMPLETED)
+            for fut in done:
+                y, entry = builds.pop(fut)
+                _record(y, entry, fut.result)
+                bar.update(1)
+
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="stac-search") as searcher, \
+                tqdm(total=len(years), desc="Years") as bar:
+
+            def _search_next():
+                y = next(todo, None)
+                if y is not None:
+                    searches.append((y, searcher.submit(plan_year, y, aoi_geojson)))
+
+            # Keep only a small lookahead so signed URLs don't go stale waiting.
+            for _ in range(workers + 1):
+                _search_next()
+
+            while searches:
+                y, fut = searches.popleft()
+                plan = fut.result()
+                _search_next()
+                if plan is None:
+                    bar.update(1)
+                    continue
+                entry = manifest.year_entry(
+                    aoi_digest, params, plan["dataset"], [it.id for it in plan["items"]]
+                )
+                out_tif = pl.Path(outdir) / f"ndvi_median_{y}.tif"
+                if not FORCE_REBUILD and manifest.is_current(built, y, entry, out_tif):
+                    print(f"[{y}] Composite is current (manifest); skipping.")
+                    run_log.log("skip", y, fingerprint=entry["fingerprint"])
+                    if pyramid.missing(outdir, y):
+                        print(f"[{y}] Adding pyramid levels from the existing composite …")
+                        pyramid.from_cog(out_tif, outdir, y, pyramid.missing(outdir, y))
+                    if cube.CUBE_PATH and y not in cube.cube_years(cube.CUBE_PATH):
+                        cube.append_year(cube.CUBE_PATH, y, out_tif, provenance=built[str(y)])
+                    bar.update(1)
+                elif pool is None:
+                    _record(y, entry, build_year, plan, aoi_gdf, outdir)
+                    bar.update(1)
+                else:
+                    builds[pool.submit(build_year, plan, aoi_gdf, outdir)] = (y, entry)
+                    _drain(bar, until=workers - 1)
+            _drain(bar, until=0)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    run_log.report()
+    if failed:
+        raise RuntimeError(f"{len(failed)} year(s) failed: {sorted(failed)}")
+    return written
 
-        out_tif = outdir / f"ndvi_median_{y}.tif"
-        crs = nir.rio.crs or stack.rio.crs or aoi_gdf.estimate_utm_crs()
-        ndvi_med.rio.write_crs(crs, inplace=True)
-        ndvi_med.rio.write_transform(nir.rio.transform(), inplace=True)
+def main():
+    aoi_gdf, aoi_geojson = load_aoi("data/aoi/roi.geojson")
+    # save NDVI composites under data/composites/ (what your app expects)
+    outdir = pl.Path("data/composites")
+    outdir.mkdir(parents=True, exist_ok=True)
+    years = list(range(1985, 2025))
 
-        print(f"[{y}] Writing COG → {out_tif} …")
-        ndvi_med.rio.to_raster(out_tif, driver="COG", compress="DEFLATE", dtype="float32")
-        print(f"Saved {out_tif}")
+    #years = [1995]  # : 2020, 2021, 2022, 2023, 2024
+    run_years(years, aoi_gdf, aoi_geojson, outdir)
 
     print("Done.")
 
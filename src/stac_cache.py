@@ -0,0 +1,230 @@
+# src/stac_cache.py
+import hashlib
+import json
+import os
+import pathlib as pl
+import threading
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+import pystac
+from shapely.geometry import shape
+
+# ---- Settings ----
+# STAC_CACHE_DIR: where search results are stored ("none" disables the disk cache).
+# STAC_CACHE_TTL_HOURS: lifetime of results for windows that may still get new scenes.
+# STAC_SETTLE_DAYS: a window that ended this long before the search is treated as final.
+# SIGN_MARGIN_MINUTES: re-sign an item when its SAS token expires within this margin.
+_cache_env = os.getenv("STAC_CACHE_DIR", "data/cache/stac").strip()
+STAC_CACHE_DIR = None if _cache_env.lower() in ("", "none") else pl.Path(_cache_env)
+STAC_CACHE_TTL_HOURS = float(os.getenv("STAC_CACHE_TTL_HOURS", "24"))
+STAC_SETTLE_DAYS = int(os.getenv("STAC_SETTLE_DAYS", "30"))
+SIGN_MARGIN_MINUTES = int(os.getenv("SIGN_MARGIN_MINUTES", "10"))
+PAGE_SIZE = 1000  # MPC maximum; fewer round trips when paging large windows
+
+_NEVER = datetime.max.replace(tzinfo=timezone.utc)
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+def _as_date(d) -> date:
+    return d if isinstance(d, date) and not isinstance(d, datetime) else date.fromisoformat(str(d)[:10])
+
+def cache_key(collection, geometry, start, end, query=None) -> str:
+    blob = json.dumps(
+        {"collection": collection, "geometry": geometry, "datetime": f"{start}/{end}", "query": query or {}},
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def token_expiry(item) -> datetime:
+    """Earliest `se=` (SAS expiry) across the item's asset hrefs; unsigned items never expire."""
+    expiry = _NEVER
+    for asset in item.assets.values():
+        se = parse_qs(urlparse(asset.href).query).get("se")
+        if not se:
+            continue
+        try:
+            t = datetime.fromisoformat(se[0].replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        expiry = min(expiry, t)
+    return expiry
+
+def unsign(item):
+    """Copy of `item` without SAS tokens in its asset hrefs, safe to persist; sign() adds fresh ones."""
+    clean = item.clone()
+    for asset in clean.assets.values():
+        if "sig" in parse_qs(urlparse(asset.href).query):
+            asset.href = asset.href.split("?", 1)[0]
+    return clean
+
+def _match_query(props, query) -> bool:
+    ops = {
+        "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+        "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+        "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+        "in": lambda a, b: a in b,
+    }
+    for prop, conds in (query or {}).items():
+        val = props.get(prop)
+        if val is None:
+            return False
+        for op, ref in conds.items():
+            if not ops[op](val, ref):
+                return False
+    return True
+
+class LocalCatalog:
+    """
+    Offline stand-in for the STAC API: a directory of item JSON files
+    (single Items or FeatureCollections), searched in memory.
+    """
+
+    def __init__(self, root):
+        self.root = pl.Path(root)
+        self._items = None
+
+    def _load(self):
+        items = []
+        for p in sorted(self.root.rglob("*.json")):
+            data = json.loads(p.read_text())
+            feats = data.get("features", []) if data.get("type") == "FeatureCollection" else [data]
+            for f in feats:
+                it = pystac.Item.from_dict(f)
+                it.set_self_href(str(p.resolve()))
+                it.make_asset_hrefs_absolute()
+                items.append(it)
+        print(f"Local catalog {self.root}: {len(items)} items")
+        return items
+
+    def search(self, collection, geometry, start, end, query=None):
+        if self._items is None:
+            self._items = self._load()
+        aoi = shape(geometry)
+        start, end = _as_date(start), _as_date(end)
+        return [
+            it for it in self._items
+            if it.collection_id == collection
+            and start <= it.datetime.date() <= end
+            and _match_query(it.properties, query)
+            and shape(it.geometry).intersects(aoi)
+        ]
+
+class CachedCatalog:
+    """
+    STAC search with a persistent on-disk cache of item JSON and lazy signing.
+
+    `source` is the STAC API URL or, for offline runs, a directory of item JSON.
+    One client is opened per catalog and reused for every search.
+    """
+
+    def __init__(self, source, cache_dir=STAC_CACHE_DIR, ttl_hours=STAC_CACHE_TTL_HOURS):
+        self.source = str(source)
+        self.offline = not self.source.startswith(("http://", "https://"))
+        self.cache_dir = None if (cache_dir is None or self.offline) else pl.Path(cache_dir)
+        self.ttl = timedelta(hours=ttl_hours)
+        self._client = None
+        self._signed = {}  # item id -> (signed item, token expiry)
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            if self.offline:
+                self._client = LocalCatalog(self.source)
+            else:
+                from pystac_client import Client
+                self._client = Client.open(self.source)
+        return self._client
+
+    # ---- search ----
+    def search(self, collection, geometry, start, end, query=None):
+        """Unsigned items for the window, from the disk cache when it is still valid."""
+        key = cache_key(collection, geometry, start, end, query)
+        items = self._read(key)
+        if items is not None:
+            return items
+        items = self._fetch(collection, geometry, start, end, query)
+        self._write(key, items, end)
+        return items
+
+    def _fetch(self, collection, geometry, start, end, query):
+        client = self.client()
+        if self.offline:
+            return client.search(collection, geometry, start, end, query)
+        search = client.search(
+            collections=[collection],
+            intersects=geometry,
+            datetime=f"{start}/{end}",
+            query=query or None,
+            limit=PAGE_SIZE,
+        )
+        return list(search.items())
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: dropping unreadable STAC cache entry {path.name}: {e}")
+            return None
+        if not data.get("final"):
+            fetched = datetime.fromisoformat(data["fetched"])
+            if _utcnow() - fetched > self.ttl:
+                return None
+        return [pystac.Item.from_dict(f) for f in data["features"]]
+
+    def _write(self, key, items, end):
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        now = _utcnow()
+        payload = {
+            "fetched": now.isoformat(),
+            # Late ingestion can still add scenes to a recent window; older ones are final.
+            "final": _as_date(end) + timedelta(days=STAC_SETTLE_DAYS) < now.date(),
+            "features": [it.to_dict(transform_hrefs=False) for it in items],
+        }
+        tmp = self._path(key).with_suffix(".tmp")
+        tmp.write_text(json.dumps(payload))
+        os.replace(tmp, self._path(key))
+
+    # ---- signing ----
+    def sign(self, items, force=False):
+        """
+        Signed copies of `items`. A previously signed copy is reused until its
+        token is within SIGN_MARGIN_MINUTES of expiring; `force` re-signs anyway
+        (e.g. after a read was rejected).
+        """
+        if self.offline:
+            return list(items)
+        import planetary_computer as pc
+
+        deadline = _utcnow() + timedelta(minutes=SIGN_MARGIN_MINUTES)
+        out = []
+        with self._lock:
+            for it in items:
+                hit = self._signed.get(it.id)
+                if hit is None or force or hit[1] <= deadline:
+                    signed = pc.sign(it)
+                    hit = self._signed[it.id] = (signed, token_expiry(signed))
+                out.append(hit[0])
+        return out
+
+_catalogs = {}
+
+def get_catalog(source) -> CachedCatalog:
+    """Per-process catalog for `source`, so the client and signatures are reused across years."""
+    source = str(source)
+    if source not in _catalogs:
+        _catalogs[source] = CachedCatalog(source)
+    return _catalogs[source]
@@ -0,0 +1,169 @@
+# src/tiling.py
+import math
+import os
+import pathlib as pl
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import rasterio
+from affine import Affine
+from pyproj import CRS
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+from shapely.geometry import box, mapping, shape
+
+from cog_writer import finalize_cog, scratch_profile
+
+# Tiled execution for AOIs too large for one stack. The AOI's bounds are
+# snapped to the output pixel grid and cut into TILE_PX² processing tiles;
+# each tile gets its own small stack and composite, and its pixels are
+# written straight into a scratch GeoTIFF, which becomes the final COG. Peak
+# memory follows TILE_PX and TILE_WORKERS, not the AOI size.
+#
+# TILE_PX: processing tile size in output pixels (0 = single stack, the default).
+# TILE_WORKERS: tiles computed concurrently (each with the DASK_THREADS pool).
+# OUTPUT_CRS: EPSG code for the output grid; otherwise the AOI's UTM zone
+#             (required when the AOI spans more than one zone).
+TILE_PX = int(os.getenv("TILE_PX", "0"))
+TILE_WORKERS = max(1, int(os.getenv("TILE_WORKERS", "2")))
+OUTPUT_CRS = os.getenv("OUTPUT_CRS", "").strip() or None
+
+# ---- Output CRS ----
+def utm_zones(aoi_gdf) -> list:
+    """UTM zone numbers the AOI's lon/lat bounds span (west to east)."""
+    minx, _, maxx, _ = aoi_gdf.to_crs(4326).total_bounds
+    zone = lambda lon: min(60, int((lon + 180) // 6) + 1)
+    return list(range(zone(minx), zone(maxx) + 1))
+
+def output_epsg(aoi_gdf, override=OUTPUT_CRS) -> int:
+    """
+    EPSG code of the output grid. OUTPUT_CRS wins; otherwise the UTM zone of
+    the AOI. An AOI that spans several zones has no single right UTM grid
+    (pixels away from the zone are increasingly distorted), so it raises
+    ValueError asking for an OUTPUT_CRS that fits the whole AOI.
+    """
+    if override:
+        epsg = CRS.from_user_input(override).to_epsg()
+        if epsg is None:
+            raise ValueError(f"OUTPUT_CRS={override!r} has no EPSG code; stackstac needs one")
+        return epsg
+    utm = aoi_gdf.estimate_utm_crs()
+    if utm is None:
+        warnings.warn("No UTM zone fits the AOI; using EPSG:4326. Set OUTPUT_CRS.", stacklevel=2)
+        return 4326
+    zones = utm_zones(aoi_gdf)
+    if len(zones) > 1:
+        raise ValueError(
+            f"AOI spans UTM zones {zones[0]}–{zones[-1]}, so no single UTM grid fits it. "
+            f"Set OUTPUT_CRS to an EPSG code that covers the whole AOI (e.g. an equal-area CRS)."
+        )
+    return utm.to_epsg()
+
+# ---- Pixel grid and tiles ----
+def pixel_grid(bounds, resolution):
+    """Bounds snapped outward to multiples of `resolution`: (transform, width, height)."""
+    minx, miny, maxx, maxy = bounds
+    minx = math.floor(minx / resolution) * resolution
+    maxy = math.ceil(maxy / resolution) * resolution
+    width = max(1, math.ceil((maxx - minx) / resolution))
+    height = max(1, math.ceil((maxy - miny) / resolution))
+    return Affine(resolution, 0, minx, 0, -resolution, maxy), width, height
+
+def tile_windows(width, height, tile_px=TILE_PX):
+    """Row-major grid of output-pixel windows, each at most tile_px² (edges are clipped)."""
+    for row in range(0, height, tile_px):
+        for col in range(0, width, tile_px):
+            yield Window(col, row, min(tile_px, width - col), min(tile_px, height - row))
+
+def window_bounds(window, transform):
+    left, top = transform * (window.col_off, window.row_off)
+    right, bottom = transform * (window.col_off + window.width, window.row_off + window.height)
+    return left, bottom, right, top
+
+def plan_tiles(aoi_gdf, epsg, resolution, tile_px=TILE_PX, grid=None):
+    """
+    Output grid for the AOI in `epsg` (or the persisted `grid`, see grid.py)
+    plus the tiles that touch its polygon: (transform, width, height, [(window, bounds)]).
+    """
+    aoi = aoi_gdf.to_crs(epsg)
+    if grid:
+        transform, width, height = Affine(*grid["transform"]), grid["width"], grid["height"]
+    else:
+        transform, width, height = pixel_grid(aoi.total_bounds, resolution)
+    area = aoi.union_all() if hasattr(aoi, "union_all") else aoi.unary_union
+    tiles = []
+    for win in tile_windows(width, height, tile_px):
+        bounds = window_bounds(win, transform)
+        if box(*bounds).intersects(area):
+            tiles.append((win, bounds))
+    return transform, width, height, tiles
+
+def items_in(items, bounds, epsg):
+    """Items whose footprint intersects `bounds` (given in `epsg`)."""
+    tile = shape(transform_geom(f"EPSG:{epsg}", "EPSG:4326", mapping(box(*bounds))))
+    return [it for it in items if it.geometry and shape(it.geometry).intersects(tile)]
+
+# ---- Tiled build ----
+def build_tiled(items, aoi_gdf, out_tif, composite_fn, resolution=30, tile_px=TILE_PX,
+                workers=TILE_WORKERS, label="", timings=None, grid=None):
+    """
+    Composite the AOI tile by tile into `out_tif`. `composite_fn(items, epsg,
+    bounds)` returns one tile's lazy (y, x) composite, or None. Tiles outside
+    the AOI polygon, or without scenes, stay NoData. Returns the path, or None
+    if no tile produced data. `timings` gets compute_s and finalize_s as in
+    write_cogs. With `grid` the output is that persisted grid.
+    """
+    out_tif = pl.Path(out_tif)
+    epsg = grid["epsg"] if grid else output_epsg(aoi_gdf)
+    transform, width, height, tiles = plan_tiles(aoi_gdf, epsg, resolution, tile_px, grid)
+    total = math.ceil(width / tile_px) * math.ceil(height / tile_px)
+    print(f"{label}Tiled build: {width}×{height} px in EPSG:{epsg}, "
+          f"{len(tiles)}/{total} tiles of {tile_px}² touch the AOI ({workers} at a time)")
+
+    scratch = out_tif.with_name(out_tif.stem + ".scratch.tif")
+    profile = scratch_profile(f"EPSG:{epsg}", transform, width, height) | {"sparse_ok": True}
+    lock = threading.Lock()
+    written = 0
+
+    def _one(win, bounds):
+        tile_items = items_in(items, bounds, epsg)
+        if not tile_items:
+            return False
+        comp = composite_fn(tile_items, epsg, bounds)
+        if comp is None:
+            return False
+        values = np.asarray(comp.values, dtype="float32")
+        if values.shape != (win.height, win.width):
+            raise ValueError(f"tile {win} came back {values.shape}; grid is misaligned")
+        with lock:
+            dst.write(values, 1, window=win)
+        return True
+
+    t = time.perf_counter()
+    try:
+        with rasterio.open(scratch, "w", **profile) as dst, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile") as pool:
+            futures = {pool.submit(_one, win, bounds): win for win, bounds in tiles}
+            try:
+                for i, fut in enumerate(as_completed(futures), 1):
+                    written += bool(fut.result())
+                    print(f"{label}Tile {i}/{len(tiles)} done")
+            except BaseException:
+                for f in futures:  # a failed tile fails the build; don't start the rest
+                    f.cancel()
+                raise
+
+        t_final = time.perf_counter()
+        if not written:
+            print(f"{label}No tile had scenes; nothing written.")
+            return None
+        out = finalize_cog(scratch, out_tif)
+    finally:
+        scratch.unlink(missing_ok=True)  # finalize_cog removes it too; this covers failures
+    if timings is not None:
+        timings["compute_s"] = round(t_final - t, 3)
+        timings["finalize_s"] = round(time.perf_counter() - t_final, 3)
+    return out
@@ -0,0 +1,13 @@
+# tests/conftest.py
+import os
+import pathlib as pl
+import sys
+
+ROOT = pl.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "app"))
+sys.path.insert(0, str(ROOT / "benchmarks"))  # synthetic scenes and items
+
+# search_download reads these at import: no STAC search cache, no run log
+os.environ.setdefault("STAC_CACHE_DIR", "none")
+os.environ.setdefault("RUN_LOG", "none")
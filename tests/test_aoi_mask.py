@@ -0,0 +1,71 @@
+# tests/test_aoi_mask.py
+import dask.array as da
+import geopandas as gpd
+import numpy as np
+import xarray as xr
+from rasterio.transform import from_origin
+from shapely.geometry import Polygon
+
+import aoi_mask
+import grid
+import search_download as sd
+from synthetic import write_scenes
+
+ORIGIN = (499_980.0, 9_000_000.0)
+LANDSAT = sd.DATASETS["L89"] | {"assets": {"red": "red", "nir": "nir", "qa": "qa"}}
+
+def _l_shape(x0, y0, px, arm):
+    """L-shaped AOI in EPSG:32721: a px×arm bar down the left and an arm×px bar along the bottom (30 m pixels)."""
+    s = 30.0
+    ring = [(x0, y0), (x0 + arm * s, y0), (x0 + arm * s, y0 - (px - arm) * s), (x0 + px * s, y0 - (px - arm) * s),
+            (x0 + px * s, y0 - px * s), (x0, y0 - px * s)]
+    return gpd.GeoDataFrame(geometry=[Polygon(ring)], crs=32721)
+
+def test_grid_mask_follows_the_polygon():
+    aoi = _l_shape(*ORIGIN, px=64, arm=16)
+    inside = aoi_mask.grid_mask(aoi, "EPSG:32721", from_origin(*ORIGIN, 30, 30), (64, 64))
+    assert inside[:, :16].all() and inside[48:, :].all()
+    assert not inside[:47, 17:].any()
+
+def test_cull_chunks_never_computes_chunks_outside():
+    aoi = _l_shape(*ORIGIN, px=64, arm=16)
+    read = []
+    def source(block, block_info=None):
+        read.append(tuple(block_info[None]["chunk-location"][-2:]))
+        return np.ones_like(block)
+    data = da.map_blocks(source, da.zeros((2, 64, 64), dtype="uint16", chunks=(1, 16, 16)), dtype="uint16")
+    stack = xr.DataArray(data, dims=("time", "y", "x"),
+                         coords={"y": ORIGIN[1] - 15 - 30 * np.arange(64), "x": ORIGIN[0] + 15 + 30 * np.arange(64)})
+    stack = stack.rio.write_crs(32721).rio.write_transform(from_origin(*ORIGIN, 30, 30))
+
+    inside = aoi_mask.rasterize(aoi, stack)
+    culled, kept, total = aoi_mask.cull_chunks(stack, inside)
+    assert (kept, total) == (7, 16)                     # the left column and the bottom row of chunks
+
+    values = culled.values
+    touched = {(iy, ix) for iy in range(4) for ix in range(4) if ix == 0 or iy == 3}
+    assert set(read) == touched and len(read) == 2 * len(touched)   # two time steps each
+    for iy in range(4):
+        for ix in range(4):
+            block = values[:, iy * 16:(iy + 1) * 16, ix * 16:(ix + 1) * 16]
+            assert (block == (1 if (iy, ix) in touched else 0)).all()
+
+    full = xr.full_like(inside, True)
+    assert aoi_mask.cull_chunks(stack, full)[0] is stack
+
+def test_composite_is_nodata_outside_the_polygon(tmp_path, monkeypatch):
+    items = write_scenes(tmp_path, "landsat", 64, 2, origin=ORIGIN)
+    aoi = _l_shape(*ORIGIN, px=64, arm=16)
+    out_grid = grid.define(aoi, resolution=30, epsg=32721)
+    plan = {"year": 2020, "items": items, "cfg": LANDSAT | {"_resolved_assets": ("red", "nir", "qa")}}
+    monkeypatch.setattr(sd, "CHUNK_SIZE", 16)
+
+    monkeypatch.setattr(aoi_mask, "AOI_CLIP", False)
+    box_read = sd.composite_for_year(plan, aoi, out_grid=out_grid).values
+    monkeypatch.setattr(aoi_mask, "AOI_CLIP", True)
+    clipped = sd.composite_for_year(plan, aoi, out_grid=out_grid).values
+
+    inside = aoi_mask.grid_mask(aoi, "EPSG:32721", grid.affine(out_grid), clipped.shape)
+    assert np.isnan(clipped[~inside]).all()
+    np.testing.assert_array_equal(clipped[inside], box_read[inside])
+    assert np.isfinite(box_read[~inside]).any()        # the bounding box had data there
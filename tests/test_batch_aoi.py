@@ -0,0 +1,25 @@
+# tests/test_batch_aoi.py
+from datetime import datetime, timezone
+
+import geopandas as gpd
+import pystac
+from shapely.geometry import box, mapping
+
+import manifest
+from batch_aoi import aoi_item_ids
+
+def _item(item_id, geom):
+    return pystac.Item(item_id, mapping(geom), list(geom.bounds), datetime(2020, 1, 1, tzinfo=timezone.utc), {})
+
+def test_fingerprint_ignores_scenes_that_only_touch_a_neighbour():
+    aois = gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1), box(1.02, 0, 2, 1)], index=["a", "b"], crs=4326)
+    shared = _item("shared", box(-1, -1, 3, 2))
+    only_b = _item("only_b", box(1.5, 0, 2.5, 1))
+
+    def entry(a, items):
+        return manifest.year_entry("aoi", {}, "L89", aoi_item_ids(items, aois.geometry[a]))
+
+    assert aoi_item_ids([shared, only_b], aois.geometry["a"]) == ["shared"]
+    assert aoi_item_ids([shared, only_b], aois.geometry["b"]) == ["shared", "only_b"]
+    assert entry("a", [shared]) == entry("a", [shared, only_b])
+    assert entry("b", [shared]) != entry("b", [shared, only_b])
@@ -0,0 +1,68 @@
+# tests/test_change_layers.py
+import os
+from collections import Counter
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import change_layers
+
+YEARS = (2019, 2020, 2021, 2022)
+
+def _setup(tmp_path, monkeypatch):
+    comp, change = tmp_path / "composites", tmp_path / "change"
+    comp.mkdir()
+    for i, year in enumerate(YEARS):
+        with rasterio.open(comp / f"ndvi_median_{year}.tif", "w", driver="GTiff", width=16, height=16, count=1,
+                           dtype="float32", crs="EPSG:32721", transform=from_origin(499_980.0, 9_000_000.0, 30, 30),
+                           nodata=np.nan) as dst:
+            dst.write(np.full((16, 16), 0.1 * i, dtype="float32"), 1)
+    monkeypatch.setattr(change_layers, "CHANGE_DIR", change)
+    monkeypatch.setattr(change_layers, "level_dir", lambda level=None: comp)
+    monkeypatch.setattr(change_layers, "_in_flight", Counter())
+    monkeypatch.setattr(change_layers, "_displayed", None)
+    return change
+
+def _fake_deltas(change, n):
+    change.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n):
+        p = change / f"ndvi_delta_{2000 + i}_{2001 + i}_abc.tif"
+        p.write_bytes(b"x" * 100)
+        os.utime(p, (1_000 + i, 1_000 + i))   # oldest first
+        paths.append(p)
+    return paths
+
+def test_enforce_budget_spares_in_flight_and_displayed(tmp_path, monkeypatch):
+    change = _setup(tmp_path, monkeypatch)
+    paths = _fake_deltas(change, 4)
+    monkeypatch.setattr(change_layers, "_displayed", paths[0])
+    change_layers._in_flight[paths[1]] += 1
+
+    evicted = change_layers.enforce_budget(0, keep={paths[3]})
+    assert evicted == [paths[2]]
+    assert [p.exists() for p in paths] == [True, True, False, True]
+
+def test_enforce_budget_skips_vanished_files(tmp_path, monkeypatch):
+    change = _setup(tmp_path, monkeypatch)
+    paths = _fake_deltas(change, 2)
+
+    class _Listing(type(change)):
+        # another thread unlinks a file between the directory listing and its stat
+        def rglob(self, pattern):
+            return [paths[0], change / "ndvi_delta_1990_1991_gone.tif", paths[1]]
+
+    monkeypatch.setattr(change_layers, "CHANGE_DIR", _Listing(change))
+    assert change_layers.enforce_budget(100) == [paths[0]]
+
+def test_precompute_keeps_displayed_layer(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    shown = change_layers.ensure_delta(YEARS[0], YEARS[-1], display=True)
+    pairs = change_layers.consecutive_pairs(YEARS)
+    out = change_layers.precompute(pairs, workers=2, budget=1)   # every write is over budget
+
+    assert len(out) == len(pairs) and shown.exists()
+    with rasterio.open(shown) as src:
+        np.testing.assert_allclose(src.read(1), 0.3, rtol=1e-6)
+    assert not change_layers._in_flight
@@ -0,0 +1,35 @@
+# tests/test_chip_reader.py
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+import chip_reader
+from synthetic import write_scenes
+
+ORIGIN = (499_980.0, 9_000_000.0)
+
+def test_failed_prefetch_leaves_no_inflight_entry(tmp_path):
+    # A prefetch that raises must not stay in _inflight: the next read of that chip reads it itself.
+    item = write_scenes(tmp_path, "landsat", 64, 1, origin=ORIGIN)[0]
+    reader = chip_reader.ChipReader(cache=chip_reader.ChipCache(tmp_path / "chips", 16), prefetch=1)
+    grid = ("EPSG:32721", from_origin(*ORIGIN, 30.0, 30.0), (64, 64))
+    window = Window(0, 0, 32, 32)
+
+    read_remote, calls = reader._read_remote, []
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("transient")
+        return read_remote(*args)
+    reader._read_remote = flaky
+
+    spec = (item, "nir", grid, window)
+    reader.prefetch([spec])
+    reader._pool.shutdown(wait=True)
+    assert reader._inflight == {}
+
+    got = reader.read(*spec)
+    with rasterio.open(item.assets["nir"].href) as src:
+        np.testing.assert_array_equal(got, src.read(1, window=window))
+    assert len(calls) == 2
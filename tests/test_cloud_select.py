@@ -0,0 +1,48 @@
+# tests/test_cloud_select.py
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+import cloud_select
+
+INSIDE = np.ones((4, 4), dtype=bool)
+ITEMS = [f"scene_{i}" for i in range(5)]   # select_scenes only indexes and slices them
+AOI = gpd.GeoDataFrame(geometry=[box(-55.1, -8.9, -55.0, -8.8)], crs=4326)
+
+def _clear(rows):
+    c = np.zeros((4, 4), dtype=bool)
+    c[rows] = True
+    return c
+
+def _select(monkeypatch, clear, **kw):
+    monkeypatch.setattr(cloud_select, "clear_maps", lambda *a, **k: (clear, INSIDE))
+    stats = {}
+    items, covered = cloud_select.select_scenes(ITEMS, "qa", "s2", AOI, stats=stats, **kw)
+    return items, covered, stats
+
+def test_greedy_cover_picks_most_needed_looks():
+    clear = [_clear(slice(0, 2)), _clear(slice(0, 4)), None, _clear(slice(2, 4)), _clear(slice(0, 4))]
+    keep, covered = cloud_select.greedy_cover(clear, INSIDE, target=1.0, obs=2)
+    assert keep == [1, 4] and covered == 1.0
+    keep, covered = cloud_select.greedy_cover(clear, INSIDE, target=1.0, obs=2, max_scenes=1)
+    assert keep == [1] and covered == 0.0
+
+def test_select_scenes_keeps_order(monkeypatch):
+    clear = [_clear(slice(0, 1)), _clear(slice(0, 4)), None, _clear(slice(0, 4)), _clear(slice(0, 4))]
+    items, covered, stats = _select(monkeypatch, clear)
+    assert items == ["scene_1", "scene_3", "scene_4"] and covered == 1.0
+    assert stats == {"qa_probed": 4, "clear_coverage": 1.0}
+
+@pytest.mark.parametrize("clear,why", [
+    ([None] * 5, "every QA probe failed"),
+    ([_clear(slice(0, 0))] * 5, "no scene adds a clear look over the AOI"),
+])
+def test_select_scenes_falls_back_to_search_order(monkeypatch, capsys, clear, why):
+    # A year must not be dropped just because the probes found nothing usable.
+    items, covered, stats = _select(monkeypatch, clear)
+    assert items == ITEMS and covered == 0.0 and stats["fallback"] == why
+    assert "Warning" in capsys.readouterr().out
+
+    items, _, _ = _select(monkeypatch, clear, max_scenes=3)
+    assert items == ITEMS[:3]
@@ -0,0 +1,32 @@
+# tests/test_cog_writer.py
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import cog_writer
+
+TRANSFORM = from_origin(499_980.0, 9_000_000.0, 30.0, 30.0)
+
+def _write(path, arr, dtype, nodata):
+    cog_writer.write_cogs([arr], [path], "EPSG:32721", TRANSFORM, dtypes=[dtype], nodatas=[nodata],
+                          codec="DEFLATE", predictor="3")
+    with rasterio.open(path) as src:
+        return src.read(1), src.dtypes[0], src.tags(ns="IMAGE_STRUCTURE").get("PREDICTOR")
+
+def test_predictor_for_dtype():
+    assert cog_writer.predictor_for("float32", "3") == "FLOATING_POINT"
+    assert cog_writer.predictor_for("float64", "3") == "FLOATING_POINT"
+    assert cog_writer.predictor_for("int16", "3") == "STANDARD"
+    assert cog_writer.predictor_for("uint8", "3") == "STANDARD"
+    assert cog_writer.predictor_for("int16", "1") == "NO"
+
+@pytest.mark.parametrize("dtype,nodata,predictor", [("int16", -1, "2"), ("uint8", 0, "2"), ("float32", np.nan, "3")])
+def test_write_cogs_picks_predictor_by_dtype(tmp_path, dtype, nodata, predictor):
+    # The float predictor is the default, but integer rasters must still write (GDAL rejects PREDICTOR=3).
+    arr = np.arange(700 * 600).reshape(700, 600) % 120
+    got, got_dtype, got_predictor = _write(tmp_path / f"{dtype}.tif", arr.astype(dtype), dtype, nodata)
+    assert got_dtype == dtype
+    assert got_predictor == predictor
+    np.testing.assert_array_equal(got, arr.astype(dtype))
+    assert not list(tmp_path.glob("*.scratch.tif"))
@@ -0,0 +1,67 @@
+# tests/test_composites.py
+import json
+import os
+
+import pytest
+
+import composites
+
+def _age(path):
+    # push the stamp into the past so the next change is visible even on coarse filesystem clocks
+    os.utime(path, ns=(0, 0))
+
+def test_dir_stamp_follows_adds_replaces_and_removes(tmp_path):
+    comp = tmp_path / "composites"
+    assert composites.dir_stamp(comp) is None
+    comp.mkdir()
+    _age(comp)
+    empty = composites.dir_stamp(comp)
+
+    (comp / "ndvi_median_2020.tif").write_bytes(b"a")
+    added = composites.dir_stamp(comp)
+    assert added != empty
+
+    _age(comp)
+    aged = composites.dir_stamp(comp)
+    (comp / "ndvi_median_2020.tif.tmp").write_bytes(b"bb")
+    os.replace(comp / "ndvi_median_2020.tif.tmp", comp / "ndvi_median_2020.tif")   # atomic rewrite
+    assert composites.dir_stamp(comp) != aged
+
+    _age(comp)
+    aged = composites.dir_stamp(comp)
+    (comp / "ndvi_median_2020.tif").unlink()
+    assert composites.dir_stamp(comp) != aged
+
+def test_fingerprint_changes_on_rewrite(tmp_path):
+    path = tmp_path / "ndvi_median_2020.tif"
+    path.write_bytes(b"a")
+    os.utime(path, ns=(0, 0))
+    before = composites.fingerprint(path)
+    assert composites.fingerprint(path) == before
+    path.write_bytes(b"ab")
+    assert composites.fingerprint(path) != before
+
+def test_discovery(tmp_path):
+    for name in ("ndvi_median_2019.tif", "ndvi_median_2021.tiff", "ndvi_median_2020.tif", "ndvi_max_draft.tif"):
+        (tmp_path / name).write_bytes(b"")
+    for level, has_composite in ((120, True), (60, True), (240, False)):
+        (tmp_path / f"{level}m").mkdir()
+        if has_composite:
+            (tmp_path / f"{level}m" / "ndvi_median_2019.tif").write_bytes(b"")
+    (tmp_path / "summary").mkdir()
+
+    assert composites.composite_years(tmp_path) == [2019, 2020, 2021]
+    assert composites.pyramid_levels(tmp_path) == [60, 120]          # empty levels are not offered
+    assert composites.level_dir(None, tmp_path) == tmp_path
+    assert composites.level_dir(60, tmp_path) == tmp_path / "60m"
+    assert composites.ndvi_path(2021, tmp_path).name == "ndvi_median_2021.tiff"
+    with pytest.raises(FileNotFoundError, match="2018"):
+        composites.ndvi_path(2018, tmp_path)
+
+def test_load_grid(tmp_path):
+    assert composites.load_grid(tmp_path) is None
+    (tmp_path / "grid.json").write_text("{truncated")
+    assert composites.load_grid(tmp_path) is None
+    grid = {"epsg": 32721, "transform": [30, 0, 499_980, 0, -30, 9_000_000], "width": 4, "height": 4}
+    (tmp_path / "grid.json").write_text(json.dumps(grid))
+    assert composites.load_grid(tmp_path) == grid
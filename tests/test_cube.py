@@ -0,0 +1,33 @@
+# tests/test_cube.py
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import cube
+
+def _write(path, data):
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype="float32", crs="EPSG:32721", transform=from_origin(499_980.0, 9_000_000.0, 30, 30),
+                       nodata=np.nan) as dst:
+        dst.write(data, 1)
+    return path
+
+def test_append_replace_and_read_back(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.uniform(-1, 1, (7, 10)).astype(np.float32)
+    data[2, 3] = np.nan
+    store = tmp_path / "cube.zarr"
+    for year, shift in ((2020, 9), (2021, 1), (2020, 0), (2022, 2)):   # 2020 is written twice
+        cube.append_year(store, year, _write(tmp_path / f"ndvi_median_{year}.tif", data + shift),
+                         provenance={"fingerprint": f"{year}/{shift}"})
+
+    assert cube.cube_years(store) == [2020, 2021, 2022]
+    ds = cube.open_cube(store)
+    assert ds.rio.crs.to_epsg() == 32721                       # grid attrs survive appends
+    assert ds.attrs["provenance"] == {"2020": {"fingerprint": "2020/0"}, "2021": {"fingerprint": "2021/1"},
+                                      "2022": {"fingerprint": "2022/2"}}
+    a, b = cube.year_pair(ds, 2020, 2022)
+    np.testing.assert_allclose(b.values, data + 2, rtol=1e-6)
+    np.testing.assert_allclose(a.values, data, rtol=1e-6)
+    series = cube.pixel_series(ds, ds.x.values[4], ds.y.values[1])
+    np.testing.assert_allclose(series.values, data[1, 4] + np.array([0, 1, 2]), rtol=1e-6)
@@ -0,0 +1,79 @@
+# tests/test_events.py
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+
+import cube
+import events
+
+YEARS = [2000, 2001, 2002, 2003, 2004, 2005]
+NAN = np.nan
+
+# One pixel per case, as (T,) series over YEARS.
+SERIES = {
+    "clearing": [0.8, 0.8, 0.8, 0.3, 0.3, 0.3],     # abrupt, persistent loss in 2003
+    "gap": [0.8, NAN, 0.3, 0.3, 0.3, 0.3],          # drop measured from the last valid year
+    "stable": [0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+    "declining": [0.8, 0.78, 0.76, 0.74, 0.72, 0.70],
+    "greening": [0.4, 0.45, 0.5, 0.55, 0.6, 0.65],
+    "recovered": [0.8, 0.8, 0.55, 0.8, 0.8, 0.8],   # big enough drop, but it does not persist
+    "sparse": [NAN, 0.8, NAN, NAN, 0.3, NAN],       # fewer than MIN_YEARS
+}
+
+def _block():
+    return np.array(list(SERIES.values()), dtype="float32").T.reshape(len(YEARS), 1, len(SERIES))
+
+def _out(bands, name):
+    i = list(SERIES).index(name)
+    return dict(zip(events.BANDS, bands[:, 0, i]))
+
+def test_detect_block_classes():
+    bands = events.detect_block(_block(), YEARS, drop=0.2, persist=3, trend=0.01)
+    assert bands.shape == (4, 1, len(SERIES)) and bands.dtype == np.float32
+
+    px = _out(bands, "clearing")
+    assert px["change_class"] == events.BREAKPOINT and px["drop_year"] == 2003
+    assert np.isclose(px["drop_magnitude"], 0.5)
+    px = _out(bands, "gap")
+    assert px["change_class"] == events.BREAKPOINT and px["drop_year"] == 2002
+
+    assert _out(bands, "stable")["change_class"] == events.STABLE
+    assert np.isclose(_out(bands, "stable")["trend"], 0.0)
+    px = _out(bands, "declining")
+    assert px["change_class"] == events.DECLINING and np.isclose(px["trend"], -0.02)
+    px = _out(bands, "greening")
+    assert px["change_class"] == events.GREENING and np.isclose(px["trend"], 0.05)
+    px = _out(bands, "recovered")
+    assert px["drop_year"] == 2002 and px["drop_magnitude"] >= 0.2 and px["change_class"] != events.BREAKPOINT
+
+    px = _out(bands, "sparse")
+    assert px["change_class"] == events.UNKNOWN and np.isnan(px["trend"])
+
+def test_run_writes_rasters_and_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(cube, "CUBE_PATH", None)
+    comp, out = tmp_path / "composites", tmp_path / "events"
+    comp.mkdir()
+    block = np.tile(_block(), (1, 8, 1))                # 8 rows of every case
+    for t, year in enumerate(YEARS):
+        with rasterio.open(comp / f"ndvi_median_{year}.tif", "w", driver="GTiff", width=block.shape[2],
+                           height=block.shape[1], count=1, dtype="float32", crs="EPSG:32721",
+                           transform=from_origin(499_980.0, 9_000_000.0, 30, 30), nodata=np.nan) as dst:
+            dst.write(block[t], 1)
+
+    summary = events.run(comp, out, drop=0.2, persist=3, trend=0.01)
+
+    want = events.detect_block(block, YEARS, drop=0.2, persist=3, trend=0.01)
+    dtypes = {"drop_year": "int16", "drop_magnitude": "float32", "trend": "float32", "change_class": "uint8"}
+    for i, name in enumerate(events.BANDS):
+        with rasterio.open(out / f"{name}.tif") as src:
+            assert src.dtypes[0] == dtypes[name]
+            np.testing.assert_allclose(src.read(1), want[i].astype(dtypes[name]), equal_nan=True)
+    with rasterio.open(out / "cleared_year.tif") as src:
+        cleared = src.read(1)
+    np.testing.assert_array_equal(cleared, np.where(want[3] == events.BREAKPOINT, want[0], 0))
+
+    # 8 clearings in 2003 and 8 in 2002; 30 m pixels are 0.09 ha
+    assert summary.set_index("year")["cleared_px"].to_dict() == {y: {2002: 8, 2003: 8}.get(y, 0) for y in YEARS}
+    pd.testing.assert_frame_equal(pd.read_csv(out / "summary.csv"), summary.reset_index(drop=True), check_dtype=False)
+    assert np.isclose(summary["cleared_ha"].sum(), 16 * 0.09)
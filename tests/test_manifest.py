@@ -0,0 +1,77 @@
+# tests/test_manifest.py
+import json
+from types import SimpleNamespace
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+
+import cube
+import manifest
+import search_download as sd
+
+AOI_GDF = gpd.GeoDataFrame(geometry=[box(-55.1, -8.9, -55.09, -8.89)], crs=4326)
+AOI_GEOJSON = json.loads(AOI_GDF.to_json())
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """run_years with a fake search (scene ids per year) and a build that only records the call."""
+    scenes = {2020: ["a", "b"], 2021: ["c"]}
+    built = []
+
+    def plan_year(y, aoi_geojson):
+        items = [SimpleNamespace(id=i) for i in scenes[y]]
+        return {"year": y, "dataset": "S2", "items": items}
+
+    def build_year(plan, aoi_gdf, outdir):
+        built.append(plan["year"])
+        out = outdir / f"ndvi_median_{plan['year']}.tif"
+        out.write_bytes(b"composite")
+        return out
+
+    monkeypatch.setattr(sd, "plan_year", plan_year)
+    monkeypatch.setattr(sd, "build_year", build_year)
+    monkeypatch.setattr(cube, "CUBE_PATH", None)
+    monkeypatch.setattr(sd, "FORCE_REBUILD", False)
+
+    def run():
+        built.clear()
+        sd.run_years([2020, 2021], AOI_GDF, AOI_GEOJSON, tmp_path, workers=1)
+        return sorted(built)
+    return SimpleNamespace(run=run, scenes=scenes, outdir=tmp_path)
+
+def test_unchanged_inputs_skip_and_changes_rebuild(pipeline, monkeypatch):
+    assert pipeline.run() == [2020, 2021]
+    first = manifest.load_manifest(pipeline.outdir)
+    assert set(first) == {"2020", "2021"} and first["2020"]["items"] == ["a", "b"]
+
+    assert pipeline.run() == []                                    # same fingerprints: both skipped
+
+    pipeline.scenes[2021] = ["c", "d"]                             # a new scene for 2021 only
+    assert pipeline.run() == [2021]
+    again = manifest.load_manifest(pipeline.outdir)
+    assert again["2020"]["fingerprint"] == first["2020"]["fingerprint"]
+    assert again["2021"]["fingerprint"] != first["2021"]["fingerprint"]
+
+    monkeypatch.setattr(sd, "REDUCER", "median")                   # a build parameter: every year
+    assert pipeline.run() == [2020, 2021]
+
+    (pipeline.outdir / "ndvi_median_2020.tif").unlink()            # output gone: rebuilt
+    assert pipeline.run() == [2020]
+
+    monkeypatch.setattr(sd, "FORCE_REBUILD", True)
+    assert pipeline.run() == [2020, 2021]
+
+def test_fingerprint_ignores_item_order_and_aoi_properties():
+    e1 = manifest.year_entry("aoi", {"REDUCER": "max"}, "S2", ["b", "a"])
+    e2 = manifest.year_entry("aoi", {"REDUCER": "max"}, "S2", ["a", "b"])
+    assert e1["fingerprint"] == e2["fingerprint"]
+    with_props = json.loads(json.dumps(AOI_GEOJSON))
+    with_props["features"][0]["properties"] = {"name": "roi"}
+    assert manifest.aoi_hash(with_props) == manifest.aoi_hash(AOI_GEOJSON)
+
+def test_unreadable_manifest_rebuilds(tmp_path):
+    (tmp_path / manifest.MANIFEST_NAME).write_text("{not json")
+    assert manifest.load_manifest(tmp_path) == {}
+    (tmp_path / manifest.MANIFEST_NAME).write_text(json.dumps({"version": 0, "years": {"2020": {}}}))
+    assert manifest.load_manifest(tmp_path) == {}
@@ -0,0 +1,34 @@
+# tests/test_ndvi.py
+import numpy as np
+import dask.array as da
+import pytest
+import xarray as xr
+
+from ndvi import REDUCERS, composite_ndvi_mixed, compute_ndvi_mixed, mask_clouds_mixed, nanquantile_sorted
+from search_download import reduce_ndvi_over_time
+from synthetic import make_stack
+
+@pytest.mark.parametrize("kind", ["landsat", "s2"])
+@pytest.mark.parametrize("reducer", REDUCERS)
+def test_fused_kernel_matches_xarray_steps(kind, reducer):
+    red, nir, qa, cfg = make_stack(kind, 96, 9, chunk=32, seed=3)
+    ndvi_t = compute_ndvi_mixed(red, nir, cfg).where((red != 0) & (nir != 0))
+    want = reduce_ndvi_over_time(mask_clouds_mixed(qa, ndvi_t, cfg), reducer).values.astype(np.float32)
+    got = composite_ndvi_mixed(red, nir, qa, cfg, reducer).values
+    assert got.dtype == np.float32
+    np.testing.assert_array_equal(got, want)
+
+@pytest.mark.parametrize("axis", [0, -1])
+def test_nanquantile_sorted_matches_xarray_quantile(axis):
+    rng = np.random.default_rng(0)
+    arr = rng.uniform(-1, 1, (13, 40, 40)).astype(np.float32)
+    arr[rng.random(arr.shape) < 0.4] = np.nan
+    arr[:, :3] = np.nan                          # all-NaN pixels
+    arr[:, 3:6] = np.nan
+    arr[0, 3:6] = 0.5                            # single valid value
+    arr = np.moveaxis(arr, 0, axis)
+    dims = ["y", "x"]
+    dims.insert(axis % 3, "time")
+    # dask-backed, like the pipeline's stacks
+    want = xr.DataArray(da.from_array(arr, chunks=16), dims=dims).quantile(0.95, dim="time", skipna=True)
+    np.testing.assert_array_equal(nanquantile_sorted(arr, 0.95, axis=axis), want.values)
@@ -0,0 +1,53 @@
+# tests/test_pyramid.py
+import warnings
+
+import numpy as np
+import dask.array as da
+import rasterio
+import xarray as xr
+from rasterio.transform import from_origin
+
+import grid
+import pyramid
+from cog_writer import write_cog
+
+G = {"epsg": 32721, "resolution": 30, "transform": list(from_origin(499_980.0, 9_000_000.0, 30, 30))[:6],
+     "width": 10, "height": 7}
+
+def _composite(chunks=None):
+    rng = np.random.default_rng(1)
+    data = rng.uniform(-1, 1, (G["height"], G["width"])).astype(np.float32)
+    data[rng.random(data.shape) < 0.3] = np.nan
+    data[:4, :4] = np.nan                                     # one all-NaN 120 m block
+    ys, xs = grid.coords(G)
+    arr = xr.DataArray(da.from_array(data, chunks=chunks) if chunks else data, dims=("y", "x"),
+                       coords={"y": ys, "x": xs})
+    return arr.rio.write_crs(G["epsg"]).rio.write_transform(grid.affine(G)), data
+
+def _block_means(data, f):
+    h, w = -(-data.shape[0] // f), -(-data.shape[1] // f)
+    padded = np.full((h * f, w * f), np.nan, dtype=data.dtype)
+    padded[:data.shape[0], :data.shape[1]] = data
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # all-NaN blocks -> NaN
+        return np.nanmean(padded.reshape(h, f, w, f), axis=(1, 3))
+
+def test_coarsen_is_nan_aware_block_mean_on_level_grid():
+    arr, data = _composite(chunks=4)
+    out = pyramid.coarsen(arr, 120)
+    lg = pyramid.level_grid(G, 120)
+    assert out.shape == (lg["height"], lg["width"])
+    assert out.rio.transform() == grid.affine(lg)
+    np.testing.assert_allclose(out.values, _block_means(data, 4), rtol=1e-6, equal_nan=True)
+    assert np.isnan(out.values[0, 0])
+
+def test_from_cog_writes_missing_levels(tmp_path):
+    arr, data = _composite()
+    tif = tmp_path / "ndvi_median_2020.tif"
+    write_cog(arr, tif)
+    written = pyramid.from_cog(tif, tmp_path, 2020, levels=[60, 120])
+    assert written == [pyramid.level_path(tmp_path, r, 2020) for r in (60, 120)]
+    assert pyramid.missing(tmp_path, 2020, levels=[60, 120]) == []
+    with rasterio.open(written[1]) as src:
+        assert src.transform == grid.affine(pyramid.level_grid(G, 120))
+        np.testing.assert_allclose(src.read(1), _block_means(data, 4), rtol=1e-6, equal_nan=True)
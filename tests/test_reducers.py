@@ -0,0 +1,44 @@
+# tests/test_reducers.py
+import numpy as np
+import pytest
+import xarray as xr
+
+import reducers
+import search_download as sd
+
+HALF_BIN = (reducers.NDVI_RANGE[1] - reducers.NDVI_RANGE[0]) / reducers.STREAM_BINS / 2
+
+def _ndvi_t(seed=0, T=9, h=40, w=50):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-0.2, 0.95, (T, h, w)).astype(np.float32)
+    x[rng.random(x.shape) < 0.3] = np.nan   # cloud-masked looks
+    x[:, :3, :4] = np.nan                   # never observed
+    x[1:, 5, 5] = np.nan                    # a single look
+    return xr.DataArray(x, dims=("time", "y", "x"),
+                        coords={"y": np.arange(h) * -30.0, "x": np.arange(w) * 30.0}).chunk({"time": 1})
+
+@pytest.mark.parametrize("reducer", ["max", "median", "p95"])
+def test_stream_reduce_matches_xarray(reducer):
+    ndvi_t = _ndvi_t()
+    got, count = reducers.stream_reduce(ndvi_t, reducer, chunk=16)   # uneven tiles over 40x50
+    want = sd.reduce_ndvi_over_time(ndvi_t, reducer).compute().values
+    got = got.compute().values
+
+    assert got.shape == want.shape and got.dtype == np.float32
+    np.testing.assert_array_equal(np.isnan(got), np.isnan(want))
+    assert np.isnan(got[:3, :4]).all()
+    if reducer == "max":
+        np.testing.assert_array_equal(got, want)
+    else:
+        np.testing.assert_allclose(got, want, rtol=0, atol=HALF_BIN + 1e-6, equal_nan=True)
+
+    count = count.compute().values
+    assert count.dtype == np.uint16
+    np.testing.assert_array_equal(count, np.isfinite(ndvi_t.values).sum(axis=0))
+    assert (count[:3, :4] == 0).all() and count[5, 5] == 1
+
+def test_histogram_clamps_out_of_range_values():
+    x = np.array([[-1.5, 0.2, 1.7]], dtype=np.float32)
+    value, count = reducers.reduce_scenes([x, x, x], "median", x.shape)
+    np.testing.assert_allclose(value, [[-1 + HALF_BIN, 0.2, 1 - HALF_BIN]], atol=HALF_BIN + 1e-6)
+    np.testing.assert_array_equal(count, [[3, 3, 3]])
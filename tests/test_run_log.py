@@ -0,0 +1,118 @@
+# tests/test_run_log.py
+import time
+from types import SimpleNamespace
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+import cloud_select
+import run_log
+import search_download as sd
+
+AOI = {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}, "geometry": {
+    "type": "Polygon", "coordinates": [[[-55.1, -8.9], [-55.0, -8.9], [-55.0, -8.8], [-55.1, -8.8], [-55.1, -8.9]]]}}]}
+
+@pytest.fixture
+def log_path(tmp_path, monkeypatch):
+    path = tmp_path / "run_log.jsonl"
+    monkeypatch.setattr(run_log, "RUN_LOG", str(path))
+    return path
+
+def _records(path):
+    return run_log.load(path=path).to_dict("records")
+
+def test_cloud_select_is_its_own_stage(log_path, monkeypatch):
+    # QA probe time lands in `cloud_select`, not in the search latency; `kept` follows the pick.
+    found = [SimpleNamespace(id=f"scene_{i}", assets={}) for i in range(6)]
+    def probe(items, *args, stats=None, **kw):
+        time.sleep(0.2)
+        stats.update(qa_probed=len(items), clear_coverage=0.97)
+        return items[1:3], 0.97
+
+    monkeypatch.setattr(sd, "search_items", lambda *a, stats=None, **k: found)
+    monkeypatch.setattr(cloud_select, "CLOUD_SELECT", True)
+    monkeypatch.setattr(cloud_select, "select_scenes", probe)
+    monkeypatch.setattr(sd, "PLAN_DIR", None)
+
+    plan = sd.plan_year(2020, AOI)
+    assert plan["items"] == found[1:3]
+
+    search, select = _records(log_path)
+    assert (search["stage"], search["kept"], search["dataset"]) == ("search", 6, "S2")
+    assert search["seconds"] < 0.2
+    assert select["stage"] == "cloud_select" and select["seconds"] >= 0.2
+    assert (select["qa_probed"], select["clear_coverage"], select["kept"]) == (6, 0.97, 2)
+
+    table = run_log.summary(path=log_path)
+    assert table.loc[2020, "scenes"] == 2
+    assert list(table.columns[1:3]) == ["search_s", "cloud_select_s"]
+
+def test_stage_records_fields_and_errors(log_path):
+    with run_log.stage("search", 2020, dataset="S2") as rec:
+        rec["found"] = 12
+    with pytest.raises(RuntimeError):
+        with run_log.stage("build", 2020):
+            raise RuntimeError("disk full")
+
+    search, build = _records(log_path)
+    assert search["run"] == run_log.RUN_ID and search["year"] == 2020 and search["pid"] > 0
+    assert (search["stage"], search["dataset"], search["found"]) == ("search", "S2", 12)
+    assert search["seconds"] >= 0 and pd.isna(search["error"])          # a DataFrame row: absent is NaN
+    assert build["stage"] == "build" and build["error"] == "RuntimeError('disk full')"
+
+def test_logging_off_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_log, "RUN_LOG", "none")
+    run_log.log("search", 2020, found=1)
+    assert run_log.load(path=tmp_path / "none").empty and not list(tmp_path.iterdir())
+
+def test_summary_and_report(log_path, capsys):
+    for rec in (
+        dict(stage="search", year=2019, seconds=1.5, kept=4),
+        dict(stage="graph", year=2019, read_mib_upper_bound=10.0, tasks=30),
+        dict(stage="graph", year=2019, read_mib_upper_bound=5.5, tasks=20),       # tiled: one per tile
+        dict(stage="compute", year=2019, seconds=3.0, peak_rss_mib=900),
+        dict(stage="compute", year=2019, seconds=2.0, peak_rss_mib=1200),
+        dict(stage="search", year=2020, seconds=0.5, kept=3),
+        dict(stage="skip", year=2020, fingerprint="abc"),
+        dict(stage="search", year=2021, seconds=0.7, kept=5),
+        dict(stage="failed", year=2021, error="boom"),
+        dict(stage="search", year=2022, seconds=0.2, kept=0),
+    ):
+        stage, year = rec.pop("stage"), rec.pop("year")
+        run_log.log(stage, year, **rec)
+
+    table = run_log.report(path=log_path)
+    assert table["status"].to_dict() == {2019: "built", 2020: "skipped", 2021: "failed", 2022: "no data"}
+    assert table.loc[2019, "est_read_mib"] == 15.5 and table.loc[2019, "tasks"] == 50
+    assert table.loc[2019, "peak_mib"] == 1200 and table.loc[2019, "compute_s"] == 5.0
+    assert table["scenes"].to_dict() == {2019: 4, 2020: 3, 2021: 5, 2022: 0}
+    out = capsys.readouterr().out
+    assert "est_read_mib is an upper bound" in out and "not bytes measured" in out
+    assert "Stage totals (s): search 2.9, graph 0.0, compute 5.0" in out
+
+def test_build_year_logs_graph_compute_and_finalize(log_path, tmp_path, monkeypatch):
+    from synthetic import write_scenes
+
+    items = write_scenes(tmp_path, "landsat", 64, 3, origin=(499_980.0, 9_000_000.0))
+    aoi = gpd.GeoDataFrame(geometry=[box(499_980, 8_998_080, 501_900, 9_000_000)], crs=32721)
+    cfg = sd.DATASETS["L89"] | {"assets": {"red": "red", "nir": "nir", "qa": "qa"},
+                                "_resolved_assets": ("red", "nir", "qa")}
+    monkeypatch.setattr(sd, "CHUNK_SIZE", 32)
+    out = sd.build_year({"year": 2020, "items": items, "cfg": cfg}, aoi, tmp_path)
+    assert out == tmp_path / "ndvi_median_2020.tif" and out.exists()
+
+    recs = {r["stage"]: r for r in _records(log_path)}
+    assert list(recs) == ["graph", "build", "compute", "finalize"]
+    graph = recs["graph"]
+    assert graph["time_steps"] == 3 and graph["shape"] == [64, 64] and graph["tasks"] > 0
+    assert (graph["chunks_read"], graph["chunks_total"]) == (4, 4)
+    per_asset = 3 * 64 * 64 * 2 / 2**20                     # every chunk of every scene as uint16
+    assert graph["read_mib_upper_bound_per_asset"] == {a: round(per_asset, 1) for a in ("red", "nir", "qa")}
+    assert graph["read_mib_upper_bound"] == round(3 * per_asset, 1)
+    assert recs["build"]["output"] == str(out) and recs["build"]["seconds"] > 0
+    assert recs["compute"]["seconds"] >= 0 and recs["compute"]["peak_rss_mib"] > 0
+    assert recs["finalize"]["seconds"] >= 0
+
+    assert run_log.summary(path=log_path).loc[2020, "status"] == "built"
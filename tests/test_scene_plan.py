@@ -0,0 +1,46 @@
+# tests/test_scene_plan.py
+from datetime import datetime, timezone
+
+import pystac
+
+import scene_plan
+
+SAS = "?st=2026-10-16T10%3A00%3A00Z&se=2026-10-17T10%3A00%3A00Z&sp=rl&sv=2024-05-04&sr=c&sig=c2VjcmV0"
+
+def _item(i, signed):
+    item = pystac.Item(f"LC09_{i}", {"type": "Point", "coordinates": [-55.0, -9.0]}, [-55, -9, -55, -9],
+                       datetime(2020, 7, 1 + i, 13, 30, tzinfo=timezone.utc),
+                       {"eo:cloud_cover": 10.0 * i, "landsat:wrs_path": "226", "landsat:wrs_row": "066"})
+    for band in ("red", "nir", "qa"):
+        href = f"https://example.blob.core.windows.net/landsat/{item.id}_{band}.tif"
+        item.add_asset(band, pystac.Asset(href=href + (SAS if signed else "")))
+    return item
+
+class _Signer:
+    def __init__(self):
+        self.calls = 0
+
+    def sign(self, items, force=False):
+        self.calls += 1
+        out = []
+        for it in items:
+            signed = it.clone()
+            for a in signed.assets.values():
+                a.href += "?sig=fresh"
+            out.append(signed)
+        return out
+
+def test_saved_plan_holds_no_tokens_and_resigns_on_load(tmp_path):
+    path = tmp_path / "plan_2020.json"
+    scene_plan.save_plan(scene_plan.items_table([_item(i, signed=True) for i in range(3)], "landsat"), path)
+    assert "sig=" not in path.read_text() and "se=" not in path.read_text()
+
+    plain = scene_plan.load_plan(path, "landsat")
+    assert list(plain["id"]) == ["LC09_0", "LC09_1", "LC09_2"]
+    assert plain["item"][0].assets["nir"].href == _item(0, signed=False).assets["nir"].href
+
+    signer = _Signer()
+    signed = scene_plan.load_plan(path, "landsat", catalog=signer)
+    assert signer.calls == 1
+    assert all(it.assets["red"].href.endswith("?sig=fresh") for it in signed["item"])
+    assert list(signed["tile"]) == ["P226R066"] * 3
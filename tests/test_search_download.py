@@ -0,0 +1,52 @@
+# tests/test_search_download.py
+import numpy as np
+import geopandas as gpd
+import rasterio
+from shapely.geometry import box
+
+import grid
+import search_download as sd
+from ndvi import composite_block
+from synthetic import write_scenes
+
+CFG = {"assets": {"red": "red", "nir": "nir", "qa": "qa"}}
+LANDSAT = sd.DATASETS["L89"] | CFG
+ORIGIN = (499_980.0, 9_000_000.0)  # on the 30 m lattice stackstac snaps bounds to
+
+def _aoi(x0, y0, x1, y1):
+    return gpd.GeoDataFrame(geometry=[box(x0, y0, x1, y1)], crs=32721)
+
+def test_stack_for_year_reads_native_uint16(tmp_path):
+    # Real stackstac call on local GeoTIFFs: uint16 DNs, matching the files pixel for pixel.
+    items = write_scenes(tmp_path, "landsat", 64, 2, origin=ORIGIN)
+    stack = sd.stack_for_year(items, _aoi(500_280, 8_998_200, 501_480, 8_999_700), CFG, epsg=32721)
+    assert stack.dtype == np.uint16
+    assert stack.sizes["time"] == 2 and stack.sizes["band"] == 3
+    assert set(stack.chunksizes["time"]) == {1} and set(stack.chunksizes["band"]) == {1}
+
+    got = stack.isel(time=0).sel(band="nir").values
+    with rasterio.open(items[0].assets["nir"].href) as src:
+        want = src.read(1)[10:10 + got.shape[0], 10:10 + got.shape[1]]
+    np.testing.assert_array_equal(got, want)
+
+def test_snapped_composite_matches_source_pixels(tmp_path):
+    # A stackstac composite placed on grid.json keeps every pixel where the source has it.
+    size = 64
+    items = write_scenes(tmp_path, "landsat", size, 1, origin=ORIGIN)
+    aoi = _aoi(500_290, 8_998_210, 501_470, 8_999_690)
+    out_grid = grid.define(aoi, resolution=30, epsg=32721)
+    plan = {"year": 2020, "items": items, "cfg": LANDSAT | {"_resolved_assets": ("red", "nir", "qa")}}
+
+    got = sd.composite_for_year(plan, aoi, out_grid=out_grid)
+    assert got.rio.transform() == grid.affine(out_grid)
+
+    bands = {}
+    for name in ("red", "nir", "qa"):
+        with rasterio.open(items[0].assets[name].href) as src:
+            bands[name] = src.read(1)
+    want = composite_block(*(b[..., None] for b in bands.values()), LANDSAT["scale"], LANDSAT["offset"],
+                           "landsat", reducer="max")
+    r0 = int((ORIGIN[1] - out_grid["transform"][5]) / 30)
+    c0 = int((out_grid["transform"][2] - ORIGIN[0]) / 30)
+    want = want[r0:r0 + out_grid["height"], c0:c0 + out_grid["width"]]
+    np.testing.assert_array_equal(got.values, want)
@@ -0,0 +1,144 @@
+# tests/test_stac_cache.py
+import json
+from datetime import datetime, timedelta, timezone
+
+import planetary_computer
+import pystac
+import pytest
+
+import stac_cache
+
+URL = "https://example.com/stac/v1"
+AOI = {"type": "Polygon", "coordinates": [[[-55.2, -9.2], [-54.8, -9.2], [-54.8, -8.8], [-55.2, -8.8], [-55.2, -9.2]]]}
+NOW = datetime(2026, 10, 16, 12, 0, tzinfo=timezone.utc)
+
+def _item(i, lon=-55.0, day=1, cloud=10.0, collection="sentinel-2-l2a", href=None):
+    item = pystac.Item(f"S2_{i}", {"type": "Point", "coordinates": [lon, -9.0]}, [lon, -9.0, lon, -9.0],
+                       datetime(2024, 1, day, 13, 30, tzinfo=timezone.utc), {"eo:cloud_cover": cloud},
+                       collection=collection)
+    item.add_asset("B04", pystac.Asset(href=href or f"https://example.blob.core.windows.net/s2/{item.id}_B04.tif"))
+    return item
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+    monkeypatch.setattr(stac_cache, "_utcnow", lambda: now[0])
+    return now
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """A CachedCatalog for an API URL whose fetches are counted instead of sent."""
+    catalog = stac_cache.CachedCatalog(URL, cache_dir=tmp_path / "stac", ttl_hours=24)
+    catalog.fetches = 0
+    def fetch(collection, geometry, start, end, query):
+        catalog.fetches += 1
+        return [_item(0), _item(1, day=3)]
+    monkeypatch.setattr(catalog, "_fetch", fetch)
+    return catalog
+
+@pytest.fixture
+def signer(monkeypatch, clock):
+    """planetary_computer.sign stand-in: SAS tokens that expire an hour after signing."""
+    calls = []
+    def sign(item):
+        calls.append(item.id)
+        se = (clock[0] + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        signed = item.clone()
+        for a in signed.assets.values():
+            a.href = f"{a.href}?se={se}&sp=rl&sig=c2lnbmVk"
+        return signed
+    monkeypatch.setattr(planetary_computer, "sign", sign)
+    return calls
+
+def test_recent_window_expires_after_ttl(remote, clock):
+    window = ("2026-09-01", "2026-10-10")          # may still get late scenes
+    assert len(remote.search("sentinel-2-l2a", AOI, *window)) == 2
+    remote.search("sentinel-2-l2a", AOI, *window)
+    assert remote.fetches == 1
+
+    clock[0] += timedelta(hours=23)
+    remote.search("sentinel-2-l2a", AOI, *window)
+    assert remote.fetches == 1
+    clock[0] += timedelta(hours=2)
+    remote.search("sentinel-2-l2a", AOI, *window)
+    assert remote.fetches == 2
+
+def test_settled_window_never_expires(remote, clock):
+    window = ("2024-01-01", "2024-02-25")
+    remote.search("sentinel-2-l2a", AOI, *window)
+    clock[0] += timedelta(days=400)
+    remote.search("sentinel-2-l2a", AOI, *window)
+    assert remote.fetches == 1
+    remote.search("sentinel-2-l2a", AOI, *window, query={"eo:cloud_cover": {"lt": 20}})  # another key
+    assert remote.fetches == 2
+
+def test_unreadable_cache_entry_is_refetched(remote, capsys):
+    window = ("2024-01-01", "2024-02-25")
+    remote.search("sentinel-2-l2a", AOI, *window)
+    (entry,) = remote.cache_dir.glob("*.json")
+    entry.write_text("{truncated")
+    remote.search("sentinel-2-l2a", AOI, *window)
+    assert remote.fetches == 2 and "unreadable STAC cache entry" in capsys.readouterr().out
+
+def test_cache_hits_are_signed_lazily_and_tokens_reused(remote, signer, clock):
+    window = ("2024-01-01", "2024-02-25")
+    remote.search("sentinel-2-l2a", AOI, *window)
+    (entry,) = remote.cache_dir.glob("*.json")
+    assert "sig=" not in entry.read_text()                  # only unsigned items are persisted
+
+    hit = remote.search("sentinel-2-l2a", AOI, *window)     # from disk; nothing signed yet
+    assert signer == [] and all("?" not in it.assets["B04"].href for it in hit)
+
+    signed = remote.sign(hit)
+    assert signer == ["S2_0", "S2_1"] and all("sig=" in it.assets["B04"].href for it in signed)
+    assert stac_cache.token_expiry(signed[0]) == NOW + timedelta(hours=1)
+
+    clock[0] += timedelta(minutes=30)
+    assert remote.sign(remote.search("sentinel-2-l2a", AOI, *window)) == signed   # token still good
+    assert len(signer) == 2
+
+    clock[0] += timedelta(minutes=25)                       # within SIGN_MARGIN_MINUTES of expiry
+    resigned = remote.sign(hit[:1])
+    assert signer[2:] == ["S2_0"] and stac_cache.token_expiry(resigned[0]) == clock[0] + timedelta(hours=1)
+    remote.sign(hit[:1], force=True)
+    assert signer[3:] == ["S2_0"]
+
+def test_unsign_and_token_expiry():
+    item = _item(0, href="https://example.blob.core.windows.net/s2/a.tif?se=2026-10-17T10%3A00%3A00Z&sig=abc")
+    item.add_asset("public", pystac.Asset(href="https://example.com/a.tif?version=2"))
+    assert stac_cache.token_expiry(item) == datetime(2026, 10, 17, 10, tzinfo=timezone.utc)
+    clean = stac_cache.unsign(item)
+    assert clean.assets["B04"].href == "https://example.blob.core.windows.net/s2/a.tif"
+    assert clean.assets["public"].href == "https://example.com/a.tif?version=2"   # not a SAS token
+    assert stac_cache.token_expiry(clean) == datetime.max.replace(tzinfo=timezone.utc)
+    assert "sig=" in item.assets["B04"].href                                       # original untouched
+
+def test_offline_catalog_directory(tmp_path, monkeypatch, signer):
+    root = tmp_path / "items"
+    (root / "sub").mkdir(parents=True)
+    features = [_item(0, href="S2_0_B04.tif").to_dict(),
+                _item(1, day=20, cloud=60.0, href="S2_1_B04.tif").to_dict(),
+                _item(2, lon=-40.0, href="S2_2_B04.tif").to_dict(),                      # outside the AOI
+                _item(3, collection="landsat-c2-l2", href="L_3.tif").to_dict()]
+    (root / "s2.json").write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    (root / "sub" / "one.json").write_text(json.dumps(_item(4, day=5, href="S2_4_B04.tif").to_dict()))
+
+    catalog = stac_cache.CachedCatalog(str(root), cache_dir=tmp_path / "stac")
+    assert catalog.offline and catalog.cache_dir is None                    # nothing cached for local catalogs
+    found = catalog.search("sentinel-2-l2a", AOI, "2024-01-01", "2024-01-31")
+    assert sorted(it.id for it in found) == ["S2_0", "S2_1", "S2_4"]
+    hrefs = {it.id: it.assets["B04"].href for it in found}
+    assert hrefs["S2_0"] == str((root / "S2_0_B04.tif").resolve())         # relative to its JSON file
+    assert hrefs["S2_4"] == str((root / "sub" / "S2_4_B04.tif").resolve())
+
+    low = catalog.search("sentinel-2-l2a", AOI, "2024-01-01", "2024-01-31", query={"eo:cloud_cover": {"lt": 50}})
+    assert sorted(it.id for it in low) == ["S2_0", "S2_4"]
+    assert sorted(it.id for it in catalog.search("sentinel-2-l2a", AOI, "2024-01-10", "2024-01-31")) == ["S2_1"]
+
+    assert catalog.sign(found) == found and signer == []                  # local files need no token
+    assert not (tmp_path / "stac").exists()
+
+def test_get_catalog_is_shared_per_source(monkeypatch):
+    monkeypatch.setattr(stac_cache, "_catalogs", {})
+    assert stac_cache.get_catalog(URL) is stac_cache.get_catalog(URL)
+    assert stac_cache.get_catalog(URL) is not stac_cache.get_catalog("data/stac")
@@ -0,0 +1,37 @@
+# tests/test_tiles.py
+import math
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import tiles
+
+def _cog(path, value):
+    with rasterio.open(path, "w", driver="GTiff", width=64, height=64, count=1, dtype="float32",
+                       crs="EPSG:32721", transform=from_origin(499_980.0, 9_000_000.0, 30, 30), nodata=np.nan) as dst:
+        dst.write(np.full((64, 64), value, dtype="float32"), 1)
+    return path
+
+def _tile_at(lon, lat, z):
+    n = 1 << z
+    lat = math.radians(lat)
+    return z, int((lon + 180) / 360 * n), int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)
+
+def test_layers_and_open_rasters_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(tiles, "TILE_LAYERS", 2)
+    monkeypatch.setattr(tiles, "_layers", type(tiles._layers)())
+    monkeypatch.setattr(tiles, "_datasets", type(tiles._datasets)())
+    ids, handles = [], []
+    for year in range(2020, 2023):
+        path = _cog(tmp_path / f"ndvi_median_{year}.tif", 0.5)
+        minx, miny, maxx, maxy = tiles.layer_bounds(path)
+        z, x, y = _tile_at((minx + maxx) / 2, (miny + maxy) / 2, 14)
+        layer = tiles.register_layer(path, "RdYlGn", -1, 1)
+        assert tiles.render(layer, z, x, y) != tiles.empty_png()
+        ids.append(layer)
+        handles.append(next(reversed(tiles._datasets.values()))[0])
+
+    assert len(tiles._layers) == 2 and len(tiles._datasets) == 2
+    assert not tiles.has_layer(ids[0]) and tiles.has_layer(ids[2])
+    assert handles[0].closed and not handles[2].closed
@@ -0,0 +1,63 @@
+# tests/test_tiling.py
+from types import SimpleNamespace
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+from shapely.geometry import box, mapping
+
+import tiling
+
+AOI = gpd.GeoDataFrame(geometry=[box(499_980, 8_996_160, 503_820, 9_000_000)], crs=32721)  # 128x128 px at 30 m
+SCENE = SimpleNamespace(id="scene", geometry=mapping(AOI.to_crs(4326).geometry[0].buffer(0.01)))
+
+def test_output_epsg():
+    assert tiling.output_epsg(AOI, override=None) == 32721
+    assert tiling.output_epsg(AOI, override="EPSG:5641") == 5641
+    assert tiling.utm_zones(AOI) == [21]
+
+def test_output_epsg_refuses_multi_zone_aoi():
+    wide = gpd.GeoDataFrame(geometry=[box(-58.0, -10.0, -53.0, -6.0)], crs=4326)   # zones 21-22
+    assert tiling.utm_zones(wide) == [21, 22]
+    with pytest.raises(ValueError, match="OUTPUT_CRS"):
+        tiling.output_epsg(wide, override=None)
+    assert tiling.output_epsg(wide, override="EPSG:5641") == 5641
+
+def test_plan_tiles_covers_grid():
+    transform, width, height, tiles = tiling.plan_tiles(AOI, 32721, 30, tile_px=48)
+    assert (width, height) == (128, 128) and transform.c == 499_980 and transform.f == 9_000_000
+    assert len(tiles) == 9
+    assert sum(w.width * w.height for w, _ in tiles) == width * height
+
+def _tile_value(items, epsg, bounds):
+    # every pixel holds its tile's offset (row * 1000 + col), so placement can be checked
+    minx, miny, maxx, maxy = bounds
+    shape = (round((maxy - miny) / 30), round((maxx - minx) / 30))
+    offset = round((9_000_000 - maxy) / 30) * 1000 + round((minx - 499_980) / 30)
+    return xr.DataArray(np.full(shape, offset, dtype="float32"), dims=("y", "x"))
+
+def test_build_tiled_writes_every_tile(tmp_path, monkeypatch):
+    monkeypatch.setattr(tiling, "OUTPUT_CRS", None)
+    out = tiling.build_tiled([SCENE], AOI, tmp_path / "ndvi.tif", _tile_value, tile_px=48, workers=2)
+    with rasterio.open(out) as src:
+        data = src.read(1)
+    assert data.shape == (128, 128) and np.isfinite(data).all()
+    assert (data[0, 0], data[50, 100], data[-1, -1]) == (0, 48_096, 96_096)
+    assert list(tmp_path.iterdir()) == [out]
+
+def test_build_tiled_removes_scratch_on_failure(tmp_path):
+    calls = []
+    def flaky(items, epsg, bounds):
+        calls.append(bounds)
+        if len(calls) == 2:
+            raise RuntimeError("tile read failed")
+        return _tile_value(items, epsg, bounds)
+
+    with pytest.raises(RuntimeError, match="tile read failed"):
+        tiling.build_tiled([SCENE], AOI, tmp_path / "ndvi.tif", flaky, tile_px=48, workers=1,
+                           grid={"epsg": 32721, "transform": [30, 0, 499_980, 0, -30, 9_000_000],
+                                 "width": 128, "height": 128})
+    assert list(tmp_path.iterdir()) == []
+    assert len(calls) < 9  # queued tiles were cancelled
@@ -0,0 +1,56 @@
+# tests/test_timeseries.py
+import numpy as np
+import rasterio
+from pyproj import Transformer
+from rasterio.transform import from_origin
+from shapely.geometry import box, mapping
+from shapely.ops import transform as shp_transform
+
+import timeseries
+
+X0, Y0, RES = 499_980.0, 9_000_000.0, 30.0
+NODATA = -9999.0
+_to_lonlat = Transformer.from_crs("EPSG:32721", "EPSG:4326", always_xy=True).transform
+
+def _values(year):
+    v = (np.arange(20 * 20, dtype="float32").reshape(20, 20) + (year - 2000) * 1000) / 1000
+    v[3, 4] = NODATA
+    return v
+
+def _archive(tmp_path, monkeypatch, years=(2020, 2021)):
+    for year in years:
+        with rasterio.open(tmp_path / f"ndvi_median_{year}.tif", "w", driver="GTiff", width=20, height=20, count=1,
+                           dtype="float32", crs="EPSG:32721", transform=from_origin(X0, Y0, RES, RES),
+                           nodata=NODATA) as dst:
+            dst.write(_values(year), 1)
+    monkeypatch.setattr(timeseries, "level_dir", lambda level=None: tmp_path)
+    monkeypatch.setattr(timeseries, "_index", {})
+
+def test_point_series(tmp_path, monkeypatch):
+    _archive(tmp_path, monkeypatch)
+    lon, lat = _to_lonlat(X0 + RES * 7.5, Y0 - RES * 2.5)          # centre of row 2, col 7
+    got = timeseries.point_series(lon, lat)
+    assert got["year"].tolist() == [2020, 2021]
+    np.testing.assert_allclose(got["ndvi"], [_values(2020)[2, 7], _values(2021)[2, 7]])
+
+    lon, lat = _to_lonlat(X0 + RES * 4.5, Y0 - RES * 3.5)          # nodata pixel
+    assert timeseries.point_series(lon, lat)["ndvi"].isna().all()
+    lon, lat = _to_lonlat(X0 - RES * 5, Y0)                        # off the raster
+    assert timeseries.point_series(lon, lat)["ndvi"].isna().all()
+
+def test_polygon_series(tmp_path, monkeypatch):
+    _archive(tmp_path, monkeypatch)
+    # Rows 1-4, cols 2-5: edges fall mid-pixel, so the window must round outward.
+    poly = box(X0 + RES * 2 + 10, Y0 - RES * 5 + 10, X0 + RES * 6 - 10, Y0 - RES * 1 - 10)
+    got = timeseries.polygon_series(mapping(shp_transform(_to_lonlat, poly))).set_index("year")
+
+    for year in (2020, 2021):
+        block = _values(year)[1:5, 2:6]
+        vals = block[block != NODATA]                              # (3, 4) is inside and masked
+        row = got.loc[year]
+        assert row["total_px"] == 16 and row["valid_px"] == 15
+        np.testing.assert_allclose([row["mean"], row["median"]], [vals.mean(), np.median(vals)], rtol=1e-6)
+
+    far = box(X0 - RES * 40, Y0 + RES * 10, X0 - RES * 30, Y0 + RES * 20)
+    got = timeseries.polygon_series(mapping(shp_transform(_to_lonlat, far)))
+    assert (got["total_px"] == 0).all() and got["mean"].isna().all()